@@ -1,13 +1,30 @@
 # !/usr/bin/env python
 # -*- coding: utf-8 -*-
 """API functions."""
+import hmac
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from typing import Tuple
+
 from flask import Blueprint
 from flask import current_app
+from flask import Flask
 from flask import jsonify
 from flask import request
+from flask import Response
+from flask import url_for
+
+from app.db import get_db
+from app.db import NDJSON_CONTENT_TYPES
+from app.db import queue_api_import
+from app.db import run_api_import
+from app.models import Import
 
 
 blueprint = Blueprint("v1", __name__)
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
 
 
 @blueprint.route("/")
@@ -17,95 +34,94 @@ def index() -> dict:
 
 
 @blueprint.route("/add_data", methods=["POST"])
-def add_data() -> str:
+def add_data() -> Tuple[Response, int]:
     """Add data via an API endpoint to the database.
 
+    The body is a JSON list of entries or, with the content type
+    `application/x-ndjson`, one entry per line. It is stored as an `Import`
+    and processed by a pool of `API_IMPORT_WORKERS` threads, the response
+    (202) links to its state at `/imports/<id>`. With `API_IMPORT_WORKERS`
+    set to 0 the body is processed right away. The `X-API-Key` header must
+    match `API_TOKEN`.
+
     Required: doi
-    Optional: url, date
+    Optional: url with url_type, date (YYYY-MM-DD)
+
+    See :func:`app.db.import_dois_from_api` for the processing.
     """
-    # TODO: merge with index or remove /add_data url from blueprint
-    response_status = "error"
-    url_type_list = [
-        "ojs",
-        "doi_new",
-        "doi_old",
-        "doi_new_landingpage",
-        "unpaywall",
-        "pubmed",
-        "pubmedcentral",
-    ]
-
-    json_data = request.get_json()
-    # token = json_data["token"]
-
-    if request.method == "POST":
+    rejected = check_api_key()
+    if rejected:
+        return rejected
+    if request.mimetype != "application/json" and (
+        request.mimetype not in NDJSON_CONTENT_TYPES
+    ):
+        return error_response("No JSON delivered.", 415)
+    try:
+        body = request.get_data().decode("utf-8")
+    except UnicodeDecodeError:
+        return error_response("Body is not UTF-8 encoded.", 400)
+
+    db_imp = queue_api_import(body, request.mimetype)
+    workers = current_app.config.get("API_IMPORT_WORKERS")
+    if not workers:
+        content = run_api_import(db_imp.id)
+        if content["status"] == "failed":
+            return error_response(content["message"], 400)
+        return jsonify({"status": "ok", "content": content}), 200
+
+    get_import_executor(workers).submit(
+        _run_import, current_app._get_current_object(), db_imp.id
+    )
+    content = {
+        "import_id": db_imp.id,
+        "status": db_imp.status,
+        "url": url_for("v1.import_status", import_id=db_imp.id),
+    }
+    return jsonify({"status": "ok", "content": content}), 202
+
+
+@blueprint.route("/imports/<int:import_id>")
+def import_status(import_id: int) -> Tuple[Response, int]:
+    """Get the state of an import: status, progress, counts and errors."""
+    rejected = check_api_key()
+    if rejected:
+        return rejected
+    db_imp = get_db().session.query(Import).get(import_id)
+    if db_imp is None:
+        return error_response("Import {0} not found.".format(import_id), 404)
+    return jsonify({"status": "ok", "content": db_imp.to_dict()}), 200
+
+
+def check_api_key() -> Optional[Tuple[Response, int]]:
+    """Get the error response, if the `X-API-Key` header is not right."""
+    token = current_app.config.get("API_TOKEN") or ""
+    if "X-API-Key" not in request.headers:
+        return error_response("Authentication token not passed.", 401)
+    if not token or not hmac.compare_digest(
+        request.headers["X-API-Key"].encode("utf-8"), token.encode("utf-8")
+    ):
+        return error_response("Authentication token not right.", 401)
+    return None
+
+
+def error_response(message: str, status_code: int) -> Tuple[Response, int]:
+    return jsonify({"status": "error", "content": message}), status_code
+
+
+def get_import_executor(max_workers: int) -> ThreadPoolExecutor:
+    """Get the thread pool processing the imports, shared by all requests."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="api-import"
+            )
+        return _executor
+
+
+def _run_import(app: Flask, import_id: int) -> None:
+    with app.app_context():
         try:
-            if "X-API-Key" in request.headers:
-                if current_app.config["API_TOKEN"] == request.headers["X-API-Key"]:
-                    if request.headers["Content-Type"] == "application/json":
-                        json_data = request.get_json()
-                        if isinstance(json_data, list):
-                            is_data_valid = True
-                            for entry in json_data:
-                                # Validate entry
-                                if "doi" in entry:
-                                    if not isinstance(entry["doi"], str):
-                                        response = "DOI {} is no string.".format(
-                                            entry["doi"]
-                                        )
-                                        is_data_valid = False
-                                    if "url" in entry:
-                                        if not isinstance(entry["url"], str):
-                                            response = "URL {} is no string.".format(
-                                                entry["url"]
-                                            )
-                                            is_data_valid = False
-                                    else:
-                                        print("URL is missing")
-                                        is_data_valid = False
-                                    if "url_type" in entry:
-                                        if not isinstance(entry["url_type"], str):
-                                            response = "URL type {} is no string.".format(
-                                                entry["url_type"]
-                                            )
-                                            is_data_valid = False
-                                        if entry["url_type"] not in url_type_list:
-                                            response = "URL type {} is not one of the allowed types.".format(
-                                                entry["url_type"]
-                                            )
-                                            is_data_valid = False
-                                        else:
-                                            response = "URL type is missing."
-                                            is_data_valid = False
-                                    if "date" in entry:
-                                        if not isinstance(entry["date"], str):
-                                            response = "Date {} is no string.".format(
-                                                entry["date"]
-                                            )
-                                            is_data_valid = False
-                                    else:
-                                        response = "Date is missing."
-                                        is_data_valid = False
-                                else:
-                                    is_data_valid = False
-                                    response = "DOI is missing in {}.".format(entry)
-                            if is_data_valid:
-                                # TODO: import_dois_from_api
-                                resp_func = import_dois_from_api(data)
-                                if resp_func:
-                                    response = resp_func
-                                    response_status = "ok"
-                                else:
-                                    response = "Error: JSON from API could not be stored in database."
-                        else:
-                            response = "No list of data in JSON."
-                    else:
-                        response = "No JSON delivered."
-                else:
-                    response = "Authentication token not right."
-            else:
-                response = "Authentication token not passed."
-        except:
-            raise ("Undefined error.")
-
-        return jsonify({"status": response_status, "content": response})
+            run_api_import(import_id)
+        except Exception:
+            app.logger.exception("Import {0} could not be run.".format(import_id))
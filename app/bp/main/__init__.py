@@ -7,12 +7,7 @@ from flask import render_template
 from flask_sqlalchemy import get_debug_queries
 from requests import Response
 
-from app.db import get_db
-from app.models import Doi
-from app.models import FBRequest
-from app.models import Import
-from app.models import Request
-from app.models import Url
+from app.db import get_stats
 
 
 blueprint = Blueprint("main", __name__)
@@ -28,47 +23,7 @@ def index() -> str:
 @blueprint.route("/stats")
 def stats() -> str:
     """Statistics."""
-    db = get_db()
-    data = {
-        "imports": db.session.query(Import).count(),
-        "dois": {
-            "num": db.session.query(Doi).count(),
-            "new": db.session.query(Doi).filter(Doi.url_doi_new == True).count(),
-            "old": db.session.query(Doi).filter(Doi.url_doi_old == True).count(),
-            "lp": db.session.query(Doi).filter(Doi.url_doi_lp == True).count(),
-            "ncbi": db.session.query(Doi).filter(Doi.url_ncbi == True).count(),
-            "pmc": db.session.query(Doi).filter(Doi.url_pmc == True).count(),
-            "pm": db.session.query(Doi).filter(Doi.url_pm == True).count(),
-            "unpaywall": db.session.query(Doi)
-            .filter(Doi.url_unpaywall == True)
-            .count(),
-        },
-        "urls": {
-            "num": db.session.query(Url).count(),
-            "new": db.session.query(Url).filter(Url.url_type == "doi_new").count(),
-            "old": db.session.query(Url).filter(Url.url_type == "doi_old").count(),
-            "lp": db.session.query(Url).filter(Url.url_type == "doi_lp").count(),
-            "pm": db.session.query(Url).filter(Url.url_type == "pm").count(),
-            "pmc": db.session.query(Url).filter(Url.url_type == "pmc").count(),
-            "unpaywall": db.session.query(Url)
-            .filter(Url.url_type == "unpaywall")
-            .count(),
-            "ojs": db.session.query(Url).filter(Url.url_type == "ojs").count(),
-        },
-        "requests": {
-            "num": db.session.query(Request).count(),
-            "lp": db.session.query(Request)
-            .filter(Request.request_type == "doi_lp")
-            .count(),
-            "ncbi": db.session.query(Request)
-            .filter(Request.request_type == "ncbi")
-            .count(),
-            "unpaywall": db.session.query(Request)
-            .filter(Request.request_type == "unpaywall")
-            .count(),
-        },
-        "fbrequests": db.session.query(FBRequest).count(),
-    }
+    data = get_stats()
     return render_template("stats.html", title="Statistics", data=data)
 
 
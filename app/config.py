@@ -14,15 +14,54 @@ class BaseConfig(BaseSettings):
     FLASK_ENV: str
     SQLALCHEMY_DATABASE_URI: str = ""
     SECRET_KEY: str = ""
+    API_TOKEN: str = ""
+    API_MAX_ENTRIES: int = 100000
+    API_IMPORT_WORKERS: int = 2
     ADMIN_EMAIL: str = ""
     APP_EMAIL: str = ""
     NCBI_TOOL: str = ""
+    NCBI_API_KEY: str = ""
+    NCBI_RATELIMIT: float = 3.0
+    NCBI_API_KEY_RATELIMIT: float = 10.0
+    NCBI_CONCURRENCY: int = 10
+    UNPAYWALL_RATELIMIT: float = 10.0
+    UNPAYWALL_CONCURRENCY: int = 10
+    UNPAYWALL_CACHE_TTL: float = 30 * 24 * 3600
+    HOST_RATELIMIT: float = 5.0
     FB_API_TOKEN: str = ""
     FB_APP_ID: str = ""
     FB_APP_SECRET: str = ""
     FB_HOURLY_RATELIMIT: int = 200
     FB_BATCH_SIZE: int = 50
+    FB_CONCURRENCY: int = 4
+    FB_API_VERSION: str = "3.1"
+    FB_TOKEN_FILE: str = "data/fb-token.json"
+    FB_USAGE_THRESHOLD: float = 75.0
+    FB_SNAPSHOT_LIMIT: int = 10000
+    FB_SNAPSHOT_MIN_INTERVAL: float = 24 * 3600
+    FB_SNAPSHOT_MAX_INTERVAL: float = 90 * 24 * 3600
     URL_BATCH_SIZE: int = 1000
+    EXPORT_BATCH_SIZE: int = 100000
+    DEDUP_HASHED_KEYS: bool = False
+    DOI_URLS_SERVER_SIDE: bool = False
+    HTTP_BATCH_SIZE: int = 100
+    HTTP_CONCURRENCY: int = 20
+    HTTP_PER_HOST_CONCURRENCY: int = 5
+    HTTP_TIMEOUT: float = 30.0
+    HTTP_MAX_RETRIES: int = 3
+    HTTP_BACKOFF_FACTOR: float = 0.5
+    HTTP_CACHE_MODE: str = "off"
+    HTTP_CACHE_BACKEND: str = "sqlite"
+    HTTP_CACHE_PATH: str = "data/http-cache.sqlite"
+    HTTP_CACHE_MAX_SIZE: int = 1024 * 1024 * 1024
+    HTTP_CACHE_TTL: float = 7 * 24 * 3600
+    STATS_CACHE_TTL: float = 60.0
+    RESPONSE_COMPRESSION: str = "gzip"
+    RESPONSE_STORE: str = "db"
+    RESPONSE_SEGMENT_DIR: str = "data/segments"
+    RESPONSE_SEGMENT_SIZE: int = 256 * 1024 * 1024
+    LP_BODY_POLICY: str = "full"
+    LP_BODY_HEAD_SIZE: int = 8192
     FLASK_DEBUG: bool = False
     TESTING: bool = False
     TRAVIS: bool = False
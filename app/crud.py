@@ -1,12 +1,19 @@
 # !/usr/bin/env python
 # -*- coding: utf-8 -*-
 """"""
+from typing import Any
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
 from typing import Type
 from typing import Union
 
+from sqlalchemy import inspect
 from sqlalchemy.orm import Session
 from sqlalchemy.orm.query import Query
 
+from app.models import BULK_BATCH_SIZE
 from app.models import Doi
 from app.models import FBRequest
 from app.models import Import
@@ -18,10 +25,13 @@ DatabaseModelTypes = Type[Union[Import, Doi, Url, Request, FBRequest]]
 
 
 def get_all(
-    db: Session, model: DatabaseModelTypes, skip: int = 0, limit: int = 100,
+    db: Session, model: DatabaseModelTypes, skip: int = 0, limit: Optional[int] = None,
 ) -> Query:
     """Get all entries of a model.
 
+    This loads all entries into memory. Use :func:`iter_all` to walk
+    through big tables.
+
     Parameters
     ----------
     db : Session
@@ -31,15 +41,99 @@ def get_all(
     skip : int, optional
         Number of entries to be skipped.
     limit : int, optional
-        Number of entries to be limited to.
+        Number of entries to be limited to. Defaults to `None`, no limit.
 
     Returns
     -------
     Query
         Query result.
     """
+    query = db.session.query(model).offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def iter_batches(
+    db: Session,
+    model: DatabaseModelTypes,
+    columns: Optional[Sequence[str]] = None,
+    chunk_size: int = 1000,
+    filters: Sequence[Any] = (),
+    after: Any = None,
+) -> Iterator[List[Any]]:
+    """Iterate over all entries of a model in batches.
+
+    Uses keyset pagination on the primary key: each batch is one query
+    ``WHERE pk > <last pk> ORDER BY pk LIMIT <chunk_size>``, so only one
+    batch is held in memory and every query is an index range scan, no
+    matter how deep into the table it is. Entries can be updated while
+    iterating.
 
-    return db.session.query(model).offset(skip).limit(limit).all()
+    Parameters
+    ----------
+    db : Session
+        SQLAlchemy session.
+    model : BaseModel
+        model
+    columns : list, optional
+        Names of the columns to be returned. If passed, bare tuples of the
+        column values are returned instead of model instances.
+    chunk_size : int, optional
+        Number of entries per batch. Defaults to `1000`.
+    filters : list, optional
+        SQLAlchemy filter expressions.
+    after : optional
+        Primary key to start after, e. g. to resume an iteration.
+
+    Yields
+    ------
+    list
+        Batch of model instances or column tuples.
+    """
+    pk = inspect(model).primary_key[0]
+    if columns:
+        entities = [getattr(model, col) for col in columns] + [pk]
+    else:
+        entities = [model]
+
+    last = after
+    while True:
+        query = db.session.query(*entities).filter(*filters)
+        if last is not None:
+            query = query.filter(pk > last)
+        rows = query.order_by(pk).limit(chunk_size).all()
+        if not rows:
+            return
+        if columns:
+            last = rows[-1][-1]
+            yield [tuple(row[:-1]) for row in rows]
+        else:
+            last = getattr(rows[-1], pk.key)
+            yield rows
+        if len(rows) < chunk_size:
+            return
+
+
+def iter_all(
+    db: Session,
+    model: DatabaseModelTypes,
+    columns: Optional[Sequence[str]] = None,
+    chunk_size: int = 1000,
+    filters: Sequence[Any] = (),
+    after: Any = None,
+) -> Iterator[Any]:
+    """Iterate lazily over all entries of a model.
+
+    See :func:`iter_batches` for the parameters.
+
+    Yields
+    ------
+    BaseModel or tuple
+        Model instance or tuple of column values.
+    """
+    for batch in iter_batches(db, model, columns, chunk_size, filters, after):
+        yield from batch
 
 
 def get_first(db: Session, model: DatabaseModelTypes, kwargs: dict) -> Query:
@@ -98,12 +192,50 @@ def create_entities(
     iterable : list
         Iterable entries.
     kwargs : dict, optional
+        Passed on to :meth:`BaseModel.bulk_create`, e. g. `commit`.
 
     Returns
     -------
-    BaseModel
-        model after entries are created.
+    list
+        Entries created.
 
     """
     db_entities = model.bulk_create(db, iterable, **kwargs)
     return db_entities
+
+
+def insert_entities(
+    db: Session, model: DatabaseModelTypes, rows: list, kwargs: dict = {},
+) -> int:
+    """Insert many entries of a model from dictionaries.
+
+    Much faster than :func:`create_entities`, as the rows are sent with
+    :meth:`BaseModel.bulk_insert` in batches, without model instances.
+
+    Parameters
+    ----------
+    db : Session
+        SQLAlchemy session.
+    model : BaseModel
+        model
+    rows : list
+        Dictionaries with the column names as keys.
+    kwargs : dict, optional
+        `commit` (default `True`), `batch_size` and `on_conflict_do_nothing`,
+        see :meth:`BaseModel.bulk_insert`.
+
+    Returns
+    -------
+    int
+        Number of entries inserted.
+
+    """
+    num_inserted = model.bulk_insert(
+        db,
+        rows,
+        batch_size=kwargs.get("batch_size", BULK_BATCH_SIZE),
+        on_conflict_do_nothing=kwargs.get("on_conflict_do_nothing", False),
+    )
+    if kwargs.get("commit", True) is True:
+        db.session.commit()
+    return num_inserted
@@ -1,38 +1,157 @@
 # !/usr/bin/env python
 # -*- coding: utf-8 -*-
 """Database functions."""
+import asyncio
 import os
+import time
 from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from io import BytesIO
+from itertools import islice
 from json import dumps
+from json import loads
 from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
 from urllib.parse import quote
 
 from flask import g
 from flask_sqlalchemy import SQLAlchemy
+from pandas import DataFrame
 from pandas import read_csv
+from pandas import to_datetime
+from pandas.api.types import is_datetime64_any_dtype
+from sqlalchemy import case
+from sqlalchemy import func
+from sqlalchemy import text
 from tqdm import tqdm
 
 from app.config import get_config_class
-from app.crud import create_entities
 from app.crud import create_entity
-from app.crud import get_all
+from app.crud import insert_entities
+from app.crud import iter_all
+from app.crud import iter_batches
+from app.models import Checkpoint
 from app.models import db
 from app.models import Doi
 from app.models import FBRequest
+from app.models import FBState
 from app.models import Import
 from app.models import Request
+from app.models import ResponseBody
 from app.models import Url
-from app.requests import get_graph_api
-from app.requests import get_graph_api_token
-from app.requests import get_graph_api_urls
-from app.requests import request_doi_landingpage
-from app.requests import request_ncbi_api
-from app.requests import request_unpaywall_api
+from app.requests import app_usage
+from app.requests import AsyncFetcher
+from app.requests import CacheSettings
+from app.requests import FB_GRAPH_URL
+from app.requests import FB_TOKEN_ERRORS
+from app.requests import fetch_graph_objects
+from app.requests import FetchResult
+from app.requests import get_graph_api_access_token
+from app.requests import graph_api_error_code
+from app.requests import HTTPCache
+from app.requests import ncbi_idconv_url
+from app.requests import NCBI_MAX_IDS
+from app.requests import ncbi_params
+from app.requests import pace_graph_api
+from app.requests import print_fetcher_stats
+from app.requests import register_cache_backend
+from app.requests import run_async
+from app.requests import unpaywall_url
+from app.storage import get_segment_store
+from app.storage import SegmentStore
 from app.utils import is_valid_doi
+from app.utils import iter_json_array
+from app.utils import iter_ndjson
+from app.utils import KeyIndex
+from app.utils import normalize_doi
+from app.utils import pyarrow
+from app.utils import PYARROW_MISSING
+from app.utils import StepTimer
+from app.utils import validate_doi_series
 
 
 DATABASE = db
+# URL's or DOI's written by another process in the meantime are skipped.
+IGNORE_CONFLICTS = {"on_conflict_do_nothing": True}
+# url_type: URL prefix, quote DOI, flag of Doi
+DOI_URL_TYPES = {
+    "doi_new": ("https://doi.org/", False, "url_doi_new"),
+    "doi_old": ("http://dx.doi.org/", True, "url_doi_old"),
+}
+# Characters kept by urllib.parse.quote(), which quotes "~" before Python 3.7.
+URL_QUOTE_SAFE = "A-Za-z0-9_.~/-" if quote("~") == "~" else "A-Za-z0-9_./-"
+PG_URL_QUOTE_FUNCTION = r"""
+CREATE OR REPLACE FUNCTION fhe_url_quote(doi text) RETURNS text AS $$
+    SELECT CASE WHEN doi ~ '^[SAFE]*$' THEN doi ELSE (
+        SELECT string_agg(
+            CASE WHEN ch ~ '^[SAFE]$' THEN ch ELSE upper(regexp_replace(
+                encode(convert_to(ch, 'UTF8'), 'hex'), '(..)', '%\1', 'g'
+            )) END,
+            '' ORDER BY pos
+        )
+        FROM regexp_split_to_table(doi, '') WITH ORDINALITY AS chars(ch, pos)
+    ) END
+$$ LANGUAGE sql IMMUTABLE STRICT
+""".replace(
+    "SAFE", URL_QUOTE_SAFE
+)
+# What is stored of a landing page: nothing, the final URL and headers, the
+# first `LP_BODY_HEAD_SIZE` bytes or the full body.
+LP_BODY_POLICIES = ("none", "headers", "head", "full")
+# The stages commit each batch together with its checkpoint.
+BATCH_KWARGS = {"commit": False}
+IGNORE_BATCH_KWARGS = {"commit": False, "on_conflict_do_nothing": True}
+# file extension: format read with pyarrow, others are read as CSV
+ARROW_EXTENSIONS = {
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+}
+# url_type's of URL's posted to the API
+API_URL_TYPES = (
+    "ojs",
+    "doi_new",
+    "doi_old",
+    "doi_lp",
+    "pm",
+    "pmc",
+    "unpaywall:doi",
+    "unpaywall:pdf",
+    "unpaywall:url",
+    "unpaywall:landing_page",
+)
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/jsonl")
+# key of the statistics: Doi flag, url_type of Url and request_type of Request
+STATS_DOI_FLAGS = {
+    "new": "url_doi_new",
+    "old": "url_doi_old",
+    "lp": "url_doi_lp",
+    "ncbi": "url_ncbi",
+    "pmc": "url_pmc",
+    "pm": "url_pm",
+    "unpaywall": "url_unpaywall",
+}
+STATS_URL_TYPES = {
+    "new": "doi_new",
+    "old": "doi_old",
+    "lp": "doi_lp",
+    "pm": "pm",
+    "pmc": "pmc",
+    "unpaywall": "unpaywall",
+    "ojs": "ojs",
+}
+STATS_REQUEST_TYPES = {"lp": "doi_lp", "ncbi": "ncbi", "unpaywall": "unpaywall"}
+# database URI: time computed, statistics
+_stats_cache: Dict[str, Tuple[float, dict]] = {}
 
 
 def get_config() -> Any:
@@ -79,6 +198,287 @@ def drop_db() -> None:
     """Drop database."""
     database = get_db()
     database.drop_all()
+    g.pop("doi_index", None)
+    g.pop("url_index", None)
+
+
+def get_doi_index() -> KeyIndex:
+    """Get the DOI index shared by all pipeline stages.
+
+    The index is loaded once from the database and then kept in the
+    application context. Stages add the DOI's they write to it.
+    """
+    if "doi_index" not in g:
+        config = get_config()
+        g.doi_index = KeyIndex(
+            (doi for doi, in iter_all(get_db(), Doi, columns=["doi"])),
+            hashed=config.DEDUP_HASHED_KEYS,
+        )
+    return g.doi_index
+
+
+def get_url_index() -> KeyIndex:
+    """Get the URL index shared by all pipeline stages.
+
+    The index is loaded once from the database and then kept in the
+    application context. Stages add the URL's they write to it.
+    """
+    if "url_index" not in g:
+        config = get_config()
+        g.url_index = KeyIndex(
+            (url for url, in iter_all(get_db(), Url, columns=["url"])),
+            hashed=config.DEDUP_HASHED_KEYS,
+        )
+    return g.url_index
+
+
+def get_checkpoint(stage: str, restart: bool = False) -> Checkpoint:
+    """Get the checkpoint of a pipeline stage.
+
+    A checkpoint of a finished run, or with `restart=True` any checkpoint,
+    is reset, so the stage starts from the beginning.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage.
+    restart : bool, optional
+        Ignore the progress saved, by default False
+
+    Returns
+    -------
+    Checkpoint
+        Checkpoint of the stage.
+    """
+    db = get_db()
+    checkpoint = db.session.query(Checkpoint).get(stage)
+    if checkpoint is None:
+        checkpoint = Checkpoint(stage=stage)
+        db.session.add(checkpoint)
+    if restart or checkpoint.status != "running":
+        checkpoint.reset()
+    db.session.commit()
+    return checkpoint
+
+
+def add_response(responses: dict, content: str, compression: str) -> str:
+    """Add a response body to the rows of a batch and return its hash.
+
+    Bodies already in the batch are compressed only once. Bodies already in
+    the database are skipped, when the batch is written with
+    `on_conflict_do_nothing`.
+    """
+    response_hash = ResponseBody.hash_content(content)
+    if response_hash not in responses:
+        responses[response_hash] = ResponseBody.make_row(content, compression)
+    return response_hash
+
+
+def get_response_store() -> Optional[SegmentStore]:
+    """Get the segment store for response bodies.
+
+    `None`, if the bodies are stored in the database.
+    """
+    config = get_config()
+    if config.RESPONSE_STORE == "db":
+        return None
+    elif config.RESPONSE_STORE == "segments":
+        return get_segment_store(
+            config.RESPONSE_SEGMENT_DIR, config.RESPONSE_SEGMENT_SIZE
+        )
+    raise ValueError("Unknown response store {0}.".format(config.RESPONSE_STORE))
+
+
+def write_responses(
+    db: SQLAlchemy, responses: dict, store: Optional[SegmentStore] = None
+) -> int:
+    """Write the response bodies of a batch, which are not stored yet.
+
+    Parameters
+    ----------
+    db : SQLAlchemy
+        Database.
+    responses : dict
+        Rows of the bodies by hash, see :func:`add_response`.
+    store : SegmentStore, optional
+        Segment store the bodies are appended to. Default: in the database.
+
+    Returns
+    -------
+    int
+        Bytes stored.
+
+    """
+    if not responses:
+        return 0
+    existing = {
+        response_hash
+        for response_hash, in db.session.query(ResponseBody.hash).filter(
+            ResponseBody.hash.in_(list(responses))
+        )
+    }
+    rows = [row for key, row in responses.items() if key not in existing]
+    if store is not None:
+        for row in rows:
+            row["segment"], row["offset"] = store.append(row["body"])
+            row["body"] = None
+        store.flush()
+    insert_entities(db, ResponseBody, rows, IGNORE_BATCH_KWARGS)
+    return sum(row["stored_size"] for row in rows)
+
+
+def landingpage_body(result: FetchResult, policy: str, head_size: int) -> Optional[str]:
+    """Get the part of a landing page to store, see :data:`LP_BODY_POLICIES`."""
+    if policy == "none":
+        return None
+    elif policy == "headers":
+        return dumps(
+            {
+                "final_url": result.final_url,
+                "status": result.status,
+                "headers": result.headers,
+            },
+            sort_keys=True,
+        )
+    elif policy == "head":
+        return result.content[:head_size].decode("utf-8", errors="ignore")
+    elif policy == "full":
+        return result.text
+    raise ValueError("Unknown body policy {0}.".format(policy))
+
+
+def get_cached_responses(
+    db: SQLAlchemy,
+    request_type: str,
+    dois: List[str],
+    ttl: float,
+    store: Optional[SegmentStore] = None,
+) -> Dict[str, str]:
+    """Get the latest successful responses of DOI's, which are still fresh.
+
+    Parameters
+    ----------
+    db : SQLAlchemy
+        Database.
+    request_type : str
+        Type of the requests, e. g. `unpaywall`.
+    dois : list
+        DOI's to look up.
+    ttl : float
+        Seconds a response is fresh. `0` disables the cache.
+    store : SegmentStore, optional
+        Segment store of the response bodies.
+
+    Returns
+    -------
+    dict
+        Content of the responses by DOI.
+
+    """
+    if ttl <= 0 or not dois:
+        return {}
+    since = datetime.utcnow() - timedelta(seconds=ttl)
+    rows = (
+        db.session.query(Request.doi, ResponseBody)
+        .join(ResponseBody, Request.response_hash == ResponseBody.hash)
+        .filter(
+            Request.request_type == request_type,
+            Request.doi.in_(dois),
+            Request.response_status == "200",
+            Request.created_at >= since,
+        )
+        .order_by(Request.created_at)
+    )
+    return {doi: response.read(store) for doi, response in rows}
+
+
+class ReplayCache(HTTPCache):
+    """HTTP cache backend serving the recorded `Request` and `FBRequest` rows.
+
+    Used with `HTTP_CACHE_MODE=replay`, so the pipeline runs again from the
+    database without network access. The latest request of an URL is
+    served; landing page requests redirect to the `doi_lp` URL of their
+    DOI. Nothing is stored.
+    """
+
+    def __init__(self, config: Any = None) -> None:
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str, params: Optional[dict] = None) -> Optional[FetchResult]:
+        db = get_db()
+        if url == FB_GRAPH_URL and params:
+            fb_row = (
+                db.session.query(FBRequest)
+                .filter(FBRequest.url == params["id"])
+                .order_by(FBRequest.id.desc())
+                .first()
+            )
+            if fb_row is None or fb_row.response is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return FetchResult(url, 200, url, fb_row.response.encode("utf-8"), {})
+
+        row = (
+            db.session.query(Request)
+            .filter(Request.request_url == url)
+            .order_by(Request.id.desc())
+            .first()
+        )
+        if row is None:
+            self.misses += 1
+            return None
+        if row.response_hash is not None:
+            content = row.response.read(get_response_store())
+        else:
+            content = row.response_content or ""
+        final_url = url
+        if row.request_type == "doi_lp":
+            lp_url = (
+                db.session.query(Url.url)
+                .filter(Url.doi == row.doi, Url.url_type == "doi_lp")
+                .first()
+            )
+            if lp_url is not None:
+                final_url = lp_url[0]
+        self.hits += 1
+        status = int(row.response_status) if row.response_status else None
+        return FetchResult(url, status, final_url, content.encode("utf-8"), {})
+
+    def set(self, url: str, params: Optional[dict], result: FetchResult) -> None:
+        pass
+
+
+register_cache_backend("replay", ReplayCache)
+
+
+def count_pending_dois(flag: str) -> int:
+    """Count the DOI's, where `flag` is not set yet."""
+    return get_db().session.query(Doi).filter(Doi.pending(flag)).count()
+
+
+def iter_pending_dois(
+    db: SQLAlchemy, flag: str, batch_size: int, checkpoint: Optional[Checkpoint]
+) -> Iterator[List[Doi]]:
+    """Iterate over the DOI's, where `flag` is not set yet.
+
+    The DOI's are read in batches with keyset pagination over the partial
+    index of the flag, starting after the checkpoint, if one is passed.
+    """
+    after = checkpoint.last_key if checkpoint else None
+    return iter_batches(
+        db, Doi, chunk_size=batch_size, filters=[Doi.pending(flag)], after=after
+    )
+
+
+def commit_batch(
+    db: SQLAlchemy, checkpoint: Optional[Checkpoint], last_key: str, num_processed: int,
+) -> None:
+    """Commit the writes of a batch together with the progress of its stage."""
+    if checkpoint is not None:
+        checkpoint.advance(last_key, num_processed)
+    db.session.commit()
 
 
 def dev() -> None:
@@ -86,22 +486,67 @@ def dev() -> None:
     pass
 
 
-def import_basedata(filename: str, reset: bool = False) -> dict:
+def iter_basedata_chunks(filename: str, chunksize: int) -> Iterator[DataFrame]:
+    """Read a CSV, Parquet or Feather file in chunks.
+
+    The format is taken from the extension, see :data:`ARROW_EXTENSIONS`,
+    other files are read as CSV with all columns as strings. Parquet files
+    are read by record batches and Feather files are memory mapped, so
+    neither is loaded as a whole. Date columns of both come as datetime64.
+
+    Parameters
+    ----------
+    filename : str
+        Filename of the CSV, Parquet or Feather file.
+    chunksize : int
+        Number of rows per chunk.
+
+    Yields
+    ------
+    DataFrame
+        Chunk of the file.
+
+    """
+    file_format = ARROW_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+    if file_format is None:
+        yield from read_csv(filename, encoding="utf8", chunksize=chunksize, dtype=str)
+        return
+    if pyarrow is None:
+        raise ImportError(PYARROW_MISSING.format("Reading " + filename))
+    if file_format == "parquet":
+        batches = pyarrow.parquet.ParquetFile(filename).iter_batches(chunksize)
+    else:
+        table = pyarrow.feather.read_table(filename, memory_map=True)
+        batches = iter(table.to_batches(chunksize))
+    for batch in batches:
+        yield batch.to_pandas(date_as_object=False)
+
+
+def import_basedata(
+    filename: str, reset: bool = False, chunksize: Optional[int] = None
+) -> dict:
     """Import base data.
 
-    * preprocess data
-        * read csv to pandas df (header: doi,url,url_type,date_published)
-        * remove duplicates: doi, url
-        * na mit None befüllen
-        * validate doi
-        * OPTIONAL: trim whitespace of doi, url, url_type and date_published
-            fields => necessary? :OPTIONAL
-    * create import entry and save id
-    * if is_valid
-        * create list of dicts for dois and list of dicts for urls
-        * do bulk import of dois with batch_size
-        * create all dois and save ids in list of url dicts
-        * do bulk import of urls with batch_size
+    The file (CSV, Parquet or Feather, see :func:`iter_basedata_chunks`) is
+    streamed in chunks of `chunksize` rows, so the memory used stays bounded
+    by the chunk size and not by the size of the file.
+
+    * for each chunk (header: doi,url,url_type,date_published)
+        * normalize and validate the DOI's, see
+          :func:`app.utils.validate_doi_series`
+        * remove duplicates: rows of a DOI seen before, URL's seen before
+          (both also against earlier chunks). The DOI of a row with a
+          duplicate URL is still added.
+        * remove DOI's and URL's already in the database
+        * parse the dates of publication, DOI's without one are not added
+        * do bulk import of dois
+        * do bulk import of urls
+
+    All steps work on whole columns, only the rows written are turned into
+    dictionaries. The time spent in each step is printed and returned.
+
+    The raw data is not stored in the `Import` entry, as this would need the
+    whole file in memory. The file can be found via `Import.source`.
 
     Parameters
     ----------
@@ -109,11 +554,14 @@ def import_basedata(filename: str, reset: bool = False) -> dict:
         Filename to CSV to be imported.
     reset : bool, optional
         Resets database, by default False
+    chunksize : int, optional
+        Number of rows read and written at once, by default `URL_BATCH_SIZE`.
 
     Returns
     -------
     dict
-        Dictionary with number of DOI's added, number or URL's added and list of invalid DOI's.
+        Dictionary with number of DOI's added, number or URL's added, list of
+        invalid DOI's and the seconds spent in each step.
     """
     if reset:
         drop_db()
@@ -125,187 +573,657 @@ def import_basedata(filename: str, reset: bool = False) -> dict:
 
     db = get_db()
     config = get_config()
-    batch_size = config.URL_BATCH_SIZE
-    df = read_csv(filename, encoding="utf8")
-    json_str = df.to_json(orient="records")
-    df = df.drop_duplicates(subset="doi")
-    df = df.drop_duplicates(subset="url")
-    df = df.fillna(False)
-    data = df.to_dict(orient="records")
+    if not chunksize:
+        chunksize = config.URL_BATCH_SIZE
 
     imp_dict = {
         "source": "<INIT " + filename + ">",
-        "raw": json_str,
     }
     db_imp = create_entity(db, Import, imp_dict)
     import_id = db_imp.id
 
-    doi_list = [doi.doi for doi in get_all(db, Doi)]
-    url_list = [url.url for url in get_all(db, Url)]
-
-    for i in range(0, len(data), batch_size):
-        dois_added = []
-        urls_added = []
-        for d in tqdm(data[i : i + batch_size]):
-            """
-            d = {
-                'url': 'http://www.cjc-online.ca/index.php/journal/article/view/1208',
-                'doi': '10.22230/cjc.2001v26n1a1208',
-                'url_type': 'ojs',
-                'date_published': '2001-01-01',
-            }
-            """
-            if is_valid_doi(d["doi"]):
-                if d["doi"] not in doi_list:
-                    if d["doi"] and d["date_published"]:
-                        doi_dict = {
-                            "doi": d["doi"],
-                            "date_published": datetime.strptime(
-                                d["date_published"], "%Y-%m-%d"
-                            ),
-                            "import_id": import_id,
-                            "is_valid": True,
-                        }
-                        dois_added.append(doi_dict)
-                if d["url"] not in url_list:
-                    url_dict = {
-                        "url": d["url"],
-                        "doi": d["doi"],
-                        "url_type": d["url_type"],
-                    }
-                    urls_added.append(url_dict)
-            else:
-                dois_invalid.append(d["doi"])
-        create_entities(db, Doi, dois_added)
-        num_dois_added += len(dois_added)
-        create_entities(db, Url, urls_added)
-        num_urls_added += len(urls_added)
+    doi_index = get_doi_index()
+    url_index = get_url_index()
+    # DOI's seen in earlier chunks of this file, to keep the first row only.
+    dois_seen = KeyIndex()
+    timer = StepTimer()
+
+    chunks = iter_basedata_chunks(filename, chunksize)
+    while True:
+        with timer("read"):
+            df = next(chunks, None)
+        if df is None:
+            break
+
+        with timer("validate"):
+            dois, valid = validate_doi_series(df["doi"])
+            dois_invalid.extend(df["doi"][~valid].tolist())
+            df = df[valid].assign(doi=dois[valid])
+        with timer("dedup"):
+            df = df.drop_duplicates(subset="doi")
+            df = df[~dois_seen.contains_many(df["doi"])]
+            dois_seen.update(df["doi"].tolist())
+        with timer("filter"):
+            new_dois = df[~doi_index.contains_many(df["doi"])]
+            new_urls = df[df["url"].notna()].drop_duplicates(subset="url")
+            new_urls = new_urls[~url_index.contains_many(new_urls["url"])]
+        with timer("dates"):
+            published = new_dois["date_published"]
+            if not is_datetime64_any_dtype(published):
+                published = to_datetime(published, format="%Y-%m-%d", errors="coerce")
+            new_dois = new_dois.assign(date_published=published)
+            new_dois = new_dois[new_dois["date_published"].notna()]
+            # the URL's of DOI's skipped without a date would miss their DOI
+            new_urls = new_urls[
+                new_urls["doi"].isin(new_dois["doi"])
+                | doi_index.contains_many(new_urls["doi"])
+            ]
+        with timer("records"):
+            # datetime64 to datetime for the whole column at once
+            dates = new_dois["date_published"].values.astype("datetime64[us]")
+            dois_added = [
+                {
+                    "doi": doi,
+                    "date_published": date_published,
+                    "import_id": import_id,
+                    "is_valid": True,
+                }
+                for doi, date_published in zip(new_dois["doi"].tolist(), dates.tolist())
+            ]
+            urls_added = [
+                {
+                    "url": url,
+                    "doi": doi,
+                    "url_type": url_type if isinstance(url_type, str) else None,
+                }
+                for url, doi, url_type in zip(
+                    new_urls["url"].tolist(),
+                    new_urls["doi"].tolist(),
+                    new_urls["url_type"].tolist(),
+                )
+            ]
+        with timer("write"):
+            insert_entities(db, Doi, dois_added, IGNORE_CONFLICTS)
+            doi_index.update(d["doi"] for d in dois_added)
+            num_dois_added += len(dois_added)
+            insert_entities(db, Url, urls_added, IGNORE_CONFLICTS)
+            url_index.update(d["url"] for d in urls_added)
+            num_urls_added += len(urls_added)
     print("{0} doi's added to database.".format(num_dois_added))
     print("{0} url's added to database.".format(num_urls_added))
+    for step, duration in timer.durations.items():
+        print("{0:<10} {1:>8.2f}s".format(step, duration))
     return {
         "num_dois_added": num_dois_added,
         "num_urls_added": num_urls_added,
         "dois_invalid": dois_invalid,
+        "timings": timer.durations,
+    }
+
+
+def parse_api_entry(entry: Any) -> Tuple[dict, Optional[dict]]:
+    """Validate an entry posted to the API and get its DOI and URL.
+
+    Parameters
+    ----------
+    entry : Any
+        Entry with a `doi` and optionally an `url` with its `url_type` and
+        the `date` of publication as YYYY-MM-DD. The DOI is normalized with
+        :func:`app.utils.normalize_doi`.
+
+    Returns
+    -------
+    tuple
+        DOI and URL as dictionaries, the URL is `None` if not passed.
+
+    Raises
+    ------
+    ValueError
+        If the entry is not valid.
+
+    """
+    if not isinstance(entry, dict):
+        raise ValueError("Entry is no object.")
+    doi = entry.get("doi")
+    if not isinstance(doi, str):
+        raise ValueError("DOI is missing or no string.")
+    doi = normalize_doi(doi)
+    if not is_valid_doi(doi):
+        raise ValueError("DOI {0} is not valid.".format(doi))
+    doi_dict = {"doi": doi, "is_valid": True}
+
+    date = entry.get("date")
+    if date is not None:
+        if not isinstance(date, str):
+            raise ValueError("Date {0} is no string.".format(date))
+        try:
+            doi_dict["date_published"] = datetime.strptime(date, "%Y-%m-%d")
+        except ValueError:
+            raise ValueError("Date {0} is not YYYY-MM-DD.".format(date))
+
+    url = entry.get("url")
+    if url is None:
+        return doi_dict, None
+    if not isinstance(url, str):
+        raise ValueError("URL {0} is no string.".format(url))
+    if entry.get("url_type") not in API_URL_TYPES:
+        raise ValueError(
+            "URL type {0} is not one of the allowed types.".format(
+                entry.get("url_type")
+            )
+        )
+    return doi_dict, {"url": url, "doi": doi, "url_type": entry["url_type"]}
+
+
+def import_dois_from_api(
+    entries: Iterable[Any],
+    max_entries: Optional[int] = None,
+    db_imp: Optional[Import] = None,
+) -> dict:
+    """Import DOI's and URL's posted to the API.
+
+    All entries are validated in one pass, while they are parsed, see
+    :func:`parse_api_entry`. The valid ones are then inserted in one
+    transaction together with the `Import`, the first entry of a DOI or URL
+    wins and DOI's or URL's already stored are kept. Invalid entries are
+    reported by their position and do not stop the import.
+
+    Parameters
+    ----------
+    entries : Iterable
+        Entries, e. g. from :func:`app.utils.iter_json_array`.
+    max_entries : int, optional
+        Maximum number of entries, by default `API_MAX_ENTRIES`.
+    db_imp : Import, optional
+        Import to record the progress and the result in, by default a new
+        one is created.
+
+    Returns
+    -------
+    dict
+        Id of the import, number of entries, of DOI's and of URL's added and
+        the errors as list of `{"index": ..., "doi": ..., "error": ...}`.
+
+    Raises
+    ------
+    ValueError
+        If there are more than `max_entries` entries. Nothing is imported.
+
+    """
+    config = get_config()
+    db = get_db()
+    if max_entries is None:
+        max_entries = config.API_MAX_ENTRIES
+
+    dois: Dict[str, dict] = {}
+    urls: Dict[str, dict] = {}
+    errors = []
+    num_entries = 0
+    for index, entry in enumerate(entries):
+        if index == max_entries:
+            raise ValueError("More than {0} entries.".format(max_entries))
+        num_entries += 1
+        if db_imp is not None and num_entries % config.URL_BATCH_SIZE == 0:
+            db_imp.num_processed = num_entries
+            db_imp.updated_at = datetime.now(timezone.utc)
+            db.session.commit()
+        try:
+            doi_dict, url_dict = parse_api_entry(entry)
+        except ValueError as e:
+            doi = entry.get("doi") if isinstance(entry, dict) else None
+            errors.append({"index": index, "doi": doi, "error": str(e)})
+            continue
+        dois.setdefault(doi_dict["doi"], doi_dict)
+        if url_dict is not None:
+            urls.setdefault(url_dict["url"], url_dict)
+
+    if db_imp is None:
+        db_imp = Import(source="api")
+        db.session.add(db_imp)
+        db.session.flush()
+    for doi_dict in dois.values():
+        doi_dict["import_id"] = db_imp.id
+    num_dois_added = Doi.bulk_insert(
+        db, list(dois.values()), config.URL_BATCH_SIZE, on_conflict_do_nothing=True
+    )
+    num_urls_added = Url.bulk_insert(
+        db, list(urls.values()), config.URL_BATCH_SIZE, on_conflict_do_nothing=True
+    )
+    db_imp.status = "done"
+    db_imp.num_entries = num_entries
+    db_imp.num_processed = num_entries
+    db_imp.num_dois_added = num_dois_added
+    db_imp.num_urls_added = num_urls_added
+    db_imp.errors = dumps(errors)
+    db_imp.updated_at = datetime.now(timezone.utc)
+    db.session.commit()
+    return {
+        "import_id": db_imp.id,
+        "num_entries": num_entries,
+        "num_dois_added": num_dois_added,
+        "num_urls_added": num_urls_added,
+        "errors": errors,
     }
 
 
-def create_doi_new_urls() -> None:
+def queue_api_import(body: str, content_type: str) -> Import:
+    """Store a body posted to the API as a queued `Import`.
+
+    It is processed by :func:`run_api_import`.
+    """
+    db = get_db()
+    return create_entity(
+        db,
+        Import,
+        {
+            "source": "api",
+            "raw": body,
+            "content_type": content_type,
+            "status": "queued",
+        },
+    )
+
+
+def run_api_import(import_id: int) -> dict:
+    """Process a queued `Import` posted to the API.
+
+    The body is parsed as NDJSON, if its content type says so, otherwise as
+    JSON list. If the import fails, e. g. with invalid JSON or too many
+    entries, nothing is imported and the import is marked as failed with
+    the reason in `message`. As the state is kept in the database, imports
+    left queued by a stopped worker can be run again.
+
+    Returns
+    -------
+    dict
+        State of the import, see :meth:`Import.to_dict`.
+    """
+    db = get_db()
+    db_imp = db.session.query(Import).get(import_id)
+    db_imp.status = "running"
+    db_imp.num_processed = 0
+    db_imp.updated_at = datetime.now(timezone.utc)
+    db.session.commit()
+
+    stream = BytesIO(db_imp.raw.encode("utf-8"))
+    if db_imp.content_type in NDJSON_CONTENT_TYPES:
+        entries = iter_ndjson(stream)
+    else:
+        entries = iter_json_array(stream)
+    try:
+        import_dois_from_api(entries, db_imp=db_imp)
+    except Exception as e:
+        db.session.rollback()
+        db_imp.status = "failed"
+        db_imp.message = str(e)
+        db_imp.updated_at = datetime.now(timezone.utc)
+        db.session.commit()
+    return db_imp.to_dict()
+
+
+def create_doi_new_urls(
+    checkpoint: Optional[Checkpoint] = None, server_side: Optional[bool] = None
+) -> dict:
     """Create URL's from the identifier.
 
     Creates the DOI URL's as part of the pre-processing.
 
+    Parameters
+    ----------
+    checkpoint : Checkpoint, optional
+        Checkpoint to resume from and to save the progress in.
+    server_side : bool, optional
+        Create the URL's inside the database, see
+        :func:`create_doi_urls_server_side`. Defaults to
+        `DOI_URLS_SERVER_SIDE`.
+
+    Returns
+    -------
+    dict
+        Number of DOI's processed and URL's added.
+
     """
+    num_dois = 0
     num_urls_added = 0
-    urls_added = []
 
     db = get_db()
     config = get_config()
     batch_size = config.URL_BATCH_SIZE
+    if server_side is None:
+        server_side = config.DOI_URLS_SERVER_SIDE
+    if server_side:
+        return create_doi_urls_server_side("doi_new", checkpoint)
 
-    url_list = [url.url for url in get_all(db, Url)]
+    url_index = get_url_index()
 
     # get all DOIs, where url_doi_new = False
-    list_dois = Doi.query.filter(Doi.url_doi_new is False).all()
-    print("Found DOI's: {0}".format(len(list_dois)))
+    print("Found DOI's: {0}".format(count_pending_dois("url_doi_new")))
 
-    for i in range(0, len(list_dois), batch_size):
+    for batch in tqdm(iter_pending_dois(db, "url_doi_new", batch_size, checkpoint)):
         db_urls_added = []
-        for row in tqdm(list_dois[i : i + batch_size]):
+        batch_urls: Set[str] = set()
+        for row in batch:
             url = "https://doi.org/{0}".format(row.doi)
-            if url not in url_list and url not in urls_added:
+            # the URL exists afterwards, whether it's added now or not
+            row.url_doi_new = True
+            if url not in url_index and url not in batch_urls:
                 url_dict = {"url": url, "doi": row.doi, "url_type": "doi_new"}
-                row.url_doi_new = True
-                urls_added.append(url_dict["url"])
+                batch_urls.add(url)
                 db_urls_added.append(url_dict)
-        create_entities(db, Url, db_urls_added)
+        insert_entities(db, Url, db_urls_added, IGNORE_BATCH_KWARGS)
+        commit_batch(db, checkpoint, batch[-1].doi, len(batch))
+        url_index.update(batch_urls)
+        num_dois += len(batch)
         num_urls_added += len(db_urls_added)
     print('{0} "New DOI" URL\'s added to database.'.format(num_urls_added))
+    return {"num_processed": num_dois, "num_urls_added": num_urls_added}
 
 
-def create_doi_old_urls() -> None:
+def create_doi_old_urls(
+    checkpoint: Optional[Checkpoint] = None, server_side: Optional[bool] = None
+) -> dict:
     """Create URL's from the identifier.
 
     Creates the DOI URL's as part of the pre-processing.
 
+    Parameters
+    ----------
+    checkpoint : Checkpoint, optional
+        Checkpoint to resume from and to save the progress in.
+    server_side : bool, optional
+        Create the URL's inside the database, see
+        :func:`create_doi_urls_server_side`. Defaults to
+        `DOI_URLS_SERVER_SIDE`.
+
+    Returns
+    -------
+    dict
+        Number of DOI's processed and URL's added.
+
     """
+    num_dois = 0
     num_urls_added = 0
-    urls_added = []
 
     db = get_db()
     config = get_config()
     batch_size = config.URL_BATCH_SIZE
+    if server_side is None:
+        server_side = config.DOI_URLS_SERVER_SIDE
+    if server_side:
+        return create_doi_urls_server_side("doi_old", checkpoint)
 
-    url_list = [url.url for url in get_all(db, Url)]
+    url_index = get_url_index()
 
-    list_dois = Doi.query.filter(Doi.url_doi_old is False).all()
-    print("Found DOI's: {0}".format(len(list_dois)))
+    print("Found DOI's: {0}".format(count_pending_dois("url_doi_old")))
 
-    for i in range(0, len(list_dois), batch_size):
+    for batch in tqdm(iter_pending_dois(db, "url_doi_old", batch_size, checkpoint)):
         db_urls_added = []
-        for row in tqdm(list_dois[i : i + batch_size]):
+        batch_urls: Set[str] = set()
+        for row in batch:
             url = "http://dx.doi.org/{0}".format(quote(row.doi))
-            if url not in url_list and url not in urls_added:
+            # the URL exists afterwards, whether it's added now or not
+            row.url_doi_old = True
+            if url not in url_index and url not in batch_urls:
                 url_dict = {"url": url, "doi": row.doi, "url_type": "doi_old"}
-                row.url_doi_old = True
-                urls_added.append(url_dict["url"])
+                batch_urls.add(url)
                 db_urls_added.append(url_dict)
-        create_entities(db, Url, db_urls_added)
+        insert_entities(db, Url, db_urls_added, IGNORE_BATCH_KWARGS)
+        commit_batch(db, checkpoint, batch[-1].doi, len(batch))
+        url_index.update(batch_urls)
+        num_dois += len(batch)
         num_urls_added += len(db_urls_added)
     print('{0} "Old DOI" URL\'s added to database.'.format(num_urls_added))
+    return {"num_processed": num_dois, "num_urls_added": num_urls_added}
 
 
-def create_doi_lp_urls() -> None:
-    """Create URL's from the identifier.
+def create_doi_urls_server_side(
+    url_type: str, checkpoint: Optional[Checkpoint] = None
+) -> dict:
+    """Create the DOI URL's of all pending DOI's inside the database.
 
-    Creates the DOI URL's as part of the pre-processing.
+    Instead of loading the DOI's, one ``INSERT INTO urls SELECT ... WHERE NOT
+    EXISTS ... GROUP BY url`` creates each missing URL once and one ``UPDATE``
+    sets the flag of all DOI's, whose URL exists now. The DOI's of `doi_old`
+    URL's are quoted in SQL by `fhe_url_quote()`, which matches
+    :func:`urllib.parse.quote`, see :func:`register_url_quote`.
+
+    Parameters
+    ----------
+    url_type : str
+        `doi_new` or `doi_old`.
+    checkpoint : Checkpoint, optional
+        Checkpoint to save the progress in.
+
+    Returns
+    -------
+    dict
+        Number of DOI's processed and URL's added.
 
     """
-    num_urls_added = 0
-    num_requests_added = 0
-    urls_added: list = []
+    prefix, quoted, flag = DOI_URL_TYPES[url_type]
+    db = get_db()
+    register_url_quote(db)
+    url_expr = ":prefix || {0}".format(
+        "fhe_url_quote(dois.doi)" if quoted else "dois.doi"
+    )
+    params = {
+        "prefix": prefix,
+        "url_type": url_type,
+        # naive UTC, as the ORM stores the default of `created_at`
+        "now": datetime.now(timezone.utc).replace(tzinfo=None),
+        "pending": False,
+        "done": True,
+    }
+
+    result = db.session.execute(
+        text(
+            # one row per URL, even if the URL's of two DOI's collide
+            "INSERT INTO urls (url, doi, url_type, created_at) "
+            "SELECT url, MIN(doi), :url_type, :now FROM ("
+            "SELECT DISTINCT {url} AS url, dois.doi AS doi FROM dois "
+            "WHERE dois.{flag} = :pending "
+            "AND NOT EXISTS (SELECT 1 FROM urls WHERE urls.url = {url})"
+            ") AS missing GROUP BY url".format(url=url_expr, flag=flag)
+        ),
+        params,
+    )
+    num_urls_added = result.rowcount
+    if num_urls_added and "url_index" in g:
+        # a loaded index would miss the new rows, later stages dedup with it.
+        # The URL's of all pending DOI's exist now, the index ignores the
+        # ones it already holds.
+        rows = db.session.execute(
+            text(
+                "SELECT {url} FROM dois WHERE dois.{flag} = :pending".format(
+                    url=url_expr, flag=flag
+                )
+            ).execution_options(stream_results=True),
+            params,
+        )
+        g.url_index.update(url for url, in rows)
+    result = db.session.execute(
+        text(
+            "UPDATE dois SET {flag} = :done WHERE {flag} = :pending "
+            "AND EXISTS (SELECT 1 FROM urls WHERE urls.url = {url})".format(
+                url=url_expr, flag=flag
+            )
+        ),
+        params,
+    )
+    num_dois = result.rowcount
+    commit_batch(db, checkpoint, None, num_dois)
+    print("{0} {1} URL's added to database.".format(num_urls_added, url_type))
+    return {"num_processed": num_dois, "num_urls_added": num_urls_added}
+
+
+def register_url_quote(db: SQLAlchemy) -> None:
+    """Make `fhe_url_quote(text)` available in SQL.
+
+    On SQLite :func:`urllib.parse.quote` itself is registered for the
+    connection, on PostgreSQL an equivalent SQL function is created. It
+    keeps ASCII letters, digits and ``_.-/`` (and ``~`` from Python 3.7 on,
+    like :func:`urllib.parse.quote`) and percent-encodes the UTF-8 bytes of
+    all other characters with upper-case hex digits.
+    """
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "sqlite":
+        db.session.connection().connection.create_function(
+            "fhe_url_quote", 1, lambda value: None if value is None else quote(value)
+        )
+    elif dialect == "postgresql":
+        db.session.execute(text(PG_URL_QUOTE_FUNCTION))
+    else:
+        raise NotImplementedError(
+            "fhe_url_quote() is not available for {0}.".format(dialect)
+        )
+
+
+def create_doi_lp_urls(checkpoint: Optional[Checkpoint] = None) -> dict:
+    """Create URL's from the identifier.
+
+    Creates the DOI landing page URL's as part of the pre-processing. The
+    DOI's are resolved concurrently in batches of `HTTP_BATCH_SIZE`, see
+    :class:`app.requests.AsyncFetcher`. `LP_BODY_POLICY` sets, what is
+    stored of each landing page, see :data:`LP_BODY_POLICIES`.
+
+    Parameters
+    ----------
+    checkpoint : Checkpoint, optional
+        Checkpoint to resume from and to save the progress in.
+
+    Returns
+    -------
+    dict
+        Number of DOI's processed, URL's and requests added, bytes of the
+        bodies received and stored and the seconds spent storing them.
 
+    """
     db = get_db()
-    # batch_size = config.URL_BATCH_SIZE # TODO: identify default and best practice values
-    batch_size = 20
+    config = get_config()
+    if config.LP_BODY_POLICY not in LP_BODY_POLICIES:
+        raise ValueError("Unknown body policy {0}.".format(config.LP_BODY_POLICY))
+
+    print("Found DOI's: {0}".format(count_pending_dois("url_doi_lp")))
 
-    url_list = [url.url for url in get_all(db, Url)]
+    fetcher = AsyncFetcher(
+        concurrency=config.HTTP_CONCURRENCY,
+        per_host=config.HTTP_PER_HOST_CONCURRENCY,
+        timeout=config.HTTP_TIMEOUT,
+        verify=False,
+    )
+    result = run_async(
+        _resolve_doi_landingpages(db, fetcher, config, get_response_store(), checkpoint)
+    )
+    print(
+        '{0} "Landing Page DOI" URL\'s added to database.'.format(
+            result["num_urls_added"]
+        )
+    )
+    print("{0} Requests added to database.".format(result["num_requests_added"]))
+    print(
+        "Bodies ({0}): {1:,} bytes received, {2:,} bytes stored in {3:.1f}s.".format(
+            config.LP_BODY_POLICY,
+            result["bytes_received"],
+            result["bytes_stored"],
+            result["store_seconds"],
+        )
+    )
+    print_fetcher_stats(fetcher)
+    result["http"] = fetcher.stats()
+    if result["num_failed"]:
+        print(
+            "{0} Requests failed, they are retried on the next run.".format(
+                result["num_failed"]
+            )
+        )
+    return result
 
-    list_dois = Doi.query.filter(Doi.url_doi_lp is False).all()
-    print("Found DOI's: {0}".format(len(list_dois)))
 
-    for i in range(0, len(list_dois), batch_size):
-        db_urls_added = []
-        db_requests_added = []
-        for row in tqdm(list_dois[i : i + batch_size]):
-            url = "https://doi.org/{0}".format(quote(row.doi))
-            if url not in url_list + urls_added:
-                resp = request_doi_landingpage(url)
+async def _resolve_doi_landingpages(
+    db: SQLAlchemy,
+    fetcher: AsyncFetcher,
+    config: Any,
+    store: Optional[SegmentStore],
+    checkpoint: Optional[Checkpoint],
+) -> dict:
+    num_dois = 0
+    num_urls_added = 0
+    num_requests_added = 0
+    num_failed = 0
+    bytes_received = 0
+    bytes_stored = 0
+    store_seconds = 0.0
+    url_index = get_url_index()
+    batches = iter_pending_dois(db, "url_doi_lp", config.HTTP_BATCH_SIZE, checkpoint)
+
+    async with fetcher:
+        for batch in tqdm(batches):
+            db_urls_added = []
+            db_requests_added = []
+            db_responses_added: dict = {}
+            batch_urls: Set[str] = set()
+            # the DOI URL is known from the doi-new stage, so only the landing
+            # page it resolves to is checked against the URL index
+            rows_requested = {
+                "https://doi.org/{0}".format(quote(row.doi)): row for row in batch
+            }
+
+            results = await fetcher.fetch_many(rows_requested)
+            start = time.perf_counter()
+            for url, result in zip(rows_requested, results):
+                row = rows_requested[url]
+                if result.error:
+                    num_failed += 1
+                    continue
+                bytes_received += len(result.content)
+                body = landingpage_body(
+                    result, config.LP_BODY_POLICY, config.LP_BODY_HEAD_SIZE
+                )
+                if body is not None:
+                    response_hash = add_response(
+                        db_responses_added, body, config.RESPONSE_COMPRESSION
+                    )
+                else:
+                    response_hash = None
                 req_dict = {
                     "doi": row.doi,
                     "request_url": url,
                     "request_type": "doi_lp",
-                    "response_content": resp.content,
-                    "response_status": resp.status_code,
+                    "response_hash": response_hash,
+                    "response_status": result.status,
                 }
                 db_requests_added.append(req_dict)
                 row.url_doi_lp = True
-                if resp.url not in url_list + urls_added:
+                lp_url = result.final_url
+                if lp_url not in url_index and lp_url not in batch_urls:
                     url_dict = {
-                        "url": resp.url,
+                        "url": lp_url,
                         "doi": row.doi,
                         "url_type": "doi_lp",
                     }
                     db_urls_added.append(url_dict)
-                    urls_added.append(url_dict["url"])
-        create_entities(db, Request, db_requests_added)
-        create_entities(db, Url, db_urls_added)
-        num_urls_added += len(db_urls_added)
-        num_requests_added += len(db_requests_added)
-    print('{0} "Landing Page DOI" URL\'s added to database.'.format(num_urls_added))
-    print("{0} Requests added to database.".format(num_requests_added))
+                    batch_urls.add(lp_url)
+            bytes_stored += write_responses(db, db_responses_added, store)
+            store_seconds += time.perf_counter() - start
+            insert_entities(db, Request, db_requests_added, BATCH_KWARGS)
+            insert_entities(db, Url, db_urls_added, IGNORE_BATCH_KWARGS)
+            commit_batch(db, checkpoint, batch[-1].doi, len(batch))
+            url_index.update(batch_urls)
+            num_dois += len(batch)
+            num_urls_added += len(db_urls_added)
+            num_requests_added += len(db_requests_added)
+    return {
+        "num_processed": num_dois,
+        "num_urls_added": num_urls_added,
+        "num_requests_added": num_requests_added,
+        "num_failed": num_failed,
+        "bytes_received": bytes_received,
+        "bytes_stored": bytes_stored,
+        "store_seconds": store_seconds,
+    }
 
 
-def create_ncbi_urls() -> None:
+def create_ncbi_urls(checkpoint: Optional[Checkpoint] = None) -> dict:
     """Create NCBI URL's from the identifier.
 
     https://www.ncbi.nlm.nih.gov/pmc/tools/id-converter-api/
@@ -313,73 +1231,126 @@ def create_ncbi_urls() -> None:
     API allows up to 200 ids sent at the same time.
     dois seperated with comma.
 
-    """
-    num_urls_pm_added = 0
-    num_urls_pmc_added = 0
-    num_requests_added = 0
-    urls_added: List[str] = []
+    Up to `NCBI_CONCURRENCY` requests are in flight at the same time, the
+    request rate is limited by the `ncbi` budget of the rate limiter. The
+    response of a request is stored once, the requests of its DOI's
+    reference it by hash.
+
+    Parameters
+    ----------
+    checkpoint : Checkpoint, optional
+        Checkpoint to resume from and to save the progress in.
 
+    Returns
+    -------
+    dict
+        Number of DOI's processed, URL's and requests added.
+
+    """
     db = get_db()
     config = get_config()
-    ncbi_tool = config.NCBI_TOOL
-    ncbi_email = config.APP_EMAIL
-    request_batch_size = 20
-    doi_batch_size = 200
 
-    url_list = [url.url for url in get_all(db, Url)]
+    print("Found DOI's: {0}".format(count_pending_dois("url_ncbi")))
 
-    list_dois = Doi.query.filter(Doi.url_ncbi is False).all()
-    print("Found DOI's: {0}".format(len(list_dois)))
+    fetcher = AsyncFetcher(
+        concurrency=config.NCBI_CONCURRENCY,
+        per_host=config.NCBI_CONCURRENCY,
+        timeout=config.HTTP_TIMEOUT,
+        api="ncbi",
+    )
+    params = ncbi_params(config.NCBI_TOOL, config.APP_EMAIL, config.NCBI_API_KEY)
+    result = run_async(
+        _convert_ncbi_ids(
+            db,
+            fetcher,
+            params,
+            config.RESPONSE_COMPRESSION,
+            get_response_store(),
+            checkpoint,
+        )
+    )
+    print('{0} "PM" URL\'s added to database.'.format(result.pop("num_urls_pm_added")))
+    print(
+        '{0} "PMC" URL\'s added to database.'.format(result.pop("num_urls_pmc_added"))
+    )
+    print("{0} Requests added to database.".format(result["num_requests_added"]))
+    print_fetcher_stats(fetcher)
+    result["http"] = fetcher.stats()
+    if result["num_failed"]:
+        print(
+            "{0} Requests failed, they are retried on the next run.".format(
+                result["num_failed"]
+            )
+        )
+    return result
+
+
+async def _convert_ncbi_ids(
+    db: SQLAlchemy,
+    fetcher: AsyncFetcher,
+    params: dict,
+    compression: str,
+    store: Optional[SegmentStore],
+    checkpoint: Optional[Checkpoint],
+) -> dict:
+    num_dois = 0
+    num_urls_pm_added = 0
+    num_urls_pmc_added = 0
+    num_requests_added = 0
+    num_failed = 0
+    request_batch_size = 20
+    url_index = get_url_index()
 
-    for i in range(0, len(list_dois), request_batch_size * doi_batch_size):
-        db_urls_added = []
-        db_requests_added = []
-        if i + request_batch_size * doi_batch_size >= len(list_dois):
-            end = len(list_dois)
-        else:
-            end = i + request_batch_size * doi_batch_size
-        for j in tqdm(range(i, end, doi_batch_size)):
-            if j + doi_batch_size >= len(list_dois):
-                end = len(list_dois)
-            else:
-                end = j + doi_batch_size
-            list_dois_tmp = list_dois[j:end]
-            dois_requested = {}
-            url = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/?ids="
-            for row in list_dois_tmp:
-                url += quote(row.doi) + ","
-                dois_requested[row.doi] = row
-            url = url[:-1]
-
-            # send request to NCBI API
-            resp = request_ncbi_api(url, ncbi_tool, ncbi_email)
-            resp_data = resp.json()
-            for doi, row in dois_requested.items():
-                request_dict = {
-                    "doi": doi,
-                    "request_url": url,
-                    "request_type": "ncbi",
-                    "response_content": dumps(resp_data),
-                    "response_status": resp.status_code,
-                }
-                db_requests_added.append(request_dict)
-                row.url_ncbi = True
+    batches = iter_pending_dois(
+        db, "url_ncbi", request_batch_size * NCBI_MAX_IDS, checkpoint
+    )
+    async with fetcher:
+        for batch in tqdm(batches):
+            db_urls_added = []
+            db_requests_added = []
+            db_responses_added: dict = {}
+            batch_urls: Set[str] = set()
+            chunks = [
+                batch[i : i + NCBI_MAX_IDS] for i in range(0, len(batch), NCBI_MAX_IDS)
+            ]
+            urls = [ncbi_idconv_url(row.doi for row in chunk) for chunk in chunks]
+
+            results = await fetcher.fetch_many(urls, params)
+            for url, chunk, result in zip(urls, chunks, results):
+                if not result.ok:
+                    num_failed += 1
+                    continue
+                response_hash = add_response(
+                    db_responses_added, result.text, compression
+                )
+                dois_requested = {}
+                for row in chunk:
+                    db_requests_added.append(
+                        {
+                            "doi": row.doi,
+                            "request_url": url,
+                            "request_type": "ncbi",
+                            "response_hash": response_hash,
+                            "response_status": result.status,
+                        }
+                    )
+                    dois_requested[row.doi] = row
+                    row.url_ncbi = True
 
-            if "records" in resp_data:
-                for rec in resp_data["records"]:
+                for rec in result.json().get("records", []):
                     # create PMC url
                     if "pmcid" in rec:
                         url_pmc = "https://ncbi.nlm.nih.gov/pmc/articles/PMC{0}/".format(
                             quote(rec["pmcid"])
                         )
-                        if url_pmc not in url_list + urls_added:
+                        if url_pmc not in url_index and url_pmc not in batch_urls:
                             url_dict = {
                                 "url": url_pmc,
                                 "doi": rec["doi"],
                                 "url_type": "pmc",
                             }
                             db_urls_added.append(url_dict)
-                            urls_added.append(url_pmc)
+                            batch_urls.add(url_pmc)
                             num_urls_pmc_added += 1
                             if rec["doi"] in dois_requested:
                                 dois_requested[rec["doi"]].url_pmc = True
@@ -388,134 +1359,602 @@ def create_ncbi_urls() -> None:
                         url_pm = "https://www.ncbi.nlm.nih.gov/pubmed/{0}".format(
                             rec["pmid"]
                         )
-                        if url_pm not in url_list + urls_added:
+                        if url_pm not in url_index and url_pm not in batch_urls:
                             url_dict = {
                                 "url": url_pm,
                                 "doi": rec["doi"],
                                 "url_type": "pm",
                             }
                             db_urls_added.append(url_dict)
-                            urls_added.append(url_pm)
+                            batch_urls.add(url_pm)
                             num_urls_pm_added += 1
                             if rec["doi"] in dois_requested:
                                 dois_requested[rec["doi"]].url_pm = True
-        create_entities(db, Request, db_requests_added)
-        create_entities(db, Url, db_urls_added)
-        num_requests_added += len(db_requests_added)
-    print('{0} "PM" URL\'s added to database.'.format(num_urls_pm_added))
-    print('{0} "PMC" URL\'s added to database.'.format(num_urls_pmc_added))
-    print("{0} Requests added to database.".format(num_requests_added))
+            write_responses(db, db_responses_added, store)
+            insert_entities(db, Request, db_requests_added, BATCH_KWARGS)
+            insert_entities(db, Url, db_urls_added, IGNORE_BATCH_KWARGS)
+            commit_batch(db, checkpoint, batch[-1].doi, len(batch))
+            url_index.update(batch_urls)
+            num_dois += len(batch)
+            num_requests_added += len(db_requests_added)
+    return {
+        "num_processed": num_dois,
+        "num_urls_added": num_urls_pm_added + num_urls_pmc_added,
+        "num_urls_pm_added": num_urls_pm_added,
+        "num_urls_pmc_added": num_urls_pmc_added,
+        "num_requests_added": num_requests_added,
+        "num_failed": num_failed,
+    }
 
 
-def create_unpaywall_urls() -> None:
+def create_unpaywall_urls(
+    checkpoint: Optional[Checkpoint] = None, refresh: bool = False
+) -> dict:
     """Create Unpaywall URL's from the identifier.
 
     https://unpaywall.org/products/api
 
-    """
-    num_urls_unpaywall_added = 0
-    num_requests_added = 0
-    urls_added: List[str] = []
+    The DOI's are requested concurrently in batches of `HTTP_BATCH_SIZE`,
+    with up to `UNPAYWALL_CONCURRENCY` requests in flight. Responses of the
+    last `UNPAYWALL_CACHE_TTL` seconds are taken from the stored requests
+    instead of the API.
 
-    database = get_db()
+    Parameters
+    ----------
+    checkpoint : Checkpoint, optional
+        Checkpoint to resume from and to save the progress in.
+    refresh : bool, optional
+        Process all DOI's, not only the pending ones. DOI's with a fresh
+        cached response are not requested again.
+
+    Returns
+    -------
+    dict
+        Number of DOI's processed, URL's and requests added and DOI's taken
+        from the cache.
+
+    """
+    db = get_db()
     config = get_config()
-    # batch_size = config.URL_BATCH_SIZE # TODO: identify default and best practice values
-    email = config.APP_EMAIL
-    batch_size = 20
 
-    url_list = [url.url for url in get_all(database, Url)]
+    if refresh:
+        print("Found DOI's: {0}".format(db.session.query(Doi).count()))
+    else:
+        print("Found DOI's: {0}".format(count_pending_dois("url_unpaywall")))
+
+    fetcher = AsyncFetcher(
+        concurrency=config.UNPAYWALL_CONCURRENCY,
+        per_host=config.UNPAYWALL_CONCURRENCY,
+        timeout=config.HTTP_TIMEOUT,
+        api="unpaywall",
+    )
+    result = run_async(
+        _request_unpaywall(
+            db, fetcher, config, get_response_store(), checkpoint, refresh
+        )
+    )
+    print('{0} "Unpaywall" URL\'s added to database.'.format(result["num_urls_added"]))
+    print("{0} Requests added to database.".format(result["num_requests_added"]))
+    print("{0} DOI's taken from the cache.".format(result["num_cached"]))
+    print_fetcher_stats(fetcher)
+    result["http"] = fetcher.stats()
+    if result["num_failed"]:
+        print(
+            "{0} Requests failed, they are retried on the next run.".format(
+                result["num_failed"]
+            )
+        )
+    return result
+
+
+async def _request_unpaywall(
+    db: SQLAlchemy,
+    fetcher: AsyncFetcher,
+    config: Any,
+    store: Optional[SegmentStore],
+    checkpoint: Optional[Checkpoint],
+    refresh: bool,
+) -> dict:
+    num_dois = 0
+    num_urls_added = 0
+    num_requests_added = 0
+    num_cached = 0
+    num_failed = 0
+    url_index = get_url_index()
 
-    list_dois = Doi.query.filter(Doi.url_unpaywall is False).all()
-    print("Found DOI's: {0}".format(len(list_dois)))
+    if refresh:
+        after = checkpoint.last_key if checkpoint else None
+        batches = iter_batches(db, Doi, chunk_size=config.HTTP_BATCH_SIZE, after=after)
+    else:
+        batches = iter_pending_dois(
+            db, "url_unpaywall", config.HTTP_BATCH_SIZE, checkpoint
+        )
 
-    for i in range(0, len(list_dois), batch_size):
-        db_urls_added = []
-        db_requests_added = []
-        for row in tqdm(list_dois[i : i + batch_size]):
-            url_resp_dict = {}
-            url = "https://api.unpaywall.org/v2/{0}?email={1}".format(
-                quote(row.doi), email
+    async with fetcher:
+        for batch in tqdm(batches):
+            db_urls_added = []
+            db_requests_added = []
+            db_responses_added: dict = {}
+            batch_urls: Set[str] = set()
+            cached = get_cached_responses(
+                db,
+                "unpaywall",
+                [row.doi for row in batch],
+                config.UNPAYWALL_CACHE_TTL,
+                store,
             )
-            resp = request_unpaywall_api(url)
-            resp_data = resp.json()
-            req_dict = {
-                "doi": row.doi,
-                "request_url": url,
-                "request_type": "unpaywall",
-                "response_content": dumps(resp_data),
-                "response_status": resp.status_code,
+            rows_requested = {
+                unpaywall_url(row.doi, config.APP_EMAIL): row
+                for row in batch
+                if row.doi not in cached
             }
-            db_requests_added.append(req_dict)
-            row.url_unpaywall = True
-
-            # check if response includes needed data
-            if "doi_url" in resp_data:
-                url_resp_dict["unpaywall:doi"] = resp_data["doi_url"]
-            if "oa_locations" in resp_data:
-                for loc in resp_data["oa_locations"]:
-                    if "url_for_pdf" in loc:
-                        if loc["url_for_pdf"]:
-                            url_resp_dict["unpaywall:pdf"] = loc["url_for_pdf"]
-                    if "url" in loc:
-                        if loc["url"]:
-                            url_resp_dict["unpaywall:url"] = loc["url"]
-                    if "url_for_landing_page" in loc:
-                        if loc["url_for_landing_page"]:
-                            url_resp_dict["unpaywall:landing_page"] = loc[
-                                "url_for_landing_page"
-                            ]
-
-            # store URL's in database
-            for url_type, url in url_resp_dict.items():
-                if url not in url_list + urls_added:
-                    url_dict = {"url": url, "doi": row.doi, "url_type": url_type}
-                    urls_added.append(url)
-                    db_urls_added.append(url_dict)
-        create_entities(database, Request, db_requests_added)
-        create_entities(database, Url, db_urls_added)
-        num_urls_unpaywall_added += len(db_urls_added)
-        num_requests_added += len(db_requests_added)
-    print('{0} "Unpaywall" URL\'s added to database.'.format(num_urls_unpaywall_added))
-    print("{0} Requests added to database.".format(num_requests_added))
+
+            results = await fetcher.fetch_many(rows_requested)
+            contents = {row.doi: cached[row.doi] for row in batch if row.doi in cached}
+            for url, result in zip(rows_requested, results):
+                row = rows_requested[url]
+                if result.error:
+                    num_failed += 1
+                    continue
+                db_requests_added.append(
+                    {
+                        "doi": row.doi,
+                        "request_url": url,
+                        "request_type": "unpaywall",
+                        "response_hash": add_response(
+                            db_responses_added,
+                            result.text,
+                            config.RESPONSE_COMPRESSION,
+                        ),
+                        "response_status": result.status,
+                    }
+                )
+                contents[row.doi] = result.text
+
+            for row in batch:
+                if row.doi not in contents:
+                    continue
+                row.url_unpaywall = True
+                try:
+                    resp_data = loads(contents[row.doi])
+                except ValueError:
+                    resp_data = {}
+                # store URL's in database
+                for url_type, url in parse_unpaywall_urls(resp_data).items():
+                    if url not in url_index and url not in batch_urls:
+                        url_dict = {"url": url, "doi": row.doi, "url_type": url_type}
+                        batch_urls.add(url)
+                        db_urls_added.append(url_dict)
+            write_responses(db, db_responses_added, store)
+            insert_entities(db, Request, db_requests_added, BATCH_KWARGS)
+            insert_entities(db, Url, db_urls_added, IGNORE_BATCH_KWARGS)
+            commit_batch(db, checkpoint, batch[-1].doi, len(batch))
+            url_index.update(batch_urls)
+            num_dois += len(batch)
+            num_urls_added += len(db_urls_added)
+            num_requests_added += len(db_requests_added)
+            num_cached += len(cached)
+    return {
+        "num_processed": num_dois,
+        "num_urls_added": num_urls_added,
+        "num_requests_added": num_requests_added,
+        "num_cached": num_cached,
+        "num_failed": num_failed,
+    }
 
 
-def get_fb_data() -> None:
-    """Get app access token.
+def parse_unpaywall_urls(resp_data: dict) -> dict:
+    """Get the URL's of an Unpaywall response by `unpaywall:*` URL type."""
+    url_resp_dict = {}
+    # check if response includes needed data
+    if "doi_url" in resp_data:
+        url_resp_dict["unpaywall:doi"] = resp_data["doi_url"]
+    if "oa_locations" in resp_data:
+        for loc in resp_data["oa_locations"]:
+            if "url_for_pdf" in loc:
+                if loc["url_for_pdf"]:
+                    url_resp_dict["unpaywall:pdf"] = loc["url_for_pdf"]
+            if "url" in loc:
+                if loc["url"]:
+                    url_resp_dict["unpaywall:url"] = loc["url"]
+            if "url_for_landing_page" in loc:
+                if loc["url_for_landing_page"]:
+                    url_resp_dict["unpaywall:landing_page"] = loc[
+                        "url_for_landing_page"
+                    ]
+    return url_resp_dict
+
+
+def get_fb_data(
+    checkpoint: Optional[Checkpoint] = None,
+    incremental: bool = False,
+    limit: Optional[int] = None,
+) -> dict:
+    """Get the Facebook engagement of all URL's.
 
     Example Response:
     {'id': 'http://dx.doi.org/10.22230/src.2010v1n2a24', 'engagement': { 'share_count': 0, 'comment_plugin_count': 0, 'reaction_count': 0, 'comment_count': 0}}
+
+    Up to `FB_CONCURRENCY` batches of `FB_BATCH_SIZE` URL's are requested at
+    the same time, within the `fb` budget of the rate limiter. The budget
+    follows the `X-App-Usage` of the responses. Entries without engagement
+    are stored with their response, so a partial batch is not lost.
+
+    In incremental mode only the URL's due for a snapshot are requested,
+    never requested ones first, then the most overdue, see
+    :func:`get_due_fb_urls`. A `FBRequest` is only added if the counts
+    changed since the last snapshot, and the next snapshot is scheduled by
+    :func:`snapshot_interval`.
+
+    Parameters
+    ----------
+    checkpoint : Checkpoint, optional
+        Checkpoint to resume from and to save the progress in. Not used in
+        incremental mode, where the snapshot schedule keeps the progress.
+    incremental : bool, optional
+        Only request the URL's due for a snapshot, by default False
+    limit : int, optional
+        Maximum number of URL's of an incremental run, by default
+        `FB_SNAPSHOT_LIMIT`.
+
+    Returns
+    -------
+    dict
+        Number of URL's processed, Facebook requests added, entries without
+        engagement and URL's failed. Incremental runs also return the number
+        of URL's with unchanged counts.
     """
     config = get_config()
+    db = get_db()
+
+    if CacheSettings.offline:
+        # served from the HTTP cache only
+        token = ""
+    else:
+        token = get_graph_api_access_token(config)
+    fetcher = AsyncFetcher(
+        concurrency=config.FB_CONCURRENCY,
+        per_host=config.FB_CONCURRENCY,
+        timeout=config.HTTP_TIMEOUT,
+        api="fb",
+        cache=False,
+    )
+    if incremental:
+        if limit is None:
+            limit = config.FB_SNAPSHOT_LIMIT
+        result = run_async(_snapshot_fb(db, fetcher, config, token, limit))
+    else:
+        result = run_async(_request_fb(db, fetcher, config, token, checkpoint))
+    print(
+        "{0} Facebook openGraph request's added to database.".format(
+            result["num_fbrequests_added"]
+        )
+    )
+    if result.get("num_unchanged"):
+        print("{0} URL's unchanged.".format(result["num_unchanged"]))
+    if result["num_partial"]:
+        print("{0} URL's without engagement.".format(result["num_partial"]))
+    if result["num_failed"]:
+        print("{0} URL's failed.".format(result["num_failed"]))
+    print_fetcher_stats(fetcher)
+    result["http"] = fetcher.stats()
+    return result
+
+
+def get_due_fb_urls(
+    db: SQLAlchemy, now: datetime, limit: int
+) -> List[Tuple[str, Optional[datetime], Optional[FBState]]]:
+    """Get the URL's due for a Facebook snapshot.
+
+    URL's without a snapshot come first, then the ones most overdue. Ties
+    are ordered by URL, so runs with a `limit` are reproducible.
+
+    Returns
+    -------
+    list
+        URL, publication date of its DOI and its state, if any.
+    """
+    return (
+        db.session.query(Url.url, Doi.date_published, FBState)
+        .join(Doi, Url.doi == Doi.doi)
+        .outerjoin(FBState, FBState.url == Url.url)
+        .filter((FBState.url.is_(None)) | (FBState.next_snapshot_at <= now))
+        .order_by(
+            FBState.next_snapshot_at.isnot(None), FBState.next_snapshot_at, Url.url
+        )
+        .limit(limit)
+        .all()
+    )
+
+
+def snapshot_interval(
+    age: Optional[timedelta], velocity: float, min_interval: float, max_interval: float,
+) -> float:
+    """Get the seconds until the next Facebook snapshot of an URL.
+
+    The interval grows by `min_interval` for every 30 days since the
+    publication and is divided by one plus the engagement gained per day.
+    Publications without a date count as new.
+
+    Parameters
+    ----------
+    age : timedelta, optional
+        Time since the publication.
+    velocity : float
+        Engagement gained per day.
+    min_interval : float
+        Shortest interval in seconds.
+    max_interval : float
+        Longest interval in seconds.
+
+    Returns
+    -------
+    float
+        Interval in seconds.
+    """
+    age_days = max(age.total_seconds() / 86400, 0.0) if age else 0.0
+    interval = min_interval * (1 + age_days / 30) / (1 + velocity)
+    return min(max(interval, min_interval), max_interval)
+
+
+def _fb_request_row(url: str, response: dict) -> dict:
+    engagement = response.get("engagement") or {}
+    return {
+        "url": url,
+        "response": dumps(response),
+        "reactions": engagement.get("reaction_count"),
+        "shares": engagement.get("share_count"),
+        "comments": engagement.get("comment_count"),
+        "plugin_comments": engagement.get("comment_plugin_count"),
+    }
+
+
+async def _iter_graph_objects(
+    fetcher: AsyncFetcher, config: Any, token: str, url_batches: Iterator[List[str]],
+) -> AsyncIterator[Tuple[List[str], dict]]:
+    """Request `FB_CONCURRENCY` batches of URL's at a time.
+
+    Yields each batch with the objects received. The budget of the rate
+    limiter follows the app usage of the responses.
+    """
+    async with fetcher:
+        while True:
+            group = list(islice(url_batches, config.FB_CONCURRENCY))
+            if not group:
+                break
+            responses = await asyncio.gather(
+                *(
+                    fetch_graph_objects(fetcher, urls, token, config.FB_API_VERSION)
+                    for urls in group
+                )
+            )
+            for urls, (objects, result) in zip(group, responses):
+                if result is not None:
+                    pace_graph_api(
+                        app_usage(result.headers),
+                        config.FB_HOURLY_RATELIMIT,
+                        config.FB_USAGE_THRESHOLD,
+                    )
+                    if graph_api_error_code(result) in FB_TOKEN_ERRORS:
+                        if config.FB_API_TOKEN:
+                            raise RuntimeError(
+                                "Facebook access token rejected, replace "
+                                "FB_API_TOKEN in the config."
+                            )
+                        get_graph_api_access_token(config, refresh=True)
+                        raise RuntimeError(
+                            "Facebook access token rejected, a new one is "
+                            "requested on the next run."
+                        )
+                yield urls, objects
+
+
+async def _request_fb(
+    db: SQLAlchemy,
+    fetcher: AsyncFetcher,
+    config: Any,
+    token: str,
+    checkpoint: Optional[Checkpoint],
+) -> dict:
+    num_urls = 0
     num_fbrequests_added = 0
-    app_id = config.FB_APP_ID
-    app_secret = config.FB_APP_SECRET
+    num_partial = 0
+    num_failed = 0
     batch_size = config.FB_BATCH_SIZE
 
-    db = get_db()
-    token = get_graph_api_token(app_id, app_secret)
-    fb_graph = get_graph_api(token["access_token"], version="3.1")
+    url_batches = (
+        [url for url, in batch]
+        for batch in iter_batches(
+            db,
+            Url,
+            columns=["url"],
+            chunk_size=batch_size,
+            after=checkpoint.last_key if checkpoint else None,
+        )
+    )
+    total = -(-db.session.query(Url).count() // batch_size)
+    progress = tqdm(total=total)
+
+    async for request_url_list, objects in _iter_graph_objects(
+        fetcher, config, token, url_batches
+    ):
+        db_requests_added = []
+        for url in request_url_list:
+            response = objects.get(url)
+            if response is None:
+                num_failed += 1
+                continue
+            if not response.get("engagement"):
+                num_partial += 1
+            db_requests_added.append(_fb_request_row(url, response))
+        insert_entities(db, FBRequest, db_requests_added, BATCH_KWARGS)
+        commit_batch(db, checkpoint, request_url_list[-1], len(request_url_list))
+        num_urls += len(request_url_list)
+        num_fbrequests_added += len(db_requests_added)
+        progress.update()
+    progress.close()
+    return {
+        "num_processed": num_urls,
+        "num_fbrequests_added": num_fbrequests_added,
+        "num_partial": num_partial,
+        "num_failed": num_failed,
+    }
 
-    result_url = get_all(db, Url)
 
-    for i in tqdm(range(0, len(result_url), batch_size)):
+async def _snapshot_fb(
+    db: SQLAlchemy, fetcher: AsyncFetcher, config: Any, token: str, limit: int,
+) -> dict:
+    num_urls = 0
+    num_fbrequests_added = 0
+    num_unchanged = 0
+    num_partial = 0
+    num_failed = 0
+    batch_size = config.FB_BATCH_SIZE
+    # naive UTC, like the stored dates
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    due = get_due_fb_urls(db, now, limit)
+    published = {url: date_published for url, date_published, _ in due}
+    states = {url: state for url, _, state in due}
+    urls = list(published)
+    url_batches = (urls[i : i + batch_size] for i in range(0, len(urls), batch_size))
+    progress = tqdm(total=-(-len(urls) // batch_size))
+
+    async for request_url_list, objects in _iter_graph_objects(
+        fetcher, config, token, url_batches
+    ):
         db_requests_added = []
-        request_url_list = [row.url for row in result_url[i : i + batch_size]]
-
-        urls_response = get_graph_api_urls(fb_graph, request_url_list)
-        for url, response in urls_response.items():
-            req_dict = {
-                "url": url,
-                "response": dumps(response),
-                "reactions": response["engagement"]["reaction_count"],
-                "shares": response["engagement"]["share_count"],
-                "comments": response["engagement"]["comment_count"],
-                "plugin_comments": response["engagement"]["comment_plugin_count"],
-            }
-            db_requests_added.append(req_dict)
-        create_entities(db, FBRequest, db_requests_added)
+        for url in request_url_list:
+            response = objects.get(url)
+            if response is None:
+                # stays due for the next run
+                num_failed += 1
+                continue
+            if not response.get("engagement"):
+                num_partial += 1
+            row = _fb_request_row(url, response)
+            state = states[url]
+            if state is None:
+                state = FBState(url=url, velocity=0.0, num_snapshots=0)
+                db.session.add(state)
+            if state.record(tuple(row[name] for name in FBState.COUNTS), now):
+                db_requests_added.append(row)
+            else:
+                num_unchanged += 1
+            age = now - published[url] if published[url] else None
+            state.next_snapshot_at = now + timedelta(
+                seconds=snapshot_interval(
+                    age,
+                    state.velocity,
+                    config.FB_SNAPSHOT_MIN_INTERVAL,
+                    config.FB_SNAPSHOT_MAX_INTERVAL,
+                )
+            )
+        insert_entities(db, FBRequest, db_requests_added, BATCH_KWARGS)
+        commit_batch(db, None, request_url_list[-1], len(request_url_list))
+        num_urls += len(request_url_list)
         num_fbrequests_added += len(db_requests_added)
-    print(
-        "{0} Facebook openGraph request's added to database.".format(
-            num_fbrequests_added
+        progress.update()
+    progress.close()
+    return {
+        "num_processed": num_urls,
+        "num_fbrequests_added": num_fbrequests_added,
+        "num_unchanged": num_unchanged,
+        "num_partial": num_partial,
+        "num_failed": num_failed,
+    }
+
+
+def get_response_stats() -> dict:
+    """Get the storage savings of the response store.
+
+    Returns
+    -------
+    dict
+        Number of requests referencing a response and of responses stored.
+        `bytes_referenced` is the size of the bodies of all requests, as if
+        each request stored its own copy. `bytes_unique` is the size of the
+        distinct bodies, `bytes_stored` their compressed size.
+
+    """
+    db = get_db()
+    num_requests, bytes_referenced = (
+        db.session.query(
+            func.count(Request.id), func.coalesce(func.sum(ResponseBody.size), 0)
         )
+        .join(ResponseBody, Request.response_hash == ResponseBody.hash)
+        .one()
     )
+    num_responses, bytes_unique, bytes_stored = db.session.query(
+        func.count(ResponseBody.hash),
+        func.coalesce(func.sum(ResponseBody.size), 0),
+        func.coalesce(func.sum(ResponseBody.stored_size), 0),
+    ).one()
+    return {
+        "num_requests": num_requests,
+        "num_responses": num_responses,
+        "bytes_referenced": bytes_referenced,
+        "bytes_unique": bytes_unique,
+        "bytes_stored": bytes_stored,
+        "bytes_saved": bytes_referenced - bytes_stored,
+    }
+
+
+def get_stats(max_age: Optional[float] = None) -> dict:
+    """Count the imports, DOI's, URL's and requests.
+
+    Each table is counted with one grouped query, and the result is cached
+    per database for `STATS_CACHE_TTL` seconds, so the stats page does not
+    scan the tables on every load.
+
+    Parameters
+    ----------
+    max_age : float, optional
+        Maximum age of cached statistics in seconds, by default
+        `STATS_CACHE_TTL`. `0` always counts again.
+
+    Returns
+    -------
+    dict
+        Number of imports and Facebook requests, number of DOI's with each
+        flag set, of URL's of each type and of requests of each type.
+    """
+    config = get_config()
+    if max_age is None:
+        max_age = config.STATS_CACHE_TTL
+    key = config.SQLALCHEMY_DATABASE_URI
+    cached = _stats_cache.get(key)
+    if cached is not None and time.monotonic() - cached[0] < max_age:
+        return cached[1]
+
+    db = get_db()
+    doi_counts = db.session.query(
+        func.count(Doi.doi),
+        *(
+            func.sum(case([(getattr(Doi, flag) == True, 1)], else_=0))  # noqa: E712
+            for flag in STATS_DOI_FLAGS.values()
+        ),
+    ).one()
+    url_counts = dict(
+        db.session.query(Url.url_type, func.count(Url.url)).group_by(Url.url_type)
+    )
+    request_counts = dict(
+        db.session.query(Request.request_type, func.count(Request.id)).group_by(
+            Request.request_type
+        )
+    )
+    data = {
+        "imports": db.session.query(func.count(Import.id)).scalar(),
+        "dois": {"num": doi_counts[0]},
+        "urls": {"num": sum(url_counts.values())},
+        "requests": {"num": sum(request_counts.values())},
+        "fbrequests": db.session.query(func.count(FBRequest.id)).scalar(),
+    }
+    for name, num in zip(STATS_DOI_FLAGS, doi_counts[1:]):
+        data["dois"][name] = num or 0
+    for name, url_type in STATS_URL_TYPES.items():
+        data["urls"][name] = url_counts.get(url_type, 0)
+    for name, request_type in STATS_REQUEST_TYPES.items():
+        data["requests"][name] = request_counts.get(request_type, 0)
+    _stats_cache[key] = (time.monotonic(), data)
+    return data
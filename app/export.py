@@ -0,0 +1,313 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Export of the database tables."""
+import csv
+import gzip
+import os
+import shutil
+import sys
+from collections import OrderedDict
+from datetime import datetime
+from json import dumps
+from typing import Any
+from typing import Dict
+from typing import IO
+from typing import Iterator
+from typing import List
+from typing import Optional
+from urllib.parse import quote
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
+from sqlalchemy import types
+
+from app.crud import iter_batches
+from app.db import get_config
+from app.db import get_db
+from app.models import Doi
+from app.models import FBRequest
+from app.models import Request
+from app.models import Url
+from app.utils import pyarrow
+from app.utils import PYARROW_MISSING
+
+
+# table: model, column to partition by
+EXPORT_TABLES = OrderedDict(
+    [
+        ("dois", (Doi, None)),
+        ("urls", (Url, "url_type")),
+        ("requests", (Request, "request_type")),
+        ("fbrequests", (FBRequest, None)),
+    ]
+)
+# directory name of NULL values, as used by Hive and pyarrow
+HIVE_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+EXPORT_FORMATS = ["csv", "ndjson"]
+# column of the engagement export: model attribute
+ENGAGEMENT_COLUMNS = OrderedDict(
+    [
+        ("doi", Doi.doi),
+        ("date_published", Doi.date_published),
+        ("import_id", Doi.import_id),
+        ("url", Url.url),
+        ("url_type", Url.url_type),
+        ("fb_reactions", FBRequest.reactions),
+        ("fb_shares", FBRequest.shares),
+        ("fb_comments", FBRequest.comments),
+        ("fb_plugin_comments", FBRequest.plugin_comments),
+        ("fb_requested_at", FBRequest.created_at),
+    ]
+)
+
+
+def arrow_schema(model: Any) -> "pyarrow.Schema":
+    """Get the Arrow schema of the columns of a model."""
+    fields = []
+    for column in model.__table__.columns:
+        # subclasses first: BigInteger is an Integer, Text a String
+        if isinstance(column.type, (types.BigInteger, types.Integer)):
+            arrow_type = pyarrow.int64()
+        elif isinstance(column.type, types.Boolean):
+            arrow_type = pyarrow.bool_()
+        elif isinstance(column.type, types.DateTime):
+            arrow_type = pyarrow.timestamp("us")
+        elif isinstance(column.type, types.Float):
+            arrow_type = pyarrow.float64()
+        elif isinstance(column.type, types.LargeBinary):
+            arrow_type = pyarrow.binary()
+        else:
+            arrow_type = pyarrow.string()
+        fields.append(pyarrow.field(column.key, arrow_type))
+    return pyarrow.schema(fields)
+
+
+def export_parquet(
+    directory: str, tables: Optional[List[str]] = None, batch_size: Optional[int] = None
+) -> dict:
+    """Export tables to Parquet datasets.
+
+    Each table is written to `<directory>/<table>`, which is replaced. URL's
+    and requests are partitioned by their type in hive style (e. g.
+    `urls/url_type=ojs/`), so a filter on the type only reads the matching
+    files::
+
+        pyarrow.parquet.read_table("export/urls", filters=[("url_type", "=", "ojs")])
+
+    Rows are streamed from the database in batches of `batch_size` and each
+    batch is written as row group of its partition, so tables larger than
+    the memory can be exported. The row group statistics allow to skip row
+    groups by the other columns.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the export.
+    tables : list, optional
+        Names of the tables, see :data:`EXPORT_TABLES`. By default all.
+    batch_size : int, optional
+        Number of rows per batch, by default `EXPORT_BATCH_SIZE`.
+
+    Returns
+    -------
+    dict
+        Number of rows exported per table.
+
+    """
+    if pyarrow is None:
+        raise ImportError(PYARROW_MISSING.format("Parquet export"))
+    db = get_db()
+    if batch_size is None:
+        batch_size = get_config().EXPORT_BATCH_SIZE
+
+    result = OrderedDict()
+    for table in tables or list(EXPORT_TABLES):
+        model, partition = EXPORT_TABLES[table]
+        path = os.path.join(directory, table)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        result[table] = _write_parquet(db, model, partition, path, batch_size)
+    return result
+
+
+def _write_parquet(
+    db: SQLAlchemy, model: Any, partition: Optional[str], path: str, batch_size: int
+) -> int:
+    schema = arrow_schema(model)
+    columns = schema.names
+    if partition:
+        # the partition column is kept in the directory names only
+        schema = schema.remove(columns.index(partition))
+    writers: Dict[str, "pyarrow.parquet.ParquetWriter"] = {}
+    num_rows = 0
+    try:
+        for rows in iter_batches(db, model, columns=columns, chunk_size=batch_size):
+            num_rows += len(rows)
+            groups: Dict[str, List[tuple]] = OrderedDict()
+            if partition:
+                pos = columns.index(partition)
+                for row in rows:
+                    key = partition_directory(partition, row[pos])
+                    groups.setdefault(key, []).append(row[:pos] + row[pos + 1 :])
+            else:
+                groups[""] = rows
+            for key, group in groups.items():
+                if key not in writers:
+                    os.makedirs(os.path.join(path, key), exist_ok=True)
+                    writers[key] = pyarrow.parquet.ParquetWriter(
+                        os.path.join(path, key, "part-0.parquet"), schema
+                    )
+                batch = pyarrow.RecordBatch.from_arrays(
+                    [
+                        pyarrow.array(values, type=field.type)
+                        for values, field in zip(zip(*group), schema)
+                    ],
+                    schema=schema,
+                )
+                # ParquetWriter.write_batch needs pyarrow >= 7
+                writers[key].write_table(pyarrow.Table.from_batches([batch]))
+    finally:
+        for writer in writers.values():
+            writer.close()
+    if not writers:
+        os.makedirs(path, exist_ok=True)
+        pyarrow.parquet.write_table(
+            arrow_schema(model).empty_table(), os.path.join(path, "part-0.parquet")
+        )
+    return num_rows
+
+
+def partition_directory(column: str, value: Optional[str]) -> str:
+    """Get the hive style directory of a partition, e. g. `url_type=ojs`."""
+    if value is None:
+        return "{0}={1}".format(column, HIVE_NULL_PARTITION)
+    return "{0}={1}".format(column, quote(str(value), safe=""))
+
+
+def export_engagement(
+    filename: str,
+    file_format: Optional[str] = None,
+    compress: Optional[bool] = None,
+    import_id: Optional[int] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    url_types: Optional[List[str]] = None,
+    batch_size: Optional[int] = None,
+) -> int:
+    """Export the URL's of the DOI's with their latest Facebook engagement.
+
+    Each row is an URL with its DOI and the counts of the latest `FBRequest`
+    of the URL, which are empty if there is none. The rows are fetched
+    through a server-side cursor (on PostgreSQL) in batches of `batch_size`
+    and written one by one, so the memory used does not grow with the size
+    of the export.
+
+    Parameters
+    ----------
+    filename : str
+        File to write, `-` for stdout.
+    file_format : str, optional
+        One of :data:`EXPORT_FORMATS`, by default `ndjson` for `.ndjson` and
+        `.jsonl` files, else `csv`.
+    compress : bool, optional
+        Compress with gzip, by default for `.gz` files.
+    import_id : int, optional
+        Only DOI's of this import.
+    date_from : datetime, optional
+        Only DOI's published at or after this date.
+    date_to : datetime, optional
+        Only DOI's published at or before this date.
+    url_types : list, optional
+        Only URL's of these types.
+    batch_size : int, optional
+        Number of rows fetched at once, by default `EXPORT_BATCH_SIZE`.
+
+    Returns
+    -------
+    int
+        Number of rows exported.
+
+    """
+    name = filename[:-3] if filename.endswith(".gz") else filename
+    if compress is None:
+        compress = filename.endswith(".gz")
+    if file_format is None:
+        file_format = "ndjson" if name.endswith((".ndjson", ".jsonl")) else "csv"
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError("Export format {0} not supported.".format(file_format))
+    if batch_size is None:
+        batch_size = get_config().EXPORT_BATCH_SIZE
+
+    rows = _iter_engagement(
+        get_db(), import_id, date_from, date_to, url_types, batch_size
+    )
+    if filename == "-":
+        if compress:
+            with gzip.open(sys.stdout.buffer, "wt", encoding="utf-8") as f:
+                return _write_rows(f, rows, file_format)
+        return _write_rows(sys.stdout, rows, file_format)
+    if compress:
+        with gzip.open(filename, "wt", encoding="utf-8", newline="") as f:
+            return _write_rows(f, rows, file_format)
+    with open(filename, "w", encoding="utf-8", newline="") as f:
+        return _write_rows(f, rows, file_format)
+
+
+def _iter_engagement(
+    db: SQLAlchemy,
+    import_id: Optional[int],
+    date_from: Optional[datetime],
+    date_to: Optional[datetime],
+    url_types: Optional[List[str]],
+    batch_size: int,
+) -> Iterator[tuple]:
+    latest = (
+        db.session.query(func.max(FBRequest.id).label("id"), FBRequest.url)
+        .group_by(FBRequest.url)
+        .subquery()
+    )
+    query = (
+        db.session.query(*ENGAGEMENT_COLUMNS.values())
+        .select_from(Doi)
+        .join(Url, Url.doi == Doi.doi)
+        .outerjoin(latest, latest.c.url == Url.url)
+        .outerjoin(FBRequest, FBRequest.id == latest.c.id)
+    )
+    if import_id is not None:
+        query = query.filter(Doi.import_id == import_id)
+    if date_from is not None:
+        query = query.filter(Doi.date_published >= date_from)
+    if date_to is not None:
+        query = query.filter(Doi.date_published <= date_to)
+    if url_types:
+        query = query.filter(Url.url_type.in_(url_types))
+    return iter(
+        query.order_by(Doi.doi, Url.url)
+        .execution_options(stream_results=True)
+        .yield_per(batch_size)
+    )
+
+
+def _write_rows(f: IO, rows: Iterator[tuple], file_format: str) -> int:
+    columns = list(ENGAGEMENT_COLUMNS)
+    num_rows = 0
+    if file_format == "csv":
+        csv_writer = csv.writer(f)
+        csv_writer.writerow(columns)
+        for row in rows:
+            csv_writer.writerow(
+                ["" if val is None else _export_value(val) for val in row]
+            )
+            num_rows += 1
+    else:
+        for row in rows:
+            entry = dict(zip(columns, (_export_value(val) for val in row)))
+            f.write(dumps(entry) + "\n")
+            num_rows += 1
+    return num_rows
+
+
+def _export_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
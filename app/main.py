@@ -7,6 +7,8 @@ Copyright 2018 Stefan Kasberger
 Licensed under the MIT License.
 """
 import os
+import time
+from datetime import datetime
 
 import click
 from flask import Flask
@@ -19,6 +21,7 @@ from app.bp.main import blueprint as main_blueprint
 from app.bp.main.errors import internal_error
 from app.bp.main.errors import not_found_error
 from app.config import get_config_class
+from app.db import ARROW_EXTENSIONS
 from app.db import close_db
 from app.db import create_doi_lp_urls
 from app.db import create_doi_new_urls
@@ -28,9 +31,21 @@ from app.db import create_unpaywall_urls
 from app.db import dev
 from app.db import drop_db
 from app.db import get_fb_data
+from app.db import get_response_stats
 from app.db import import_basedata
 from app.db import init_db
+from app.export import export_engagement
+from app.export import EXPORT_FORMATS
+from app.export import export_parquet
+from app.export import EXPORT_TABLES
 from app.models import db
+from app.pipeline import run_pipeline
+from app.pipeline import STAGES
+from app.requests import configure_http_cache
+from app.requests import configure_rate_limiter
+from app.requests import configure_retries
+from app.utils import pyarrow
+from app.utils import PYARROW_MISSING
 
 
 ROOT_DIR = os.path.dirname(os.path.realpath(__file__))
@@ -44,8 +59,12 @@ def create_app() -> Flask:
     app = Flask("fhe_collector", root_path=ROOT_DIR)
     env_name = os.getenv("FLASK_ENV", "default")
     config = get_config_class(env_name)
-    app.config.from_object(config())
+    settings = config()
+    app.config.from_object(settings)
     config.init_app(app)
+    configure_rate_limiter(settings)
+    configure_retries(settings)
+    configure_http_cache(settings)
 
     init_app(app)
     db.init_app(app)
@@ -80,6 +99,10 @@ def init_app(app: Flask) -> None:
     app.cli.add_command(ncbi_command)
     app.cli.add_command(unpaywall_command)
     app.cli.add_command(fb_command)
+    app.cli.add_command(collect_command)
+    app.cli.add_command(responses_report_command)
+    app.cli.add_command(export_parquet_command)
+    app.cli.add_command(export_command)
     app.cli.add_command(dev_command)
 
 
@@ -125,25 +148,41 @@ def reset_db_command() -> None:
 @click.command("import-basedata")
 @click.argument("filename")
 @click.option("--reset", "-r", is_flag=True, help="Reset database before import.")
+@click.option(
+    "--chunksize", "-c", type=int, default=None, help="Rows read and written at once."
+)
 @with_appcontext
-def import_basedata_command(filename: str, reset: bool) -> None:
-    """Delete all entries in all tables."""
-    import_basedata(filename, reset)
+def import_basedata_command(filename: str, reset: bool, chunksize: int) -> None:
+    """Import base data from a CSV, Parquet or Feather file."""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in ARROW_EXTENSIONS and pyarrow is None:
+        raise click.ClickException(PYARROW_MISSING.format("Reading " + filename))
+    import_basedata(filename, reset, chunksize)
     click.echo("Basedata imported.")
 
 
 @click.command("doi-new")
+@click.option(
+    "--server-side/--no-server-side",
+    default=None,
+    help="Create the URL's with SQL inside the database.",
+)
 @with_appcontext
-def doi_new_command() -> None:
+def doi_new_command(server_side: bool) -> None:
     """Create the new doi URL's."""
-    create_doi_new_urls()
+    create_doi_new_urls(server_side=server_side)
 
 
 @click.command("doi-old")
+@click.option(
+    "--server-side/--no-server-side",
+    default=None,
+    help="Create the URL's with SQL inside the database.",
+)
 @with_appcontext
-def doi_old_command() -> None:
+def doi_old_command(server_side: bool) -> None:
     """Create the old doi URL's."""
-    create_doi_old_urls()
+    create_doi_old_urls(server_side=server_side)
 
 
 @click.command("doi-lp")
@@ -161,14 +200,170 @@ def ncbi_command() -> None:
 
 
 @click.command("unpaywall")
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Process all DOI's, DOI's with a fresh cached response are skipped.",
+)
 @with_appcontext
-def unpaywall_command() -> None:
+def unpaywall_command(refresh: bool) -> None:
     """Create the Unpaywall URL's."""
-    create_unpaywall_urls()
+    create_unpaywall_urls(refresh=refresh)
 
 
 @click.command("fb")
+@click.option(
+    "--incremental", is_flag=True, help="Only request the URL's due for a snapshot."
+)
+@click.option(
+    "--limit", type=int, default=None, help="Maximum number of URL's per snapshot run."
+)
+@click.option(
+    "--every",
+    type=float,
+    default=None,
+    help="Repeat the incremental run every SECONDS, until interrupted.",
+)
 @with_appcontext
-def fb_command() -> None:
+def fb_command(incremental: bool, limit: int, every: float) -> None:
     """Create the Facebook request."""
-    get_fb_data()
+    while True:
+        get_fb_data(incremental=incremental or every is not None, limit=limit)
+        if every is None:
+            break
+        time.sleep(every)
+
+
+@click.command("collect")
+@click.option(
+    "--stage",
+    "-s",
+    "stages",
+    multiple=True,
+    type=click.Choice(list(STAGES)),
+    help="Stage to run, can be passed multiple times. Default: all stages.",
+)
+@click.option("--jobs", "-j", default=1, help="Number of stages run concurrently.")
+@click.option(
+    "--restart", is_flag=True, help="Ignore checkpoints and start from the beginning."
+)
+@with_appcontext
+def collect_command(stages: tuple, jobs: int, restart: bool) -> None:
+    """Run the collection stages, resuming from the last checkpoint."""
+    results = run_pipeline(list(stages) or list(STAGES), jobs, restart)
+    click.echo(
+        "{0:<10} {1:>12} {2:>10} {3:>10}".format("stage", "processed", "s", "/s")
+    )
+    for stage, result in results.items():
+        click.echo(
+            "{0:<10} {1:>12} {2:>10.1f} {3:>10.1f}".format(
+                stage, result["num_processed"], result["duration"], result["throughput"]
+            )
+        )
+
+
+@click.command("responses-report")
+@with_appcontext
+def responses_report_command() -> None:
+    """Report the bytes saved by the response store."""
+    stats = get_response_stats()
+    saved = (
+        stats["bytes_saved"] / stats["bytes_referenced"] * 100
+        if stats["bytes_referenced"]
+        else 0.0
+    )
+    click.echo("Requests:          {0:>14,}".format(stats["num_requests"]))
+    click.echo("Responses stored:  {0:>14,}".format(stats["num_responses"]))
+    click.echo("Bytes referenced:  {0:>14,}".format(stats["bytes_referenced"]))
+    click.echo("Bytes unique:      {0:>14,}".format(stats["bytes_unique"]))
+    click.echo("Bytes stored:      {0:>14,}".format(stats["bytes_stored"]))
+    click.echo(
+        "Bytes saved:       {0:>14,} ({1:.1f}%)".format(stats["bytes_saved"], saved)
+    )
+
+
+@click.command("export-parquet")
+@click.argument("directory")
+@click.option(
+    "--table",
+    "-t",
+    "tables",
+    multiple=True,
+    type=click.Choice(list(EXPORT_TABLES)),
+    help="Table to export, can be passed multiple times. Default: all tables.",
+)
+@click.option("--batch-size", "-b", type=int, default=None, help="Rows per row group.")
+@with_appcontext
+def export_parquet_command(directory: str, tables: tuple, batch_size: int) -> None:
+    """Export the tables to partitioned Parquet datasets."""
+    if pyarrow is None:
+        raise click.ClickException(PYARROW_MISSING.format("Parquet export"))
+    result = export_parquet(directory, list(tables) or None, batch_size)
+    for table, num_rows in result.items():
+        click.echo("{0:<12} {1:>12,} rows".format(table, num_rows))
+
+
+@click.command("export")
+@click.argument("filename")
+@click.option(
+    "--format",
+    "-f",
+    "file_format",
+    type=click.Choice(EXPORT_FORMATS),
+    default=None,
+    help="Output format. Default: ndjson for .ndjson/.jsonl files, else csv.",
+)
+@click.option(
+    "--gzip",
+    "-z",
+    "compress",
+    is_flag=True,
+    help="Compress with gzip, default for .gz.",
+)
+@click.option("--import-id", "-i", type=int, default=None, help="Only DOI's of import.")
+@click.option(
+    "--from",
+    "date_from",
+    type=click.DateTime(["%Y-%m-%d"]),
+    default=None,
+    help="Only DOI's published at or after date (YYYY-MM-DD).",
+)
+@click.option(
+    "--to",
+    "date_to",
+    type=click.DateTime(["%Y-%m-%d"]),
+    default=None,
+    help="Only DOI's published at or before date (YYYY-MM-DD).",
+)
+@click.option(
+    "--url-type",
+    "-u",
+    "url_types",
+    multiple=True,
+    help="Only URL's of type, can be passed multiple times.",
+)
+@click.option("--batch-size", "-b", type=int, default=None, help="Rows per fetch.")
+@with_appcontext
+def export_command(
+    filename: str,
+    file_format: str,
+    compress: bool,
+    import_id: int,
+    date_from: datetime,
+    date_to: datetime,
+    url_types: tuple,
+    batch_size: int,
+) -> None:
+    """Export the URL's with their latest Facebook counts to CSV or NDJSON."""
+    num_rows = export_engagement(
+        filename,
+        file_format=file_format,
+        compress=compress or None,
+        import_id=import_id,
+        date_from=date_from,
+        date_to=date_to,
+        url_types=list(url_types) or None,
+        batch_size=batch_size,
+    )
+    if filename != "-":
+        click.echo("{0:,} rows exported to {1}.".format(num_rows, filename))
@@ -3,13 +3,22 @@
 """ORM Models."""
 from datetime import datetime
 from datetime import timezone
+from hashlib import sha256
+from json import loads
+from typing import Optional
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_sqlalchemy.model import DefaultMeta
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.exc import IntegrityError
 
+from app.storage import SegmentStore
+from app.utils import compress
+from app.utils import decompress
+
 
 db = SQLAlchemy()
+BULK_BATCH_SIZE = 10000
 BaseModelType: DefaultMeta = db.Model
 
 
@@ -48,6 +57,11 @@ class BaseModel(BaseModelType):
 
     @classmethod
     def bulk_create(cls, db, iterable, *args, **kwargs):
+        """Create many entries through the session and return them.
+
+        Use :meth:`bulk_insert` to write many dictionaries fast, without
+        model instances.
+        """
         cls.before_bulk_create(iterable, *args, **kwargs)
         model_objs = []
         for data in iterable:
@@ -66,6 +80,106 @@ class BaseModel(BaseModelType):
         for o in model_objs:
             db.session.add(o)
 
+    @classmethod
+    def bulk_insert(
+        cls, db, rows, batch_size=BULK_BATCH_SIZE, on_conflict_do_nothing=False
+    ):
+        """Insert dictionaries without going through the unit of work.
+
+        Each batch is sent as one multi-row statement: with
+        ``execute_values`` from psycopg2 on PostgreSQL and with a Core
+        ``executemany`` on other databases (e. g. SQLite). Python-side
+        column defaults are filled in like the ORM would. No model instances
+        are created and the session is not committed. Database errors are
+        raised as :class:`sqlalchemy.exc.DBAPIError`, e. g.
+        :class:`sqlalchemy.exc.IntegrityError`, on all databases.
+
+        Parameters
+        ----------
+        db : SQLAlchemy
+            Database.
+        rows : list
+            List of :class:`dict`, keys are column names.
+        batch_size : int
+            Number of rows per statement.
+        on_conflict_do_nothing : bool
+            Skip rows, which violate a unique constraint, instead of
+            aborting the batch. Supported on PostgreSQL and SQLite.
+
+        Returns
+        -------
+        int
+            Number of rows inserted.
+
+        """
+        rows = cls._prepare_rows(rows)
+        if not rows:
+            return 0
+
+        db.session.flush()
+        dialect = db.session.get_bind().dialect
+        num_inserted = 0
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i : i + batch_size]
+            if dialect.name == "postgresql":
+                num_inserted += cls._execute_values(db, batch, on_conflict_do_nothing)
+            else:
+                stmt = cls.__table__.insert()
+                if on_conflict_do_nothing and dialect.name == "sqlite":
+                    stmt = stmt.prefix_with("OR IGNORE")
+                result = db.session.execute(stmt, batch)
+                num_inserted += result.rowcount
+        return num_inserted
+
+    @classmethod
+    def _prepare_rows(cls, rows):
+        """Give all rows the same columns and fill in the defaults."""
+        columns = [
+            col
+            for col in cls.__table__.columns
+            if col.default is not None or any(col.key in row for row in rows)
+        ]
+        prepared = []
+        for row in rows:
+            values = {}
+            for col in columns:
+                if col.key in row:
+                    values[col.key] = row[col.key]
+                elif col.default is None:
+                    values[col.key] = None
+                elif col.default.is_callable:
+                    values[col.key] = col.default.arg(None)
+                else:
+                    values[col.key] = col.default.arg
+            prepared.append(values)
+        return prepared
+
+    @classmethod
+    def _execute_values(cls, db, batch, on_conflict_do_nothing):
+        import psycopg2
+        from psycopg2.extras import execute_values
+
+        preparer = db.session.get_bind().dialect.identifier_preparer
+        keys = list(batch[0].keys())
+        sql = "INSERT INTO {0} ({1}) VALUES %s".format(
+            preparer.format_table(cls.__table__),
+            ", ".join(preparer.quote(key) for key in keys),
+        )
+        if on_conflict_do_nothing:
+            sql += " ON CONFLICT DO NOTHING"
+        with db.session.connection().connection.cursor() as cursor:
+            try:
+                execute_values(
+                    cursor,
+                    sql,
+                    [[row[key] for key in keys] for row in batch],
+                    page_size=len(batch),
+                )
+            except psycopg2.Error as e:
+                # wrapped like SQLAlchemy does, e. g. as IntegrityError
+                raise DBAPIError.instance(sql, None, e, psycopg2.Error) from e
+            return cursor.rowcount
+
     @classmethod
     def bulk_create_or_none(cls, db, iterable, *args, **kwargs):
         try:
@@ -96,6 +210,12 @@ class Import(BaseModel):
     """Imports of basic data done.
 
     source: '<file FILENAME>', '<uri URI>', 'api'
+
+    Imports posted to the API are jobs: `raw` keeps the body, which is
+    processed in the background, and the other columns its progress.
+
+    status: 'queued', 'running', 'done', 'failed'
+    errors: JSON list of the invalid entries
     """
 
     __tablename__ = "imports"
@@ -103,12 +223,47 @@ class Import(BaseModel):
     id = db.Column(db.Integer, primary_key=True)
     source = db.Column(db.String, nullable=False)
     raw = db.Column(db.Text)
+    content_type = db.Column(db.String)
+    status = db.Column(db.String)
+    message = db.Column(db.Text)
+    num_entries = db.Column(db.Integer)
+    num_processed = db.Column(db.Integer)
+    num_dois_added = db.Column(db.Integer)
+    num_urls_added = db.Column(db.Integer)
+    errors = db.Column(db.Text)
+
+    def to_dict(self) -> dict:
+        """Get the state of the import, without the raw data."""
+        return {
+            "import_id": self.id,
+            "source": self.source,
+            "status": self.status,
+            "message": self.message,
+            "num_entries": self.num_entries,
+            "num_processed": self.num_processed,
+            "num_dois_added": self.num_dois_added,
+            "num_urls_added": self.num_urls_added,
+            "errors": loads(self.errors) if self.errors else [],
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
 
     def __repr__(self):
         """Repr."""
         return "<Import {0}>".format(self.id)
 
 
+def pending_index(flag, flag_column):
+    """Partial index over the DOI's, a stage has not processed yet."""
+    predicate = flag_column == False  # noqa: E712
+    return db.Index(
+        "ix_dois_pending_{0}".format(flag),
+        "doi",
+        postgresql_where=predicate,
+        sqlite_where=predicate,
+    )
+
+
 class Doi(BaseModel):
     """Doi model.
 
@@ -116,6 +271,9 @@ class Doi(BaseModel):
     ORM.
 
     date comes as YYYY-MM-DD
+
+    The `url_*` flags mark the stages, which processed a DOI. Each stage has a
+    partial index over its pending DOI's, see :meth:`pending`.
     """
 
     __tablename__ = "dois"
@@ -134,6 +292,23 @@ class Doi(BaseModel):
     url_unpaywall = db.Column(db.Boolean, default=False)
     is_valid = db.Column(db.Boolean)
 
+    __table_args__ = (
+        pending_index("url_doi_new", url_doi_new),
+        pending_index("url_doi_old", url_doi_old),
+        pending_index("url_doi_lp", url_doi_lp),
+        pending_index("url_ncbi", url_ncbi),
+        pending_index("url_unpaywall", url_unpaywall),
+    )
+
+    @classmethod
+    def pending(cls, flag):
+        """Filter for the DOI's, where `flag` is not set yet.
+
+        Matches the predicate of the partial index of the flag, so the
+        pending DOI's are read with an index scan.
+        """
+        return getattr(cls, flag) == False  # noqa: E712
+
     def __repr__(self):
         """Repr."""
         return "<DOI {0}>".format(self.doi)
@@ -168,12 +343,88 @@ class Request(BaseModel):
     request_type = db.Column(db.String)
     response_content = db.Column(db.Text)
     response_status = db.Column(db.String)
+    response_hash = db.Column(
+        db.String(64), db.ForeignKey("responses.hash"), nullable=True
+    )
+    response = db.relationship("ResponseBody", lazy=True)
+
+    __table_args__ = (
+        db.Index("ix_requests_type_doi", "request_type", "doi"),
+        db.Index("ix_requests_request_url", "request_url"),
+    )
 
     def __repr__(self):
         """Repr."""
         return '<API Request "{0}">'.format(self.request_type)
 
 
+class ResponseBody(BaseModel):
+    """Content-addressed response body.
+
+    Stored once, compressed, and referenced by the SHA-256 hash of the
+    content. Identical responses, e. g. the NCBI response for a batch of
+    DOI's or an Unpaywall error, share one row. The compressed body is kept
+    in `body` or, with a :class:`app.storage.SegmentStore`, at `offset` in
+    a segment file.
+    """
+
+    __tablename__ = "responses"
+
+    hash = db.Column(db.String(64), primary_key=True)
+    compression = db.Column(db.String(8), nullable=False, default="gzip")
+    size = db.Column(db.Integer, nullable=False)
+    stored_size = db.Column(db.Integer, nullable=False)
+    body = db.Column(db.LargeBinary)
+    segment = db.Column(db.String, nullable=True)
+    offset = db.Column(db.BigInteger, nullable=True)
+
+    @staticmethod
+    def hash_content(content: str) -> str:
+        """Get the SHA-256 hex digest of the content."""
+        return sha256(content.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def make_row(cls, content: str, compression: str = "gzip") -> dict:
+        """Build the row of a response body for :meth:`bulk_create`."""
+        data = content.encode("utf-8")
+        body = compress(data, compression)
+        return {
+            "hash": sha256(data).hexdigest(),
+            "compression": compression,
+            "size": len(data),
+            "stored_size": len(body),
+            "body": body,
+            "segment": None,
+            "offset": None,
+        }
+
+    def read(self, store: Optional[SegmentStore] = None) -> str:
+        """Read and decompress the content.
+
+        Parameters
+        ----------
+        store : SegmentStore, optional
+            Store of the segment files, needed if the body is in a segment.
+
+        """
+        if self.segment is None:
+            body = self.body
+        elif store is None:
+            raise ValueError("Response {0} is in a segment file.".format(self.hash))
+        else:
+            body = store.read(self.segment, self.offset, self.stored_size)
+        return decompress(body, self.compression).decode("utf-8")
+
+    @property
+    def content(self) -> str:
+        """Decompressed content of a body stored in the database."""
+        return self.read()
+
+    def __repr__(self):
+        """Repr."""
+        return "<Response {0}>".format(self.hash)
+
+
 class FBRequest(BaseModel):
     """FBRequest model."""
 
@@ -187,6 +438,98 @@ class FBRequest(BaseModel):
     comments = db.Column(db.Integer)
     plugin_comments = db.Column(db.Integer)
 
+    __table_args__ = (db.Index("ix_fbrequests_url", "url"),)
+
     def __repr__(self):
         """Repr."""
         return "<Facebook Request {0}>".format(self.request)
+
+
+class FBState(BaseModel):
+    """Latest Facebook engagement of an URL and its next snapshot.
+
+    Kept up to date by the incremental `fb` runs, which only add a
+    `FBRequest` when the counts changed. `velocity` is the engagement gained
+    per day between the last two snapshots.
+    """
+
+    __tablename__ = "fb_states"
+
+    COUNTS = ("reactions", "shares", "comments", "plugin_comments")
+
+    url = db.Column(db.String, db.ForeignKey("urls.url"), primary_key=True)
+    reactions = db.Column(db.Integer)
+    shares = db.Column(db.Integer)
+    comments = db.Column(db.Integer)
+    plugin_comments = db.Column(db.Integer)
+    velocity = db.Column(db.Float, default=0.0, nullable=False)
+    num_snapshots = db.Column(db.Integer, default=0, nullable=False)
+    last_snapshot_at = db.Column(db.DateTime)
+    next_snapshot_at = db.Column(db.DateTime, index=True)
+
+    @property
+    def counts(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.COUNTS)
+
+    def record(self, counts: tuple, now: datetime) -> bool:
+        """Record a snapshot and return whether the counts changed.
+
+        The velocity is measured over at least one hour, so snapshots close
+        to each other do not inflate it.
+        """
+        changed = not self.num_snapshots or counts != self.counts
+        if self.last_snapshot_at is not None:
+            days = max((now - self.last_snapshot_at).total_seconds() / 86400, 1 / 24)
+            gained = sum(filter(None, counts)) - sum(filter(None, self.counts))
+            self.velocity = max(gained, 0) / days
+        for name, count in zip(self.COUNTS, counts):
+            setattr(self, name, count)
+        self.num_snapshots = (self.num_snapshots or 0) + 1
+        self.last_snapshot_at = now
+        self.updated_at = datetime.now(timezone.utc)
+        return changed
+
+    def __repr__(self):
+        """Repr."""
+        return "<Facebook State {0}>".format(self.url)
+
+
+class Checkpoint(BaseModel):
+    """Progress of a pipeline stage.
+
+    Saved with every batch, so an interrupted stage can be resumed after
+    the last key processed.
+
+    status: 'running', 'done'
+    """
+
+    __tablename__ = "checkpoints"
+
+    stage = db.Column(db.String, primary_key=True)
+    last_key = db.Column(db.String)
+    batch_num = db.Column(db.Integer, default=0, nullable=False)
+    num_processed = db.Column(db.Integer, default=0, nullable=False)
+    status = db.Column(db.String, default="running", nullable=False)
+
+    def reset(self):
+        self.last_key = None
+        self.batch_num = 0
+        self.num_processed = 0
+        self.status = "running"
+        self.created_at = datetime.now(timezone.utc)
+        self.updated_at = None
+
+    def advance(self, last_key, num_processed):
+        self.last_key = last_key
+        self.batch_num += 1
+        self.num_processed += num_processed
+        self.updated_at = datetime.now(timezone.utc)
+
+    def finish(self, db):
+        self.status = "done"
+        self.updated_at = datetime.now(timezone.utc)
+        db.session.commit()
+
+    def __repr__(self):
+        """Repr."""
+        return "<Checkpoint {0} {1}>".format(self.stage, self.batch_num)
@@ -0,0 +1,101 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Pipeline runner for the collection stages."""
+import time
+from collections import OrderedDict
+from concurrent.futures import as_completed
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict
+from typing import List
+
+from flask import current_app
+from flask import Flask
+from flask import g
+
+from app.db import create_doi_lp_urls
+from app.db import create_doi_new_urls
+from app.db import create_doi_old_urls
+from app.db import create_ncbi_urls
+from app.db import create_unpaywall_urls
+from app.db import get_checkpoint
+from app.db import get_db
+from app.db import get_fb_data
+from app.db import get_url_index
+from app.utils import KeyIndex
+
+
+STAGES = OrderedDict(
+    [
+        ("doi-new", create_doi_new_urls),
+        ("doi-old", create_doi_old_urls),
+        ("doi-lp", create_doi_lp_urls),
+        ("ncbi", create_ncbi_urls),
+        ("unpaywall", create_unpaywall_urls),
+        ("fb", get_fb_data),
+    ]
+)
+# Stages, which need the results of all other stages. They run afterwards.
+FINAL_STAGES = ["fb"]
+
+
+def run_pipeline(stages: List[str], jobs: int = 1, restart: bool = False) -> dict:
+    """Run collection stages and resume them from their checkpoints.
+
+    Stages creating URL's from DOI's are independent of each other and run
+    concurrently in up to `jobs` threads. Each thread has its own
+    application context and database session, but all share one URL index.
+    Stages in :data:`FINAL_STAGES` run after all others.
+
+    Parameters
+    ----------
+    stages : list
+        Names of the stages to run, see :data:`STAGES`.
+    jobs : int, optional
+        Number of stages run at the same time, by default 1
+    restart : bool, optional
+        Ignore the checkpoints and start all stages from the beginning.
+
+    Returns
+    -------
+    dict
+        Result of each stage, with `num_processed`, `duration` in seconds
+        and `throughput` per second.
+    """
+    app = current_app._get_current_object()
+    url_index = get_url_index()
+    results: Dict[str, dict] = OrderedDict()
+
+    independent = [stage for stage in stages if stage not in FINAL_STAGES]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {
+            executor.submit(_run_stage, app, stage, restart, url_index): stage
+            for stage in independent
+        }
+        for future in as_completed(futures):
+            results[futures[future]] = future.result()
+    for stage in stages:
+        if stage in FINAL_STAGES:
+            results[stage] = _run_stage(app, stage, restart, url_index)
+    return OrderedDict((stage, results[stage]) for stage in stages)
+
+
+def _run_stage(app: Flask, stage: str, restart: bool, url_index: KeyIndex) -> dict:
+    with app.app_context():
+        g.url_index = url_index
+        db = get_db()
+        checkpoint = get_checkpoint(stage, restart)
+        if checkpoint.batch_num:
+            print(
+                "Resume {0} after batch {1} ({2}).".format(
+                    stage, checkpoint.batch_num, checkpoint.last_key
+                )
+            )
+
+        start = time.perf_counter()
+        result = STAGES[stage](checkpoint=checkpoint)
+        duration = time.perf_counter() - start
+        checkpoint.finish(db)
+
+        result["duration"] = duration
+        result["throughput"] = result["num_processed"] / duration if duration else 0.0
+        return result
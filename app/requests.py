@@ -1,12 +1,31 @@
 # !/usr/bin/env python
 # -*- coding: utf-8 -*-
 """Request functions."""
+import asyncio
+import os
+import random
+import sqlite3
+import threading
+import time
+from json import dumps
 from json import loads
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Mapping
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from urllib.parse import quote
+from urllib.parse import urlencode
+from urllib.parse import urljoin
+from urllib.parse import urlsplit
 
-from facebook import GraphAPI
-from requests import get
+import aiohttp
 from requests import post
-from requests import Response
 from requests.exceptions import RequestException
 from requests.packages.urllib3 import disable_warnings
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
@@ -14,37 +33,784 @@ from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 disable_warnings(InsecureRequestWarning)
 
+MAX_REDIRECTS = 10
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# Wait time after a 429 response without a Retry-After header.
+DEFAULT_RETRY_AFTER = 60.0
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+BACKOFF_MAX = 120.0
+NCBI_IDCONV_URL = "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/"
+# Maximum number of ids per request to the NCBI ID converter.
+NCBI_MAX_IDS = 200
+UNPAYWALL_API_URL = "https://api.unpaywall.org/v2/"
+FB_GRAPH_URL = "https://graph.facebook.com/"
+FB_FIELDS = "engagement,og_object"
+# Graph API error codes of an invalid or expired access token.
+FB_TOKEN_ERRORS = (190,)
+# Pause after the app reached 100% of its Graph API usage.
+FB_USAGE_BACKOFF = 300.0
 
-def request_doi_landingpage(url: str) -> Response:
-    # TODO: Fix allow_redirects -> kwargs, params
-    return get(url, allow_redirects=True, verify=False)
 
+class TokenBucket:
+    """Token bucket rate limiter.
 
-def request_ncbi_api(url: str, ncbi_tool: str, ncbi_email: str) -> Response:
-    resp = get(
-        url,
-        params={
-            "tool": ncbi_tool,
-            "email": ncbi_email,
-            "idtype": "doi",
-            "versions": "no",
-            "format": "json",
-        },
+    Refills `rate` tokens per second up to `capacity`. Each request takes
+    one token; when the bucket is empty, the caller waits until the next
+    token is available. Thread-safe, and can be used from threads and from
+    coroutines at the same time.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens per second.
+    capacity : float, optional
+        Maximum burst size. Defaults to `rate`, but at least 1.
+
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None) -> None:
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def reserve(self) -> float:
+        """Take a token and return the seconds to wait before using it."""
+        with self._lock:
+            self._refill()
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the next `seconds`, e. g. after a 429.
+
+        Pauses do not add up: concurrent responses asking for the same pause
+        extend the wait only to the longest of them.
+        """
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -seconds * self.rate)
+
+    def set_rate(self, rate: float) -> None:
+        """Change the rate, tokens already refilled are kept."""
+        with self._lock:
+            self._refill()
+            self.rate = rate
+
+    def acquire(self) -> None:
+        """Take a token, blocking until it is available."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self) -> None:
+        """Take a token, sleeping in the event loop until it is available."""
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """Politeness scheduler for all outbound requests.
+
+    Requests to an API (e. g. `ncbi`, `unpaywall`, `fb`) take a token from
+    the budget of that API. All other requests, like resolving landing
+    pages, take a token from the bucket of their host, which is created
+    with `per_host_rate` on first use. A rate of `0` means no limit.
+
+    Parameters
+    ----------
+    per_host_rate : float
+        Requests per second allowed per host.
+
+    """
+
+    def __init__(self, per_host_rate: float = 0.0) -> None:
+        self.per_host_rate = per_host_rate
+        self._apis: Dict[str, TokenBucket] = {}
+        self._hosts: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def set_api_limit(
+        self, api: str, rate: float, capacity: Optional[float] = None
+    ) -> None:
+        """Set the budget of an API in requests per second."""
+        if rate > 0:
+            self._apis[api] = TokenBucket(rate, capacity)
+        else:
+            self._apis.pop(api, None)
+
+    def bucket(self, url: str, api: Optional[str] = None) -> Optional[TokenBucket]:
+        """Get the bucket a request is charged to, `None` if unlimited."""
+        if api is not None:
+            return self._apis.get(api)
+        if self.per_host_rate <= 0:
+            return None
+        host = urlsplit(url).hostname or ""
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = TokenBucket(self.per_host_rate)
+            return self._hosts[host]
+
+    def wait(self, url: str, api: Optional[str] = None) -> None:
+        """Block until a request to `url` is allowed."""
+        bucket = self.bucket(url, api)
+        if bucket is not None:
+            bucket.acquire()
+
+    async def wait_async(self, url: str, api: Optional[str] = None) -> None:
+        """Wait in the event loop until a request to `url` is allowed."""
+        bucket = self.bucket(url, api)
+        if bucket is not None:
+            await bucket.acquire_async()
+
+    def check_response(
+        self, url: str, api: Optional[str], status: int, headers: Mapping
+    ) -> None:
+        """Back off the bucket of a request, if it was answered with 429."""
+        if status != 429:
+            return
+        bucket = self.bucket(url, api)
+        if bucket is None:
+            return
+        try:
+            retry_after = float(headers.get("Retry-After", DEFAULT_RETRY_AFTER))
+        except ValueError:
+            retry_after = DEFAULT_RETRY_AFTER
+        bucket.pause(retry_after)
+
+
+rate_limiter = RateLimiter()
+
+
+def configure_rate_limiter(config: Any) -> None:
+    """Set the request budgets from the config.
+
+    NCBI allows 3 requests per second without and 10 with an API key.
+    """
+    rate_limiter.per_host_rate = config.HOST_RATELIMIT
+    if config.NCBI_API_KEY:
+        rate_limiter.set_api_limit("ncbi", config.NCBI_API_KEY_RATELIMIT)
+    else:
+        rate_limiter.set_api_limit("ncbi", config.NCBI_RATELIMIT)
+    rate_limiter.set_api_limit("unpaywall", config.UNPAYWALL_RATELIMIT)
+    rate_limiter.set_api_limit("fb", config.FB_HOURLY_RATELIMIT / 3600, capacity=1)
+
+
+def backoff_delay(retry: int, backoff_factor: float, jitter: float = 0.5) -> float:
+    """Exponential backoff with random jitter.
+
+    Parameters
+    ----------
+    retry : int
+        Number of the retry, starting with 1.
+    backoff_factor : float
+        Delay of the first retry in seconds, doubled for every next retry.
+    jitter : float
+        Up to this share of the delay is added randomly, so concurrent
+        workers do not retry in lock-step.
+
+    Returns
+    -------
+    float
+        Seconds to wait before the retry.
+
+    """
+    delay = backoff_factor * (2 ** (retry - 1))
+    return delay + random.uniform(0, jitter * delay)
+
+
+class RetrySettings:
+    """Retries of the :class:`AsyncFetcher`, set by :func:`configure_retries`."""
+
+    max_retries = 3
+    backoff_factor = 0.5
+
+
+def configure_retries(config: Any) -> None:
+    """Set the retries of failed requests from the config."""
+    RetrySettings.max_retries = config.HTTP_MAX_RETRIES
+    RetrySettings.backoff_factor = config.HTTP_BACKOFF_FACTOR
+
+
+class FetchResult(NamedTuple):
+    """Result of a request sent by :class:`AsyncFetcher`.
+
+    `status` is `None` and `error` is set, if no response was received.
+    """
+
+    url: str
+    status: Optional[int]
+    final_url: Optional[str]
+    content: bytes
+    headers: dict
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status is not None and self.status < 400
+
+    @property
+    def text(self) -> str:
+        return self.content.decode("utf-8", errors="replace")
+
+    def json(self) -> Any:
+        return loads(self.content)
+
+
+class HTTPCache:
+    """Interface of the HTTP cache backends.
+
+    A backend stores the results of GET requests by URL and parameters.
+    Backends are registered with :func:`register_cache_backend` and selected
+    with `HTTP_CACHE_BACKEND`, see :func:`configure_http_cache`.
+    """
+
+    def get(self, url: str, params: Optional[dict] = None) -> Optional[FetchResult]:
+        """Get a cached result, `None` on a miss."""
+        raise NotImplementedError
+
+    def set(self, url: str, params: Optional[dict], result: FetchResult) -> None:
+        """Store a result."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+def cache_key(url: str, params: Optional[dict] = None) -> str:
+    """Get the cache key of a request, the URL with the sorted parameters."""
+    if not params:
+        return url
+    separator = "&" if urlsplit(url).query else "?"
+    return url + separator + urlencode(sorted(params.items()))
+
+
+class SQLiteCache(HTTPCache):
+    """HTTP cache in an SQLite file.
+
+    Entries older than `ttl` seconds are dropped on access. If the bodies
+    stored exceed `max_size` bytes, the least recently used entries are
+    evicted down to 90% of it.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite file, its directory is created if missing.
+    max_size : int
+        Size cap of the cached bodies in bytes.
+    ttl : float
+        Seconds an entry is fresh. `0` keeps entries until evicted.
+
+    """
+
+    def __init__(self, path: str, max_size: int = 1 << 30, ttl: float = 0) -> None:
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, status INTEGER, "
+            "final_url TEXT, headers TEXT, content BLOB, size INTEGER, "
+            "created_at REAL, accessed_at REAL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_cache_accessed_at ON cache (accessed_at)"
+        )
+        (self.size,) = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache"
+        ).fetchone()
+
+    def get(self, url: str, params: Optional[dict] = None) -> Optional[FetchResult]:
+        key = cache_key(url, params)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, final_url, headers, content, size, created_at "
+                "FROM cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is not None and self.ttl > 0 and now - row[5] > self.ttl:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.size -= row[4]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self.hits += 1
+        status, final_url, headers, content, _, _ = row
+        return FetchResult(url, status, final_url, content, loads(headers))
+
+    def set(self, url: str, params: Optional[dict], result: FetchResult) -> None:
+        key = cache_key(url, params)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    result.status,
+                    result.final_url,
+                    dumps(result.headers),
+                    result.content,
+                    len(result.content),
+                    now,
+                    now,
+                ),
+            )
+            self.size += len(result.content) - (old[0] if old else 0)
+            if self.size > self.max_size:
+                self._evict(int(self.max_size * 0.9))
+
+    def _evict(self, target: int) -> None:
+        while self.size > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM cache ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+            if not rows:
+                self.size = 0
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+                self.size -= size
+                if self.size <= target:
+                    break
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class CacheSettings:
+    """HTTP cache of the requests, set by :func:`configure_http_cache`.
+
+    In offline mode a miss is not sent, but returned as error.
+    """
+
+    cache: Optional[HTTPCache] = None
+    offline = False
+
+
+_cache_backends: Dict[str, Callable[[Any], HTTPCache]] = {
+    "sqlite": lambda config: SQLiteCache(
+        config.HTTP_CACHE_PATH, config.HTTP_CACHE_MAX_SIZE, config.HTTP_CACHE_TTL
+    )
+}
+
+
+def register_cache_backend(name: str, factory: Callable[[Any], HTTPCache]) -> None:
+    """Register a cache backend, created by `factory` from the config."""
+    _cache_backends[name] = factory
+
+
+def configure_http_cache(config: Any) -> None:
+    """Set the HTTP cache from the config.
+
+    `HTTP_CACHE_MODE` is one of
+
+    - `off`: no cache.
+    - `read-through`: hits are served from the cache, misses are sent and
+      stored.
+    - `offline`: only hits are served, misses fail without network access.
+    - `replay`: like `offline` with the `replay` backend, which serves the
+      responses recorded in the database.
+
+    """
+    if CacheSettings.cache is not None:
+        CacheSettings.cache.close()
+    mode = config.HTTP_CACHE_MODE
+    if mode == "off":
+        CacheSettings.cache = None
+        CacheSettings.offline = False
+        return
+    elif mode == "replay":
+        backend = "replay"
+    elif mode in ("read-through", "offline"):
+        backend = config.HTTP_CACHE_BACKEND
+    else:
+        raise ValueError("Unknown HTTP cache mode {0}.".format(mode))
+    if backend not in _cache_backends:
+        raise ValueError("Unknown HTTP cache backend {0}.".format(backend))
+    CacheSettings.cache = _cache_backends[backend](config)
+    CacheSettings.offline = mode != "read-through"
+
+
+class AsyncFetcher:
+    """Fetch many URL's concurrently with asyncio.
+
+    All requests share one aiohttp connection pool, which keeps the
+    connections alive between batches. Use it as async context manager.
+    Requests go through the HTTP cache, if one is configured.
+
+    Parameters
+    ----------
+    concurrency : int
+        Maximum number of requests in flight overall.
+    per_host : int
+        Maximum number of requests in flight per host.
+    timeout : float
+        Total timeout per request in seconds.
+    verify : bool
+        Verify SSL certificates. Defaults to `True`.
+    api : str, optional
+        API budget of the :data:`rate_limiter` the requests are charged to.
+        If not set, each request and redirect is charged to its host.
+    max_retries : int, optional
+        Retries for 429 and 5xx responses and connection errors. Defaults to
+        :attr:`RetrySettings.max_retries`.
+    cache : bool, optional
+        Use the HTTP cache. Defaults to `True`.
+
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 20,
+        per_host: int = 5,
+        timeout: float = 30.0,
+        verify: bool = True,
+        api: Optional[str] = None,
+        max_retries: Optional[int] = None,
+        cache: bool = True,
+    ) -> None:
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.timeout = timeout
+        self.verify = verify
+        self.api = api
+        if max_retries is None:
+            max_retries = RetrySettings.max_retries
+        self.max_retries = max_retries
+        self.cache = cache
+        self.num_requests = 0
+        self.num_connections = 0
+        self.num_reused = 0
+        self.num_retries = 0
+        self.num_cached = 0
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self) -> "AsyncFetcher":
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.per_host,
+            ssl=None if self.verify else False,
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_connection_create_end.append(self._on_connection_create)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuse)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            trace_configs=[trace_config],
+        )
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def fetch(self, url: str, params: Optional[dict] = None) -> FetchResult:
+        """Send a GET request and follow redirects.
+
+        429 and 5xx responses and connection errors are retried with
+        exponential backoff and jitter. Redirects are followed one by one, so
+        every hop waits for the :data:`rate_limiter` of its host. Connection
+        errors and timeouts are returned as result with `error` set, so one
+        failing URL does not abort a batch.
+
+        Parameters
+        ----------
+        url : str
+            URL to request.
+        params : dict, optional
+            Query parameters.
+
+        Returns
+        -------
+        FetchResult
+            Final response, or the error of the last attempt.
+
+        """
+        cache = CacheSettings.cache if self.cache else None
+        if cache is not None:
+            cached = cache.get(url, params)
+            if cached is not None:
+                self.num_cached += 1
+                return cached
+            if CacheSettings.offline:
+                return FetchResult(url, None, None, b"", {}, "Not in the HTTP cache.")
+
+        for retry in range(1, self.max_retries + 1):
+            result = await self._fetch(url, params)
+            if result.status is not None and result.status not in RETRY_STATUSES:
+                break
+            self.num_retries += 1
+            await asyncio.sleep(backoff_delay(retry, RetrySettings.backoff_factor))
+        else:
+            result = await self._fetch(url, params)
+        if cache is not None and result.status not in (None,) + RETRY_STATUSES:
+            cache.set(url, params, result)
+        return result
+
+    async def _fetch(self, url: str, params: Optional[dict]) -> FetchResult:
+        assert self._session is not None, "Use AsyncFetcher as context manager."
+        current = url
+        try:
+            for _ in range(MAX_REDIRECTS + 1):
+                await rate_limiter.wait_async(current, self.api)
+                async with self._session.get(
+                    current, params=params, allow_redirects=False
+                ) as resp:
+                    rate_limiter.check_response(
+                        current, self.api, resp.status, resp.headers
+                    )
+                    location = resp.headers.get("Location")
+                    if resp.status in REDIRECT_STATUSES and location:
+                        current = urljoin(str(resp.url), location)
+                        params = None
+                        continue
+                    content = await resp.read()
+                    return FetchResult(
+                        url, resp.status, str(resp.url), content, dict(resp.headers)
+                    )
+            return FetchResult(url, None, current, b"", {}, "Too many redirects.")
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return FetchResult(url, None, None, b"", {}, repr(e))
+
+    async def fetch_many(
+        self, urls: Iterable[str], params: Optional[dict] = None
+    ) -> List[FetchResult]:
+        """Fetch URL's concurrently, results are in the order of `urls`."""
+        return list(await asyncio.gather(*(self.fetch(url, params) for url in urls)))
+
+    def stats(self) -> Dict[str, int]:
+        """Get the request, connection reuse, retry and cache counts.
+
+        Returns
+        -------
+        dict
+            `requests` sent (each redirect counts), `connections` opened,
+            `reused` connections, `retries` and responses from the HTTP
+            `cache`.
+
+        """
+        return {
+            "requests": self.num_requests,
+            "connections": self.num_connections,
+            "reused": self.num_reused,
+            "retries": self.num_retries,
+            "cached": self.num_cached,
+        }
+
+    async def _on_request_start(self, *args: Any) -> None:
+        self.num_requests += 1
+
+    async def _on_connection_create(self, *args: Any) -> None:
+        self.num_connections += 1
+
+    async def _on_connection_reuse(self, *args: Any) -> None:
+        self.num_reused += 1
+
+
+def print_fetcher_stats(fetcher: AsyncFetcher) -> None:
+    """Print the counts of :meth:`AsyncFetcher.stats`."""
+    print(
+        "{requests} HTTP requests, {connections} connections opened, {reused} "
+        "reused, {retries} retries, {cached} from the HTTP cache.".format(
+            **fetcher.stats()
+        )
     )
-    return resp
 
 
-def request_unpaywall_api(url: str) -> Response:
-    resp = get(url)
-    return resp
+def run_async(coro: Awaitable) -> Any:
+    """Run a coroutine in a new event loop and return its result."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def ncbi_idconv_url(dois: Iterable[str]) -> str:
+    """Build the URL of the NCBI ID converter for up to 200 DOI's."""
+    return "{0}?ids={1}".format(NCBI_IDCONV_URL, ",".join(quote(doi) for doi in dois))
+
+
+def ncbi_params(ncbi_tool: str, ncbi_email: str, ncbi_api_key: str = "") -> dict:
+    params = {
+        "tool": ncbi_tool,
+        "email": ncbi_email,
+        "idtype": "doi",
+        "versions": "no",
+        "format": "json",
+    }
+    if ncbi_api_key:
+        params["api_key"] = ncbi_api_key
+    return params
+
+
+def unpaywall_url(doi: str, email: str) -> str:
+    """Build the URL of the Unpaywall API for a DOI."""
+    return "{0}{1}?email={2}".format(UNPAYWALL_API_URL, quote(doi), email)
+
+
+def get_cached_graph_objects(url_list: list) -> Tuple[dict, list]:
+    """Get the Graph API objects of URL's in the HTTP cache.
+
+    Returns
+    -------
+    tuple
+        Objects found by URL and the URL's missing.
+
+    """
+    cache = CacheSettings.cache
+    objects = {}
+    missing = []
+    for url in url_list:
+        cached = cache.get(FB_GRAPH_URL, {"id": url}) if cache else None
+        if cached is not None:
+            objects[url] = cached.json()
+        else:
+            missing.append(url)
+    return objects, missing
+
+
+def cache_graph_objects(objects: dict) -> None:
+    """Store Graph API objects in the HTTP cache, one entry per URL."""
+    cache = CacheSettings.cache
+    if cache is None:
+        return
+    for url, data in objects.items():
+        content = dumps(data).encode("utf-8")
+        cache.set(
+            FB_GRAPH_URL,
+            {"id": url},
+            FetchResult(FB_GRAPH_URL, 200, FB_GRAPH_URL, content, {}),
+        )
+
+
+async def fetch_graph_objects(
+    fetcher: "AsyncFetcher", url_list: list, token: str, version: str
+) -> Tuple[dict, Optional[FetchResult]]:
+    """Get the engagement of URL's with one Graph API request.
+
+    URL's in the HTTP cache are not requested again.
+
+    Returns
+    -------
+    tuple
+        Objects by URL and the result of the request, `None` if all
+        objects were cached or the HTTP cache is offline.
+
+    """
+    objects, missing = get_cached_graph_objects(url_list)
+    if not missing or CacheSettings.offline:
+        return objects, None
+    params = {"ids": ",".join(missing), "fields": FB_FIELDS, "access_token": token}
+    result = await fetcher.fetch("{0}v{1}/".format(FB_GRAPH_URL, version), params)
+    if result.ok:
+        response = result.json()
+        cache_graph_objects(response)
+        objects.update(response)
+    return objects, result
+
+
+def graph_api_error_code(result: FetchResult) -> Optional[int]:
+    """Get the error code of a failed Graph API request."""
+    try:
+        return result.json()["error"]["code"]
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def app_usage(headers: Mapping) -> float:
+    """Get the Graph API usage of the app in percent from `X-App-Usage`.
+
+    The header holds the share of the hourly quota used for calls, total
+    time and CPU time. The largest one is returned, `0` without header.
+    """
+    try:
+        usage = loads(headers.get("X-App-Usage") or headers.get("x-app-usage") or "{}")
+        return float(max(usage.values(), default=0))
+    except (ValueError, TypeError, AttributeError):
+        return 0.0
+
+
+def pace_graph_api(usage: float, hourly_limit: float, threshold: float) -> None:
+    """Adjust the `fb` budget of the :data:`rate_limiter` to the app usage.
+
+    Below `threshold` percent the budget is `hourly_limit` requests per hour.
+    Above, the remaining quota is spread over the next hour. At 100% no
+    requests are sent for :data:`FB_USAGE_BACKOFF` seconds.
+    """
+    bucket = rate_limiter.bucket(FB_GRAPH_URL, "fb")
+    if bucket is None:
+        return
+    if usage >= 100:
+        bucket.pause(FB_USAGE_BACKOFF)
+    elif usage >= threshold:
+        bucket.set_rate(hourly_limit * (100 - usage) / 100 / 3600)
+    else:
+        bucket.set_rate(hourly_limit / 3600)
+
+
+def get_graph_api_access_token(config: Any, refresh: bool = False) -> str:
+    """Get the Graph API access token.
 
+    `FB_API_TOKEN`, if set. Otherwise an app token is requested once and
+    cached in `FB_TOKEN_FILE`.
 
-def get_graph_api(fb_api_token: str, version: str) -> GraphAPI:
-    return GraphAPI(fb_api_token, version=version)
+    Parameters
+    ----------
+    config : BaseConfig
+        Config.
+    refresh : bool, optional
+        Drop the cached app token, e. g. after it was rejected. A rejected
+        `FB_API_TOKEN` has to be replaced in the config.
 
+    Returns
+    -------
+    str
+        Access token.
 
-def get_graph_api_urls(fb_graph: GraphAPI, url_list: list) -> dict:
-    return fb_graph.get_objects(ids=url_list, fields="engagement,og_object",)
+    """
+    if config.FB_API_TOKEN:
+        return config.FB_API_TOKEN
+    filename = config.FB_TOKEN_FILE
+    if refresh and os.path.isfile(filename):
+        os.remove(filename)
+    if os.path.isfile(filename):
+        with open(filename, encoding="utf-8") as f:
+            return loads(f.read())["access_token"]
+    token = get_graph_api_token(config.FB_APP_ID, config.FB_APP_SECRET)
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(dumps({"access_token": token["access_token"]}))
+    return token["access_token"]
 
 
 def get_graph_api_token(app_id: str, app_secret: str) -> dict:
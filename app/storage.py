@@ -0,0 +1,98 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Segment file store for response bodies."""
+import os
+import threading
+import time
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+
+SEGMENT_SUFFIX = ".seg"
+_stores: Dict[str, "SegmentStore"] = {}
+_stores_lock = threading.Lock()
+
+
+class SegmentStore:
+    """Append-only store for response bodies on disk.
+
+    Bodies are appended to the current segment file, which is rolled over
+    after `max_size` bytes. A body is addressed by the name of its segment
+    and its offset, which are kept in the `responses` table together with
+    the stored size. Each store starts a new segment named after the time
+    and the process id, so several processes can write to one directory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the segment files, created if missing.
+    max_size : int
+        Size in bytes, after which a new segment is started.
+
+    """
+
+    def __init__(self, directory: str, max_size: int = 256 * 1024 * 1024) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment: Optional[str] = None
+        self._offset = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, data: bytes) -> Tuple[str, int]:
+        """Append a body and return its segment and offset."""
+        with self._lock:
+            if self._file is None or self._offset + len(data) > self.max_size:
+                self._roll()
+            offset = self._offset
+            self._file.write(data)
+            self._offset += len(data)
+            return self._segment, offset
+
+    def read(self, segment: str, offset: int, length: int) -> bytes:
+        """Read a body from its segment."""
+        with self._lock:
+            if self._file is not None and segment == self._segment:
+                self._file.flush()
+        with open(os.path.join(self.directory, segment), "rb") as f:
+            f.seek(offset)
+            return f.read(length)
+
+    def flush(self) -> None:
+        """Write the appended bodies to disk.
+
+        Called before the rows referencing them are committed, so the
+        database never points to data lost in a crash.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _roll(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        self._segment = "{0}-{1}{2}".format(
+            int(time.time() * 1e9), os.getpid(), SEGMENT_SUFFIX
+        )
+        self._file = open(os.path.join(self.directory, self._segment), "ab")
+        self._offset = 0
+
+
+def get_segment_store(directory: str, max_size: int) -> SegmentStore:
+    """Get the segment store of a directory, shared by all threads."""
+    directory = os.path.abspath(directory)
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = SegmentStore(directory, max_size)
+        return _stores[directory]
@@ -1,16 +1,73 @@
 # !/usr/bin/env python
 # -*- coding: utf-8 -*-
 """Helper functions."""
+import codecs
+import gzip
 import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from csv import DictReader
 from csv import DictWriter
 from csv import reader
 from csv import writer
+from hashlib import blake2b
+from itertools import islice
 from json import dump
 from json import dumps
+from json import JSONDecodeError
+from json import JSONDecoder
 from json import load
+from json import loads
+from typing import Any
+from typing import BinaryIO
+from typing import Dict
+from typing import Iterable
 from typing import Iterator
 from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from typing import Union
+
+import numpy as np
+from pandas import Series
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import pyarrow
+    import pyarrow.dataset
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+COMPRESSIONS = ("none", "gzip", "zstd")
+PYARROW_MISSING = (
+    "{0} needs the pyarrow package, install it with "
+    "`pip install fhecollector[arrow]`."
+)
+JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Crossref's recommended pattern and the ones for older Wiley, Elsevier,
+# ACS and Taylor & Francis DOI's, combined into one alternation.
+DOI_PATTERN = re.compile(
+    r"^(?:"
+    r"10.\d{4,9}/[-._;()/:A-Z0-9]+"
+    r"|10.1002/[^\s]+"
+    r"|10.\d{4}/\d+-\d+X?(\d+)\d+<[\d\w]+:[\d\w]*>\d+.\d+.\w+;\d"
+    r"|10.1021/\w\w\d+"
+    r"|10.1207\/[\w\d]+\&\d+_\d+"
+    r")$",
+    re.IGNORECASE,
+)
+# matched after lowercasing
+DOI_PREFIX_PATTERN = re.compile(r"^(?:doi:\s*|https?://(?:dx\.)?doi\.org/)")
+JSON_DELIMITERS = (" ", "\t", "\n", "\r", ",", "]")
 
 
 def read_file(filename: str, mode: str = "r", encoding: str = "utf-8") -> str:
@@ -114,10 +171,13 @@ def read_csv(
     delimiter: str = ",",
     quotechar: str = '"',
     encoding: str = "utf-8",
-) -> Iterator[List[str]]:
-    """Read in a CSV file.
+    chunksize: Optional[int] = None,
+) -> Iterator[Union[List[str], List[List[str]]]]:
+    """Read in a CSV file row by row.
 
-    See more at `csv <https://docs.python.org/3/library/csv.html>`_.
+    The file is opened when the iteration starts and closed when it ends or
+    the generator is closed, so only the current row (or chunk) is held in
+    memory. See more at `csv <https://docs.python.org/3/library/csv.html>`_.
 
     Parameters
     ----------
@@ -126,21 +186,26 @@ def read_csv(
     newline : str
         Newline character.
     delimiter : str
-        Cell delimiter of CSV file. Defaults to ';'.
+        Cell delimiter of CSV file. Defaults to ','.
     quotechar : str
         Quote-character of CSV file. Defaults to '"'.
     encoding : str
         Character encoding of file. Defaults to 'utf-8'.
+    chunksize : int, optional
+        Yield lists of up to `chunksize` rows instead of single rows.
 
-    Returns
-    -------
-    reader
-        Reader object, which can be iterated over.
+    Yields
+    ------
+    list
+        Cells of a row, or a chunk of rows.
 
     """
     with open(filename, newline=newline, encoding=encoding) as csvfile:
         csv_reader = reader(csvfile, delimiter=delimiter, quotechar=quotechar)
-        return csv_reader
+        if chunksize:
+            yield from iter_chunks(csv_reader, chunksize)
+        else:
+            yield from csv_reader
 
 
 def write_csv(
@@ -177,6 +242,51 @@ def write_csv(
             csv_writer.writerow(row)
 
 
+def iter_csv_as_dicts(
+    filename: str,
+    newline: str = "",
+    delimiter: str = ",",
+    quotechar: str = '"',
+    encoding: str = "utf-8",
+    chunksize: Optional[int] = None,
+) -> Iterator[Union[dict, List[dict]]]:
+    """Read in a CSV file as :class:`dict` per row.
+
+    Like :func:`read_csv`, the file is read lazily and closed with the
+    generator. The header row contains the column names, which are the keys
+    of the :class:`dict`.
+
+    Parameters
+    ----------
+    filename : str
+        Filename with full path.
+    newline : str
+        Newline character.
+    delimiter : str
+        Cell delimiter of CSV file. Defaults to ','.
+    quotechar : str
+        Quote-character of CSV file. Defaults to '"'.
+    encoding : str
+        Character encoding of file. Defaults to 'utf-8'.
+    chunksize : int, optional
+        Yield lists of up to `chunksize` rows instead of single rows, e. g.
+        to write them in batches to the database.
+
+    Yields
+    ------
+    dict
+        Row with the column names as keys, or a chunk of rows.
+
+    """
+    with open(filename, "r", newline=newline, encoding=encoding) as csvfile:
+        csv_reader = DictReader(csvfile, delimiter=delimiter, quotechar=quotechar)
+        rows = (dict(row) for row in csv_reader)
+        if chunksize:
+            yield from iter_chunks(rows, chunksize)
+        else:
+            yield from rows
+
+
 def read_csv_as_dicts(
     filename: str,
     newline: str = "",
@@ -187,8 +297,8 @@ def read_csv_as_dicts(
     """Read in CSV file into a list of :class:`dict`.
 
     This offers an easy import functionality of your data from CSV files.
-    See more at
-    `csv <https://docs.python.org/3/library/csv.html>`_.
+    For large files use :func:`iter_csv_as_dicts`, which does not load the
+    whole file.
 
     CSV file structure:
     1) The header row contains the column names.
@@ -202,7 +312,7 @@ def read_csv_as_dicts(
     newline : str
         Newline character.
     delimiter : str
-        Cell delimiter of CSV file. Defaults to ';'.
+        Cell delimiter of CSV file. Defaults to ','.
     quotechar : str
         Quote-character of CSV file. Defaults to '"'.
     encoding : str
@@ -215,26 +325,43 @@ def read_csv_as_dicts(
         named after the columen names.
 
     """
-    with open(filename, "r", newline=newline, encoding=encoding) as csvfile:
-        reader = DictReader(csvfile, delimiter=delimiter, quotechar=quotechar)
-        data = []
-        for row in reader:
-            data.append(dict(row))
-    return data
+    return list(
+        iter_csv_as_dicts(
+            filename,
+            newline=newline,
+            delimiter=delimiter,
+            quotechar=quotechar,
+            encoding=encoding,
+        )
+    )
+
+
+def iter_chunks(iterable: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Split an iterable into lists of up to `size` items, lazily."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
 
 
 def write_dicts_as_csv(
-    data: dict, fieldnames: list, filename: str, delimiter: str = ","
+    data: Iterable[dict], fieldnames: list, filename: str, delimiter: str = ","
 ) -> None:
     """Write :class:`dict` to a CSV file.
 
     This offers an easy export functionality of your data to a CSV files.
     See more at `csv <https://docs.python.org/3/library/csv.html>`_.
 
+    The rows are written one by one, so `data` can be a generator. Values,
+    which are a :class:`dict` or :class:`list`, are written as JSON, the
+    rows passed are not changed.
+
     Parameters
     ----------
-    data : dict
-        Dictionary with columns as keys, to be written in the CSV file.
+    data : Iterable
+        Dictionaries with columns as keys, to be written in the CSV file.
     fieldnames : list
         Sequence of keys that identify the order of the columns.
     filename : str
@@ -250,10 +377,141 @@ def write_dicts_as_csv(
         csv_writer.writeheader()
 
         for d in data:
-            for key, val in d.items():
-                if isinstance(val, dict) or isinstance(val, list):
-                    d[key] = dumps(val)
-            csv_writer.writerow(d)
+            csv_writer.writerow(
+                {
+                    key: dumps(val) if isinstance(val, (dict, list)) else val
+                    for key, val in d.items()
+                }
+            )
+
+
+def compress(data: bytes, compression: str = "gzip") -> bytes:
+    """Compress data.
+
+    Parameters
+    ----------
+    data : bytes
+        Data to compress.
+    compression : str
+        One of :data:`COMPRESSIONS`. `zstd` needs the `zstandard` package.
+
+    Returns
+    -------
+    bytes
+        Compressed data.
+
+    """
+    if compression == "gzip":
+        return gzip.compress(data)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package.")
+        return zstandard.ZstdCompressor().compress(data)
+    elif compression == "none":
+        return data
+    raise ValueError("Unknown compression {0}.".format(compression))
+
+
+def decompress(data: bytes, compression: str = "gzip") -> bytes:
+    """Decompress data compressed with :func:`compress`."""
+    if compression == "gzip":
+        return gzip.decompress(data)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstd compression needs the zstandard package.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif compression == "none":
+        return data
+    raise ValueError("Unknown compression {0}.".format(compression))
+
+
+def iter_json_array(stream: BinaryIO, chunk_size: int = 64 * 1024) -> Iterator[Any]:
+    """Parse the items of a JSON array, while it is read.
+
+    Only the current chunk and the item being parsed are held in memory,
+    not the whole document.
+
+    Parameters
+    ----------
+    stream : BinaryIO
+        UTF-8 encoded JSON array.
+    chunk_size : int, optional
+        Number of bytes read at once.
+
+    Yields
+    ------
+    Any
+        The items of the array.
+
+    Raises
+    ------
+    ValueError
+        If the stream is no valid JSON array.
+
+    """
+    decoder = JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    pos = 0
+    eof = False
+    # "[", then "first" (an item or "]"), then "," or "]" and "item"
+    expected = "["
+
+    while True:
+        pos = JSON_WHITESPACE.match(buffer, pos).end()
+        if pos < len(buffer):
+            char = buffer[pos]
+            if expected == "[":
+                if char != "[":
+                    raise ValueError("No JSON array.")
+                pos += 1
+                expected = "first"
+                continue
+            if char == "]" and expected in ("first", ","):
+                return
+            if expected == ",":
+                if char != ",":
+                    raise ValueError("Expected , or ] in JSON array.")
+                pos += 1
+                expected = "item"
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except JSONDecodeError:
+                end = None
+            # an item is complete, when a delimiter follows, numbers at the
+            # end of the buffer may go on in the next chunk
+            if end is not None and (eof or buffer[end : end + 1] in JSON_DELIMITERS):
+                yield item
+                pos = end
+                expected = ","
+                continue
+        if eof:
+            raise ValueError("Invalid JSON array.")
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + text_decoder.decode(chunk, final=eof)
+        pos = 0
+
+
+def iter_ndjson(stream: BinaryIO) -> Iterator[Any]:
+    """Parse newline delimited JSON, one line at a time.
+
+    Empty lines are skipped.
+
+    Raises
+    ------
+    ValueError
+        If a line is no valid JSON.
+
+    """
+    for num, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            yield loads(line)
+        except ValueError:
+            raise ValueError("Invalid JSON in line {0}.".format(num))
 
 
 def is_valid_doi(doi: str) -> bool:
@@ -262,7 +520,7 @@ def is_valid_doi(doi: str) -> bool:
     Parameters
     ----------
     doi : string
-        A single DOI to be validated.
+        A single DOI to be validated, see :data:`DOI_PATTERN`.
 
     Returns
     -------
@@ -270,14 +528,241 @@ def is_valid_doi(doi: str) -> bool:
         True, if DOI is valid, False if not.
 
     """
-    patterns = [
-        r"^10.\d{4,9}/[-._;()/:A-Z0-9]+$",
-        r"^10.1002/[^\s]+$",
-        r"^10.\d{4}/\d+-\d+X?(\d+)\d+<[\d\w]+:[\d\w]*>\d+.\d+.\w+;\d$",
-        r"^10.1021/\w\w\d+$",
-        r"^10.1207\/[\w\d]+\&\d+_\d+$",
-    ]
-    for pat in patterns:
-        if re.match(pat, doi, re.IGNORECASE):
-            return True
-    return False
+    return DOI_PATTERN.match(doi) is not None
+
+
+def normalize_doi(doi: str) -> str:
+    """Normalize a DOI.
+
+    Surrounding whitespace and a `doi:`, `https://doi.org/` or
+    `http://dx.doi.org/` prefix are removed, and the DOI is lowercased, as
+    DOI's are case insensitive.
+    """
+    return DOI_PREFIX_PATTERN.sub("", doi.strip().lower())
+
+
+def validate_dois(
+    dois: Iterable[str], normalize: bool = True
+) -> List[Tuple[str, bool]]:
+    """Normalize and validate DOI's in one pass.
+
+    Parameters
+    ----------
+    dois : Iterable
+        DOI's.
+    normalize : bool, optional
+        Normalize the DOI's with :func:`normalize_doi`, by default True
+
+    Returns
+    -------
+    list
+        Tuples of the (normalized) DOI and whether it is valid.
+
+    """
+    match = DOI_PATTERN.match
+    sub = DOI_PREFIX_PATTERN.sub
+    result = []
+    for doi in dois:
+        if normalize:
+            doi = sub("", doi.strip().lower())
+        result.append((doi, match(doi) is not None))
+    return result
+
+
+def validate_doi_series(dois: Series, normalize: bool = True) -> Tuple[Series, Series]:
+    """Normalize and validate a column of DOI's at once.
+
+    The vectorized variant of :func:`validate_dois` for pandas chunks.
+    Missing values and values, which are no strings, are not valid.
+
+    Parameters
+    ----------
+    dois : Series
+        DOI's.
+    normalize : bool, optional
+        Normalize the DOI's like :func:`normalize_doi`, by default True
+
+    Returns
+    -------
+    tuple
+        (Normalized) DOI's and a boolean mask of the valid ones.
+
+    """
+    # The patterns are passed as strings with `case`, so pandas can use its
+    # own string kernels, where available.
+    if normalize:
+        dois = dois.str.strip().str.lower()
+        dois = dois.str.replace(DOI_PREFIX_PATTERN.pattern, "", regex=True)
+    mask = dois.str.match(DOI_PATTERN.pattern, case=False, na=False)
+    return dois, mask.astype(bool)
+
+
+class KeyIndex:
+    """Membership index for URL's and DOI's.
+
+    Used by the pipeline stages to check, if an URL or DOI is already in the
+    database, without scanning a list. Keys are kept in a :class:`set`, so
+    lookups take constant time.
+
+    With `hashed=True` only a 64-bit hash of each key is kept. New hashes are
+    collected in a :class:`set` and merged from time to time into a sorted
+    NumPy array, which needs 8 bytes per key. This is meant for corpora with
+    tens of millions of URL's, where the strings do not fit into memory.
+    Lookups in the sorted array are done by binary search. Hash collisions
+    are possible, but very unlikely (about 1 in 10^8 for 10^6 keys).
+
+    The index can be shared by stages running in different threads, all
+    access goes through a lock.
+
+    Parameters
+    ----------
+    keys : iterable
+        Keys to fill the index with.
+    hashed : bool
+        Store 64-bit hashes instead of the keys. Defaults to `False`.
+    merge_size : int
+        Minimum number of new hashes collected, before they are merged into
+        the sorted array. Defaults to `100000`.
+
+    """
+
+    def __init__(
+        self, keys: Iterable[str] = (), hashed: bool = False, merge_size: int = 100000
+    ) -> None:
+        self.hashed = hashed
+        self.merge_size = merge_size
+        self._keys: Set[Union[str, int]] = set()
+        self._sorted = np.empty(0, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self.update(keys)
+
+    def __contains__(self, key: str) -> bool:
+        if not self.hashed:
+            with self._lock:
+                return key in self._keys
+        key_hash = self.hash_key(key)
+        with self._lock:
+            if key_hash in self._keys:
+                return True
+            pos = np.searchsorted(self._sorted, np.uint64(key_hash))
+            return bool(pos < len(self._sorted) and self._sorted[pos] == key_hash)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._keys) + len(self._sorted)
+
+    @staticmethod
+    def hash_key(key: str) -> int:
+        """Hash a key to an unsigned 64-bit integer.
+
+        Parameters
+        ----------
+        key : str
+            Key to be hashed.
+
+        Returns
+        -------
+        int
+            64-bit hash of the key.
+
+        """
+        digest = blake2b(key.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little")
+
+    def add(self, key: str) -> None:
+        """Add a key to the index.
+
+        Parameters
+        ----------
+        key : str
+            Key to be added.
+
+        """
+        self._add_all([self.hash_key(key) if self.hashed else key])
+
+    def contains_many(self, keys: Iterable[str]) -> np.ndarray:
+        """Check many keys at once.
+
+        With `hashed=True` the hashes are looked up in the sorted array in
+        one vectorized call.
+
+        Parameters
+        ----------
+        keys : iterable
+            Keys to be checked.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask, True for the keys in the index.
+
+        """
+        keys = keys.tolist() if hasattr(keys, "tolist") else list(keys)
+        if not self.hashed:
+            with self._lock:
+                return np.fromiter(
+                    (key in self._keys for key in keys), dtype=bool, count=len(keys)
+                )
+        hashes = np.fromiter(
+            (self.hash_key(key) for key in keys), dtype=np.uint64, count=len(keys)
+        )
+        with self._lock:
+            pending = np.fromiter(self._keys, dtype=np.uint64, count=len(self._keys))
+            found = np.isin(hashes, self._sorted)
+        return found | np.isin(hashes, pending)
+
+    def update(self, keys: Iterable[str]) -> None:
+        """Add keys to the index.
+
+        Parameters
+        ----------
+        keys : iterable
+            Keys to be added.
+
+        """
+        if self.hashed:
+            keys = [self.hash_key(key) for key in keys]
+        self._add_all(keys)
+
+    def _add_all(self, keys: Iterable[Union[str, int]]) -> None:
+        with self._lock:
+            if not self.hashed:
+                self._keys.update(keys)
+                return
+            for key_hash in keys:
+                self._keys.add(key_hash)
+                # Merge geometrically, so the array is not re-sorted every time.
+                if len(self._keys) >= max(self.merge_size, len(self._sorted) // 8):
+                    self._merge()
+
+    def _merge(self) -> None:
+        # called with the lock held
+        pending = np.fromiter(self._keys, dtype=np.uint64, count=len(self._keys))
+        self._sorted = np.union1d(self._sorted, pending)
+        self._keys = set()
+
+
+class StepTimer:
+    """Sum up the time spent in each step of a loop.
+
+    Example::
+
+        timer = StepTimer()
+        for chunk in chunks:
+            with timer("parse"):
+                ...
+        print(timer.durations)
+
+    """
+
+    def __init__(self) -> None:
+        self.durations: Dict[str, float] = OrderedDict()
+
+    @contextmanager
+    def __call__(self, step: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.durations[step] = self.durations.get(step, 0.0) + duration
@@ -0,0 +1,88 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark writing `Url` rows with `BaseModel.bulk_insert`.
+
+Compares the ORM path (`BaseModel.bulk_create`, model instances added to
+the session one by one) with the bulk insert path (dictionaries sent with
+executemany or execute_values).
+
+Usage::
+
+    FLASK_ENV=testing python benchmarks/bulk_create.py --rows 1000000
+    FLASK_ENV=testing python benchmarks/bulk_create.py --db postgresql://localhost/fhe_bench
+"""
+import argparse
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.main import create_app  # noqa: E402
+from app.models import Doi  # noqa: E402
+from app.models import Url  # noqa: E402
+
+
+def make_rows(num_rows: int) -> list:
+    return [
+        {
+            "url": "https://doi.org/10.1234/bench.{0}".format(i),
+            "doi": "10.1234/bench",
+            "url_type": "doi_new",
+        }
+        for i in range(num_rows)
+    ]
+
+
+def run(db, label: str, rows: list, as_objects: bool) -> None:
+    db.drop_all()
+    db.create_all()
+    db.session.add(Doi(doi="10.1234/bench"))
+    db.session.commit()
+
+    start = time.perf_counter()
+    if as_objects:
+        Url.bulk_create(db, rows)
+    else:
+        Url.bulk_insert(db, rows)
+        db.session.commit()
+    duration = time.perf_counter() - start
+    assert db.session.query(Url).count() == len(rows)
+    print(
+        "{0:<12} {1:>10,} rows {2:>8.1f}s {3:>12,.0f} rows/s".format(
+            label, len(rows), duration, len(rows) / duration
+        )
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--db", default=None, help="Database URI, default SQLite.")
+    args = parser.parse_args()
+
+    tmp_dir = tempfile.mkdtemp()
+    os.environ["SQLALCHEMY_DATABASE_URI"] = args.db or "sqlite:///{0}".format(
+        os.path.join(tmp_dir, "bench.db")
+    )
+    app = create_app()
+    with app.app_context():
+        from app.db import get_db
+
+        db = get_db()
+        print(
+            "Python {0}, {1}".format(
+                platform.python_version(), db.session.get_bind().dialect.name
+            )
+        )
+        rows = make_rows(args.rows)
+        run(db, "orm", rows, as_objects=True)
+        db.session.remove()
+        run(db, "bulk_insert", rows, as_objects=False)
+        db.drop_all()
+
+
+if __name__ == "__main__":
+    main()
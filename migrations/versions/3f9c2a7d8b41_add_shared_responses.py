@@ -0,0 +1,41 @@
+"""add shared responses
+
+Revision ID: 3f9c2a7d8b41
+Revises: e1da4748b7d9
+Create Date: 2026-10-18 11:02:17.264839
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9c2a7d8b41'
+down_revision = 'e1da4748b7d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'responses',
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('hash', sa.String(length=64), nullable=False),
+        sa.Column('content', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('hash'),
+    )
+    with op.batch_alter_table('requests') as batch_op:
+        batch_op.add_column(
+            sa.Column('response_hash', sa.String(length=64), nullable=True)
+        )
+        batch_op.create_foreign_key(
+            'fk_requests_response_hash', 'responses', ['response_hash'], ['hash']
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('requests') as batch_op:
+        batch_op.drop_constraint('fk_requests_response_hash', type_='foreignkey')
+        batch_op.drop_column('response_hash')
+    op.drop_table('responses')
@@ -0,0 +1,25 @@
+"""add requests type doi index
+
+Revision ID: 5d20b8e91c6a
+Revises: c47a19e5f2d3
+Create Date: 2026-10-18 13:15:52.640127
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5d20b8e91c6a'
+down_revision = 'c47a19e5f2d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_requests_type_doi', 'requests', ['request_type', 'doi'], unique=False
+    )
+
+
+def downgrade():
+    op.drop_index('ix_requests_type_doi', table_name='requests')
@@ -0,0 +1,134 @@
+"""compress response store
+
+Moves the response bodies of existing requests into the content-addressed
+response store, compressed with gzip.
+
+Revision ID: 8b6e0d4c5a17
+Revises: 3f9c2a7d8b41
+Create Date: 2026-10-18 11:48:05.917342
+
+"""
+import gzip
+from hashlib import sha256
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b6e0d4c5a17'
+down_revision = '3f9c2a7d8b41'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 10000
+
+requests = sa.table(
+    'requests',
+    sa.column('id', sa.Integer),
+    sa.column('response_content', sa.Text),
+    sa.column('response_hash', sa.String),
+)
+responses = sa.table(
+    'responses',
+    sa.column('hash', sa.String),
+    sa.column('content', sa.Text),
+    sa.column('compression', sa.String),
+    sa.column('size', sa.Integer),
+    sa.column('body', sa.LargeBinary),
+)
+
+
+def make_row(content):
+    data = content.encode('utf-8')
+    return {
+        'hash': sha256(data).hexdigest(),
+        'compression': 'gzip',
+        'size': len(data),
+        'body': gzip.compress(data),
+    }
+
+
+def upgrade():
+    connection = op.get_bind()
+    with op.batch_alter_table('responses') as batch_op:
+        batch_op.add_column(sa.Column('compression', sa.String(length=8)))
+        batch_op.add_column(sa.Column('size', sa.Integer()))
+        batch_op.add_column(sa.Column('body', sa.LargeBinary()))
+
+    # compress the bodies already shared
+    for hash_, content in connection.execute(
+        sa.select([responses.c.hash, responses.c.content])
+    ).fetchall():
+        row = make_row(content or '')
+        connection.execute(
+            responses.update()
+            .where(responses.c.hash == hash_)
+            .values(compression='gzip', size=row['size'], body=row['body'])
+        )
+
+    # move the bodies of the requests, in batches by id
+    last_id = 0
+    while True:
+        batch = connection.execute(
+            sa.select([requests.c.id, requests.c.response_content])
+            .where(requests.c.id > last_id)
+            .where(requests.c.response_content.isnot(None))
+            .order_by(requests.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not batch:
+            break
+        rows = {}
+        references = []
+        for request_id, content in batch:
+            row = make_row(content)
+            rows.setdefault(row['hash'], row)
+            references.append({'request_id': request_id, 'hash': row['hash']})
+        existing = {
+            hash_
+            for hash_, in connection.execute(
+                sa.select([responses.c.hash]).where(responses.c.hash.in_(list(rows)))
+            )
+        }
+        new_rows = [row for hash_, row in rows.items() if hash_ not in existing]
+        if new_rows:
+            connection.execute(responses.insert(), new_rows)
+        connection.execute(
+            requests.update()
+            .where(requests.c.id == sa.bindparam('request_id'))
+            .values(response_hash=sa.bindparam('hash'), response_content=None),
+            references,
+        )
+        last_id = batch[-1][0]
+
+    with op.batch_alter_table('responses') as batch_op:
+        batch_op.alter_column('compression', nullable=False)
+        batch_op.alter_column('size', nullable=False)
+        batch_op.drop_column('content')
+
+
+def downgrade():
+    connection = op.get_bind()
+    with op.batch_alter_table('responses') as batch_op:
+        batch_op.add_column(sa.Column('content', sa.Text(), nullable=True))
+
+    for hash_, compression, body in connection.execute(
+        sa.select([responses.c.hash, responses.c.compression, responses.c.body])
+    ).fetchall():
+        if compression == 'gzip':
+            body = gzip.decompress(body)
+        elif compression != 'none':
+            raise RuntimeError(
+                'Cannot downgrade {0} compressed responses.'.format(compression)
+            )
+        connection.execute(
+            responses.update()
+            .where(responses.c.hash == hash_)
+            .values(content=body.decode('utf-8'))
+        )
+
+    with op.batch_alter_table('responses') as batch_op:
+        batch_op.drop_column('body')
+        batch_op.drop_column('size')
+        batch_op.drop_column('compression')
@@ -0,0 +1,27 @@
+"""add replay indexes
+
+Revision ID: a93f6c0e7b25
+Revises: 5d20b8e91c6a
+Create Date: 2026-10-18 14:02:09.318774
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93f6c0e7b25'
+down_revision = '5d20b8e91c6a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'ix_requests_request_url', 'requests', ['request_url'], unique=False
+    )
+    op.create_index('ix_fbrequests_url', 'fbrequests', ['url'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_fbrequests_url', table_name='fbrequests')
+    op.drop_index('ix_requests_request_url', table_name='requests')
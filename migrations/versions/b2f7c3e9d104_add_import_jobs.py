@@ -0,0 +1,39 @@
+"""add import jobs
+
+Revision ID: b2f7c3e9d104
+Revises: e6b4d2f81a90
+Create Date: 2026-10-18 18:12:45.930271
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b2f7c3e9d104'
+down_revision = 'e6b4d2f81a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('imports', sa.Column('content_type', sa.String(), nullable=True))
+    op.add_column('imports', sa.Column('status', sa.String(), nullable=True))
+    op.add_column('imports', sa.Column('message', sa.Text(), nullable=True))
+    op.add_column('imports', sa.Column('num_entries', sa.Integer(), nullable=True))
+    op.add_column('imports', sa.Column('num_processed', sa.Integer(), nullable=True))
+    op.add_column('imports', sa.Column('num_dois_added', sa.Integer(), nullable=True))
+    op.add_column('imports', sa.Column('num_urls_added', sa.Integer(), nullable=True))
+    op.add_column('imports', sa.Column('errors', sa.Text(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('imports') as batch_op:
+        batch_op.drop_column('errors')
+        batch_op.drop_column('num_urls_added')
+        batch_op.drop_column('num_dois_added')
+        batch_op.drop_column('num_processed')
+        batch_op.drop_column('num_entries')
+        batch_op.drop_column('message')
+        batch_op.drop_column('status')
+        batch_op.drop_column('content_type')
@@ -0,0 +1,33 @@
+"""add response segments
+
+Revision ID: c47a19e5f2d3
+Revises: 8b6e0d4c5a17
+Create Date: 2026-10-18 12:31:44.082615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47a19e5f2d3'
+down_revision = '8b6e0d4c5a17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('responses') as batch_op:
+        batch_op.add_column(sa.Column('stored_size', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('segment', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('offset', sa.BigInteger(), nullable=True))
+    op.execute('UPDATE responses SET stored_size = COALESCE(length(body), 0)')
+    with op.batch_alter_table('responses') as batch_op:
+        batch_op.alter_column('stored_size', nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('responses') as batch_op:
+        batch_op.drop_column('offset')
+        batch_op.drop_column('segment')
+        batch_op.drop_column('stored_size')
@@ -0,0 +1,42 @@
+"""add pending work indexes
+
+Revision ID: e1da4748b7d9
+Revises: 
+Create Date: 2026-10-18 10:12:41.503112
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1da4748b7d9'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+PENDING_FLAGS = [
+    'url_doi_new',
+    'url_doi_old',
+    'url_doi_lp',
+    'url_ncbi',
+    'url_unpaywall',
+]
+
+
+def upgrade():
+    for flag in PENDING_FLAGS:
+        predicate = sa.text('{0} = false'.format(flag))
+        op.create_index(
+            'ix_dois_pending_{0}'.format(flag),
+            'dois',
+            ['doi'],
+            unique=False,
+            postgresql_where=predicate,
+            sqlite_where=predicate,
+        )
+
+
+def downgrade():
+    for flag in PENDING_FLAGS:
+        op.drop_index('ix_dois_pending_{0}'.format(flag), table_name='dois')
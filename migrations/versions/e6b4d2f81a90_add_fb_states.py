@@ -0,0 +1,46 @@
+"""add fb states
+
+Revision ID: e6b4d2f81a90
+Revises: a93f6c0e7b25
+Create Date: 2026-10-18 16:41:27.504913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6b4d2f81a90'
+down_revision = 'a93f6c0e7b25'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'fb_states',
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('url', sa.String(), nullable=False),
+        sa.Column('reactions', sa.Integer(), nullable=True),
+        sa.Column('shares', sa.Integer(), nullable=True),
+        sa.Column('comments', sa.Integer(), nullable=True),
+        sa.Column('plugin_comments', sa.Integer(), nullable=True),
+        sa.Column('velocity', sa.Float(), nullable=False),
+        sa.Column('num_snapshots', sa.Integer(), nullable=False),
+        sa.Column('last_snapshot_at', sa.DateTime(), nullable=True),
+        sa.Column('next_snapshot_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['url'], ['urls.url'], ),
+        sa.PrimaryKeyConstraint('url')
+    )
+    op.create_index(
+        op.f('ix_fb_states_next_snapshot_at'),
+        'fb_states',
+        ['next_snapshot_at'],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(op.f('ix_fb_states_next_snapshot_at'), table_name='fb_states')
+    op.drop_table('fb_states')
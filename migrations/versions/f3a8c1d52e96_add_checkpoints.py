@@ -0,0 +1,34 @@
+"""add checkpoints
+
+Revision ID: f3a8c1d52e96
+Revises: b2f7c3e9d104
+Create Date: 2026-10-18 19:12:44.180235
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8c1d52e96'
+down_revision = 'b2f7c3e9d104'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'checkpoints',
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.Column('stage', sa.String(), nullable=False),
+        sa.Column('last_key', sa.String(), nullable=True),
+        sa.Column('batch_num', sa.Integer(), nullable=False),
+        sa.Column('num_processed', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('stage')
+    )
+
+
+def downgrade():
+    op.drop_table('checkpoints')
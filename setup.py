@@ -67,6 +67,11 @@ INSTALL_REQUIREMENTS = [
 
 TESTS_REQUIREMENTS: List = []
 
+EXTRAS_REQUIREMENTS = {
+    # Parquet/Feather import and export, 6.0.1 is the last release for py36
+    "arrow": ["pyarrow==6.0.1"],
+}
+
 CLASSIFIERS = [
     # How mature is this project? Common values are
     #   2 - Pre-Alpha
@@ -98,6 +103,7 @@ setup(
     platforms=["OS Independent"],
     classifiers=CLASSIFIERS,
     install_requires=INSTALL_REQUIREMENTS,
+    extras_require=EXTRAS_REQUIREMENTS,
     packages=find_packages(exclude=("tests",)),
     tests_require=TESTS_REQUIREMENTS,
     cmdclass={"test": Tox},
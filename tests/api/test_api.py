@@ -1,11 +1,24 @@
 # !/usr/bin/env python
 # -*- coding: utf-8 -*-
 """Test API."""
+import time
+from datetime import datetime
+from json import dumps
 from json import loads
 
+import pytest
 from flask import jsonify
 from flask import request
 
+from app.db import drop_db
+from app.db import get_db
+from app.db import init_db
+from app.models import Doi
+from app.models import Import
+
+
+API_HEADERS = {"X-API-Key": "secret", "Content-Type": "application/json"}
+
 
 def api_add_data_response():
     response = {"api_version": "1.0", "status": "on"}
@@ -26,16 +39,149 @@ def test_v1(client):
     assert 200 == rv.status_code
 
 
-# def test_add_data(client):
-#     """Start with a blank database."""
-#
-#     rv = client.get("/api/v1/add_data")
-#     assert 200 == rv.status_code
-#     assert api_add_data_response() == loads(rv.data)
-#
-#     response = client.post(
-#         '/api/v1/add_data',
-#         data={"doi": "10.22230/src.2014v5n2a172", "url": "http://src-online.ca/index.php/src/article/view/172", "url_type": "ojs"},
-#         headers={"X-API-Key": client.config["API_TOKEN"]}
-#     )
-#     assert 'http://localhost/auth/login' == response.headers['Location']
+@pytest.fixture
+def api_app(app):
+    app.config["API_TOKEN"] = "secret"
+    app.config["API_IMPORT_WORKERS"] = 0
+    with app.app_context():
+        drop_db()
+        init_db()
+    return app
+
+
+def test_add_data(api_app):
+    entries = [
+        {
+            "doi": "10.22230/src.2014v5n2a172",
+            "url": "http://src-online.ca/index.php/src/article/view/172",
+            "url_type": "ojs",
+            "date": "2014-12-01",
+        },
+        {"doi": "10.22230/src.2014v5n2a173"},
+        {"doi": "no doi"},
+        {"doi": "10.22230/src.2014v5n2a174", "url": "https://example.org"},
+        {"doi": "10.22230/src.2014v5n2a175", "date": "01.12.2014"},
+        "10.22230/src.2014v5n2a176",
+        {"doi": "10.22230/src.2014v5n2a172"},
+    ]
+    rv = api_app.test_client().post(
+        "/api/v1/add_data", data=dumps(entries), headers=API_HEADERS
+    )
+
+    assert 200 == rv.status_code
+    content = loads(rv.data)["content"]
+    assert content["num_entries"] == 7
+    assert content["num_dois_added"] == 2
+    assert content["num_urls_added"] == 1
+    assert [error["index"] for error in content["errors"]] == [2, 3, 4, 5]
+    assert content["errors"][0]["doi"] == "no doi"
+    assert content["errors"][1]["error"] == (
+        "URL type None is not one of the allowed types."
+    )
+    with api_app.app_context():
+        db = get_db()
+        doi = db.session.query(Doi).get("10.22230/src.2014v5n2a172")
+        assert doi.import_id == content["import_id"]
+        assert doi.date_published == datetime(2014, 12, 1)
+        assert db.session.query(Import).get(content["import_id"]).source == "api"
+
+    # stored DOI's are kept
+    rv = api_app.test_client().post(
+        "/api/v1/add_data", data=dumps(entries[:2]), headers=API_HEADERS
+    )
+    assert loads(rv.data)["content"]["num_dois_added"] == 0
+
+
+def test_add_data_ndjson(api_app):
+    body = "\n".join(
+        dumps(
+            {
+                "doi": "10.1234/{0}".format(i),
+                "url": "https://example.org/{0}".format(i),
+                "url_type": "ojs",
+            }
+        )
+        for i in range(1000)
+    )
+    rv = api_app.test_client().post(
+        "/api/v1/add_data",
+        data=body,
+        headers={"X-API-Key": "secret", "Content-Type": "application/x-ndjson"},
+    )
+
+    assert 200 == rv.status_code
+    content = loads(rv.data)["content"]
+    assert content["num_dois_added"] == 1000
+    assert content["num_urls_added"] == 1000
+    assert content["errors"] == []
+
+
+@pytest.mark.parametrize(
+    "headers,data,status_code",
+    [
+        ({}, "[]", 401),
+        ({"X-API-Key": "wrong"}, "[]", 401),
+        ({"X-API-Key": "secret", "Content-Type": "text/plain"}, "[]", 415),
+    ],
+)
+def test_add_data_rejected(api_app, headers, data, status_code):
+    rv = api_app.test_client().post("/api/v1/add_data", data=data, headers=headers)
+
+    assert status_code == rv.status_code
+    assert loads(rv.data)["status"] == "error"
+    with api_app.app_context():
+        assert get_db().session.query(Import).count() == 0
+
+
+@pytest.mark.parametrize(
+    "data,message",
+    [
+        ("{}", "No JSON array."),
+        ("[{},", "Invalid JSON array."),
+        (dumps([{"doi": "10.1234/1"}] * 3), "More than 2 entries."),
+    ],
+)
+def test_add_data_failed(api_app, monkeypatch, data, message):
+    monkeypatch.setenv("API_MAX_ENTRIES", "2")
+    rv = api_app.test_client().post("/api/v1/add_data", data=data, headers=API_HEADERS)
+
+    assert 400 == rv.status_code
+    assert loads(rv.data)["content"] == message
+    with api_app.app_context():
+        db = get_db()
+        db_imp = db.session.query(Import).one()
+        assert db_imp.status == "failed"
+        assert db_imp.message == message
+        assert db.session.query(Doi).count() == 0
+
+
+def test_add_data_queued(api_app, monkeypatch):
+    monkeypatch.setenv("URL_BATCH_SIZE", "100")
+    api_app.config["API_IMPORT_WORKERS"] = 2
+    client = api_app.test_client()
+    entries = [{"doi": "10.1234/{0}".format(i)} for i in range(1000)]
+    entries.append({"doi": "invalid"})
+    rv = client.post("/api/v1/add_data", data=dumps(entries), headers=API_HEADERS)
+
+    assert 202 == rv.status_code
+    content = loads(rv.data)["content"]
+    assert content["status"] == "queued"
+    for _ in range(100):
+        rv = client.get(content["url"], headers=API_HEADERS)
+        assert 200 == rv.status_code
+        state = loads(rv.data)["content"]
+        if state["status"] in ("done", "failed"):
+            break
+        time.sleep(0.1)
+    assert state["status"] == "done"
+    assert state["num_entries"] == 1001
+    assert state["num_processed"] == 1001
+    assert state["num_dois_added"] == 1000
+    assert state["errors"] == [
+        {"index": 1000, "doi": "invalid", "error": "DOI invalid is not valid."}
+    ]
+
+    rv = client.get("/api/v1/imports/9999", headers=API_HEADERS)
+    assert 404 == rv.status_code
+    rv = client.get(content["url"])
+    assert 401 == rv.status_code
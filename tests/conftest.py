@@ -2,7 +2,14 @@
 # -*- coding: utf-8 -*-
 """conftest"""
 import os
-import tempfile
+import socketserver
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from json import dumps
+from threading import Thread
+from urllib.parse import parse_qs
+from urllib.parse import unquote
+from urllib.parse import urlsplit
 
 import pytest
 
@@ -42,3 +49,118 @@ def client(app):
 @pytest.fixture
 def runner(app):
     return app.test_cli_runner()
+
+
+def idconv_records(path):
+    query = parse_qs(urlsplit(path).query)
+    records = []
+    for doi in query["ids"][0].split(","):
+        record = {"doi": doi}
+        if doi.endswith("pmc"):
+            record["pmcid"] = record["pmid"] = doi.split("/")[-1]
+        records.append(record)
+    return {"status": "ok", "records": records}
+
+
+def unpaywall_record(path):
+    doi = unquote(urlsplit(path).path[len("/unpaywall/") :])
+    return {
+        "doi": doi,
+        "doi_url": "https://doi.org/" + doi,
+        "oa_locations": [
+            {
+                "url": "https://repo.example.org/" + doi,
+                "url_for_pdf": "https://repo.example.org/" + doi + ".pdf",
+                "url_for_landing_page": None,
+            }
+        ],
+    }
+
+
+APP_USAGE = dumps({"call_count": 10, "total_time": 20, "total_cputime": 5})
+
+
+def graph_objects(path):
+    query = parse_qs(urlsplit(path).query)
+    objects = {}
+    for url in query["ids"][0].split(","):
+        objects[url] = {"id": url}
+        if not url.endswith("noeng"):
+            objects[url]["engagement"] = {
+                "reaction_count": 1,
+                "share_count": 2,
+                "comment_count": 3,
+                "comment_plugin_count": 4,
+            }
+    return objects
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """HTTP server with a thread per request (part of http.server since 3.7)."""
+
+    daemon_threads = True
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Redirects `/doi/<id>` to `/landing/<id>`, which returns a page.
+
+    `/flaky` answers every second request with 503. `/idconv/?ids=...` answers
+    like the NCBI ID converter, DOI's ending with `pmc` have a PMC and a PM id.
+    `/unpaywall/<doi>` answers like the Unpaywall API with one OA location.
+    `/v3.1/?ids=...` answers like the Graph API, URL's ending with `noeng`
+    have no engagement.
+    """
+
+    protocol_version = "HTTP/1.1"
+    flaky_calls = 0
+
+    def do_GET(self):
+        if self.path == "/flaky":
+            # Fails on every second call.
+            StubHandler.flaky_calls += 1
+            if StubHandler.flaky_calls % 2:
+                self.send_error(503)
+                return
+            self.path = "/landing/flaky"
+        if self.path.startswith("/idconv/"):
+            self.send_json(idconv_records(self.path))
+        elif self.path.startswith("/unpaywall/"):
+            self.send_json(unpaywall_record(self.path))
+        elif self.path.startswith("/v3.1/"):
+            self.send_json(graph_objects(self.path), {"X-App-Usage": APP_USAGE})
+        elif self.path.startswith("/doi/"):
+            self.send_response(302)
+            self.send_header("Location", self.path.replace("/doi/", "/landing/"))
+            self.end_headers()
+        elif self.path.startswith("/landing/"):
+            body = "<html>{0}</html>".format(self.path).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_error(404)
+
+    def send_json(self, data, headers=None):
+        body = dumps(data).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{0}".format(server.server_port)
+    server.shutdown()
+    server.server_close()
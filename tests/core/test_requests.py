@@ -0,0 +1,199 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test requests."""
+import time
+
+from app.requests import app_usage
+from app.requests import AsyncFetcher
+from app.requests import CacheSettings
+from app.requests import FetchResult
+from app.requests import get_graph_api_access_token
+from app.requests import ncbi_idconv_url
+from app.requests import pace_graph_api
+from app.requests import rate_limiter
+from app.requests import RateLimiter
+from app.requests import run_async
+from app.requests import SQLiteCache
+from app.requests import TokenBucket
+
+
+def test_async_fetcher(stub_server, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "per_host_rate", 0)
+    urls = [stub_server + "/doi/{0}".format(i) for i in range(10)]
+    urls.append(stub_server + "/missing")
+
+    async def fetch():
+        async with AsyncFetcher(concurrency=4, per_host=2, timeout=5) as fetcher:
+            return await fetcher.fetch_many(urls)
+
+    results = run_async(fetch())
+
+    assert [result.url for result in results] == urls
+    for i, result in enumerate(results[:10]):
+        assert result.status == 200
+        assert result.final_url == stub_server + "/landing/{0}".format(i)
+        assert result.text == "<html>/landing/{0}</html>".format(i)
+    assert results[10].status == 404
+    assert not results[10].ok
+
+
+def test_async_fetcher_connection_error():
+    async def fetch():
+        async with AsyncFetcher(timeout=5, max_retries=0) as fetcher:
+            return await fetcher.fetch("http://127.0.0.1:1/")
+
+    result = run_async(fetch())
+
+    assert result.status is None
+    assert result.error
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+    bucket.pause(0.1)
+    assert bucket.reserve() >= 0.1
+
+
+def test_token_bucket_pause():
+    bucket = TokenBucket(rate=10, capacity=1)
+    bucket.pause(1.0)
+    bucket.pause(1.0)
+    # the second pause does not stack on the first one
+    assert 1.0 <= bucket.reserve() <= 1.2
+    bucket.pause(0.5)
+    assert 1.0 <= bucket.reserve() <= 1.3
+
+
+def test_rate_limiter():
+    limiter = RateLimiter(per_host_rate=2)
+    limiter.set_api_limit("ncbi", 10)
+
+    assert limiter.bucket("https://www.ncbi.nlm.nih.gov/pmc/", "ncbi").rate == 10
+    host_bucket = limiter.bucket("https://example.org/a")
+    assert host_bucket is limiter.bucket("https://example.org/b")
+    assert host_bucket is not limiter.bucket("https://example.com/a")
+    assert limiter.bucket("https://example.org/a", "unpaywall") is None
+
+    limiter.check_response("https://example.org/a", None, 429, {"Retry-After": "5"})
+    assert host_bucket.reserve() > 4
+
+
+def test_async_fetcher_stats(stub_server, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "per_host_rate", 0)
+    monkeypatch.setattr("app.requests.RetrySettings.backoff_factor", 0.01)
+
+    async def fetch():
+        async with AsyncFetcher(concurrency=1, cache=False) as fetcher:
+            for _ in range(3):
+                result = await fetcher.fetch(stub_server + "/flaky")
+                assert result.status == 200
+            return fetcher.stats()
+
+    stats = run_async(fetch())
+    assert stats["retries"] == 3
+    assert stats["requests"] == 6
+    assert stats["connections"] + stats["reused"] == 6
+    assert stats["reused"] >= 1
+
+
+def test_ncbi_idconv_url():
+    assert ncbi_idconv_url(["10.1234/a", "10.1234/<b>"]) == (
+        "https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/"
+        "?ids=10.1234/a,10.1234/%3Cb%3E"
+    )
+
+
+def test_sqlite_cache(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), max_size=25, ttl=0)
+    for i in range(3):
+        url = "https://example.org/{0}".format(i)
+        cache.set(url, {"b": 2, "a": 1}, FetchResult(url, 200, url, b"x" * 10, {}))
+        # keep the first entry recently used
+        assert cache.get("https://example.org/0", {"a": 1, "b": 2}) is not None
+
+    # least recently used entry evicted down to 90% of the size cap
+    assert cache.get("https://example.org/1", {"a": 1, "b": 2}) is None
+    assert cache.get("https://example.org/2", {"a": 1, "b": 2}).content == b"x" * 10
+    assert cache.size == 20
+    cache.close()
+
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), ttl=0.01)
+    assert cache.size == 20
+    time.sleep(0.02)
+    assert cache.get("https://example.org/0", {"a": 1, "b": 2}) is None
+    cache.close()
+
+
+def test_async_fetcher_cache(stub_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "per_host_rate", 0)
+    monkeypatch.setattr(
+        CacheSettings, "cache", SQLiteCache(str(tmp_path / "cache.sqlite"))
+    )
+    urls = [stub_server + "/doi/{0}".format(i) for i in range(3)]
+
+    async def fetch():
+        async with AsyncFetcher(timeout=5) as fetcher:
+            results = await fetcher.fetch_many(urls)
+            return results, await fetcher.fetch_many(urls), fetcher.num_cached
+
+    results, cached, num_cached = run_async(fetch())
+
+    assert num_cached == 3
+    assert [result.final_url for result in cached] == [
+        result.final_url for result in results
+    ]
+
+    # offline, misses are not sent
+    monkeypatch.setattr(CacheSettings, "offline", True)
+
+    async def fetch_offline():
+        async with AsyncFetcher(timeout=5) as fetcher:
+            return await fetcher.fetch_many(urls + [stub_server + "/doi/new"])
+
+    results = run_async(fetch_offline())
+    assert all(result.ok for result in results[:3])
+    assert results[3].error == "Not in the HTTP cache."
+
+
+def test_pace_graph_api(monkeypatch):
+    limiter = RateLimiter()
+    limiter.set_api_limit("fb", 3600 / 3600, capacity=1)
+    monkeypatch.setattr("app.requests.rate_limiter", limiter)
+    headers = {"X-App-Usage": '{"call_count": 80, "total_time": 10}'}
+    bucket = limiter.bucket("https://graph.facebook.com/", "fb")
+
+    assert app_usage(headers) == 80
+    assert app_usage({}) == 0
+    pace_graph_api(app_usage(headers), 3600, 75)
+    assert round(bucket.rate, 3) == 0.2
+    pace_graph_api(10, 3600, 75)
+    assert bucket.rate == 1
+    pace_graph_api(100, 3600, 75)
+    assert bucket.reserve() > 200
+
+
+def test_graph_api_access_token(tmp_path, monkeypatch):
+    class Config:
+        FB_API_TOKEN = ""
+        FB_APP_ID = "id"
+        FB_APP_SECRET = "secret"
+        FB_TOKEN_FILE = str(tmp_path / "fb-token.json")
+
+    tokens = iter(["token-1", "token-2"])
+    monkeypatch.setattr(
+        "app.requests.get_graph_api_token",
+        lambda app_id, app_secret: {"access_token": next(tokens)},
+    )
+
+    assert get_graph_api_access_token(Config) == "token-1"
+    # cached in the token file
+    assert get_graph_api_access_token(Config) == "token-1"
+    assert get_graph_api_access_token(Config, refresh=True) == "token-2"
+    # a configured token isn't replaced by an app token
+    Config.FB_API_TOKEN = "configured"
+    assert get_graph_api_access_token(Config, refresh=True) == "configured"
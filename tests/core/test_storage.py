@@ -0,0 +1,27 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test storage."""
+import os
+
+from app.storage import get_segment_store
+from app.storage import SegmentStore
+
+
+def test_segment_store(tmp_path):
+    store = SegmentStore(str(tmp_path), max_size=10)
+    bodies = [b"abcd", b"efgh", b"ijklmnop", b""]
+    locations = [store.append(body) for body in bodies]
+    store.flush()
+
+    # rolled over to a new segment after 10 bytes
+    assert locations[0][0] == locations[1][0] != locations[2][0]
+    assert locations[1][1] == 4
+    for (segment, offset), body in zip(locations, bodies):
+        assert store.read(segment, offset, len(body)) == body
+    store.close()
+    assert len(os.listdir(str(tmp_path))) == 2
+
+
+def test_get_segment_store(tmp_path):
+    store = get_segment_store(str(tmp_path), 100)
+    assert get_segment_store(str(tmp_path / "."), 100) is store
@@ -0,0 +1,169 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test utils."""
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from json import dumps
+
+import pytest
+from pandas import Series
+
+from app.utils import compress
+from app.utils import decompress
+from app.utils import is_valid_doi
+from app.utils import iter_chunks
+from app.utils import iter_csv_as_dicts
+from app.utils import iter_json_array
+from app.utils import iter_ndjson
+from app.utils import KeyIndex
+from app.utils import normalize_doi
+from app.utils import read_csv
+from app.utils import read_csv_as_dicts
+from app.utils import validate_doi_series
+from app.utils import validate_dois
+from app.utils import write_dicts_as_csv
+from app.utils import zstandard
+
+
+@pytest.mark.parametrize("hashed", [False, True])
+def test_key_index(hashed):
+    index = KeyIndex(["https://doi.org/10.1/a"], hashed=hashed, merge_size=2)
+    index.update(["https://doi.org/10.1/b", "https://doi.org/10.1/c"])
+    index.add("https://doi.org/10.1/d")
+
+    assert len(index) == 4
+    for key in "abcd":
+        assert "https://doi.org/10.1/" + key in index
+    keys = Series(["https://doi.org/10.1/a", "https://doi.org/10.1/x"])
+    assert list(index.contains_many(keys)) == [True, False]
+    assert list(index.contains_many(["https://doi.org/10.1/d"])) == [True]
+    assert "https://doi.org/10.1/e" not in index
+
+
+@pytest.mark.parametrize("hashed", [False, True])
+def test_key_index_concurrent(hashed):
+    index = KeyIndex(hashed=hashed, merge_size=16)
+
+    def add_keys(thread):
+        keys = ["https://example.org/{0}/{1}".format(thread, i) for i in range(2000)]
+        for key in keys:
+            index.add(key)
+            assert key in index
+        index.update(key + "/u" for key in keys)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(add_keys, range(8)))
+
+    assert len(index) == 8 * 2000 * 2
+    keys = [
+        "https://example.org/{0}/{1}".format(t, i) for t in range(8) for i in (0, 1999)
+    ]
+    assert index.contains_many(keys).all()
+
+
+@pytest.mark.parametrize("compression", ["none", "gzip", "zstd"])
+def test_compress(compression):
+    if compression == "zstd" and zstandard is None:
+        pytest.skip("zstandard not installed")
+    data = b'{"records": []}' * 100
+    compressed = compress(data, compression)
+
+    assert decompress(compressed, compression) == data
+    if compression != "none":
+        assert len(compressed) < len(data)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 64 * 1024])
+def test_iter_json_array(chunk_size):
+    items = [{"doi": "10.1234/{0}".format(i), "title": "Ü]" * i} for i in range(50)]
+    items += [1, 2.5, "a", None, [1, [2]]]
+    data = dumps(items, ensure_ascii=False, indent=2).encode("utf-8")
+
+    assert list(iter_json_array(BytesIO(data), chunk_size)) == items
+    assert list(iter_json_array(BytesIO(b" [ ] "), chunk_size)) == []
+    for invalid in [b"", b"{}", b"[1,]", b"[1 2]", b"[1"]:
+        with pytest.raises(ValueError):
+            list(iter_json_array(BytesIO(invalid), chunk_size))
+
+
+def test_iter_ndjson():
+    stream = BytesIO(b'{"doi": "10.1234/1"}\n\n{"doi": "10.1234/2"}\n')
+    assert list(iter_ndjson(stream)) == [{"doi": "10.1234/1"}, {"doi": "10.1234/2"}]
+    with pytest.raises(ValueError, match="line 2"):
+        list(iter_ndjson(BytesIO(b'{"doi": "10.1234/1"}\n{')))
+
+
+@pytest.mark.parametrize(
+    "doi,valid",
+    [
+        ("10.22230/src.2014v5n2a172", True),
+        ("10.1002/(SICI)1097-4571(199806)49:8<693::AID-ASI4>3.0.CO;2-O", True),
+        ("10.1021/ac0354342", True),
+        ("10.1207/s15327752jpa8503_01", True),
+        ("10.1207/S15327752&1_2", True),
+        ("https://doi.org/10.1234/abc", False),
+        ("10.1234/abc def", False),
+        ("11.1234/abc", False),
+        ("", False),
+    ],
+)
+def test_is_valid_doi(doi, valid):
+    assert is_valid_doi(doi) is valid
+
+
+def test_validate_dois():
+    dois = [
+        " 10.1234/ABC ",
+        "doi:10.1234/abc",
+        "DOI: 10.1234/abc",
+        "https://doi.org/10.1234/abc",
+        "http://dx.doi.org/10.1234/abc",
+        "abc",
+    ]
+    assert normalize_doi(dois[0]) == "10.1234/abc"
+    assert validate_dois(dois) == [("10.1234/abc", True)] * 5 + [("abc", False)]
+    assert validate_dois(dois[:2], normalize=False) == [
+        (" 10.1234/ABC ", False),
+        ("doi:10.1234/abc", False),
+    ]
+
+    normalized, mask = validate_doi_series(Series(dois + [None]))
+    assert list(normalized[:6]) == [doi for doi, _ in validate_dois(dois)]
+    assert list(mask) == [True] * 5 + [False, False]
+    _, mask = validate_doi_series(Series(["10.1234/ABC", " 10.1234/abc"]), False)
+    assert list(mask) == [True, False]
+
+
+def test_write_dicts_as_csv(tmp_path):
+    filename = str(tmp_path / "data.csv")
+    data = [{"doi": "10.1234/1", "meta": {"a": 1}}, {"doi": "10.1234/2", "meta": [1]}]
+    write_dicts_as_csv((d for d in data), ["doi", "meta"], filename)
+
+    assert data[0]["meta"] == {"a": 1}
+    assert read_csv_as_dicts(filename) == [
+        {"doi": "10.1234/1", "meta": '{"a": 1}'},
+        {"doi": "10.1234/2", "meta": "[1]"},
+    ]
+
+
+def test_read_csv(tmp_path):
+    filename = str(tmp_path / "data.csv")
+    with open(filename, "w") as f:
+        f.write("doi,url\n10.1234/1,https://a.org\n10.1234/2,\n10.1234/3,x\n")
+
+    rows = read_csv(filename)
+    assert next(rows) == ["doi", "url"]
+    assert list(rows) == [
+        ["10.1234/1", "https://a.org"],
+        ["10.1234/2", ""],
+        ["10.1234/3", "x"],
+    ]
+    assert [len(chunk) for chunk in read_csv(filename, chunksize=3)] == [3, 1]
+
+    chunks = list(iter_csv_as_dicts(filename, chunksize=2))
+    assert chunks == [
+        [{"doi": "10.1234/1", "url": "https://a.org"}, {"doi": "10.1234/2", "url": ""}],
+        [{"doi": "10.1234/3", "url": "x"}],
+    ]
+    assert list(iter_csv_as_dicts(filename)) == chunks[0] + chunks[1]
+    assert list(iter_chunks(iter([]), 2)) == []
@@ -0,0 +1,69 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test CRUD functions."""
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.crud import create_entities
+from app.crud import get_all
+from app.crud import insert_entities
+from app.crud import iter_all
+from app.crud import iter_batches
+from app.db import drop_db
+from app.db import get_db
+from app.db import init_db
+from app.models import Doi
+from app.models import Url
+
+
+def test_iter_all(app):
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        dois = [{"doi": "10.1234/{0:04d}".format(i)} for i in range(250)]
+        create_entities(db, Doi, dois)
+
+        assert len(get_all(db, Doi)) == 250
+        batches = list(iter_batches(db, Doi, columns=["doi"], chunk_size=100))
+        assert [len(batch) for batch in batches] == [100, 100, 50]
+        assert batches[0][0] == ("10.1234/0000",)
+        assert [row.doi for row in iter_all(db, Doi, after="10.1234/0247")] == [
+            "10.1234/0248",
+            "10.1234/0249",
+        ]
+        filters = [Doi.doi.like("10.1234/001%")]
+        assert len(list(iter_all(db, Doi, filters=filters, chunk_size=3))) == 10
+
+
+def test_bulk_create_on_conflict(app):
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(db, Doi, [{"doi": "10.1234/a"}])
+        urls = [
+            {
+                "url": "https://doi.org/10.1234/a",
+                "doi": "10.1234/a",
+                "url_type": "doi_new",
+            },
+            {"url": "http://dx.doi.org/10.1234/a", "doi": "10.1234/a"},
+        ]
+        db_urls = create_entities(db, Url, urls[:1])
+        assert isinstance(db_urls[0], Url)
+        num_inserted = insert_entities(
+            db, Url, urls, {"on_conflict_do_nothing": True, "batch_size": 1}
+        )
+
+        assert num_inserted == 1
+        assert Url.bulk_insert(db, urls, on_conflict_do_nothing=True) == 0
+        with pytest.raises(IntegrityError):
+            insert_entities(db, Url, urls[:1])
+        db.session.rollback()
+        db.session.expunge_all()
+        assert Url.bulk_create_or_none(db, [urls[0]]) is None
+        assert len(get_all(db, Url)) == 2
+        doi = get_all(db, Doi)[0]
+        assert doi.url_doi_new is False
+        assert doi.created_at is not None
@@ -1,9 +1,42 @@
 # !/usr/bin/env python
 # -*- coding: utf-8 -*-
 """Test database."""
+from datetime import datetime
+from datetime import timedelta
+from urllib.parse import quote
+
 import pytest
 
+from app.crud import create_entities
+from app.crud import get_all
+from app.db import create_doi_lp_urls
+from app.db import create_doi_new_urls
+from app.db import create_doi_old_urls
+from app.db import create_ncbi_urls
+from app.db import create_unpaywall_urls
+from app.db import drop_db
 from app.db import get_db
+from app.db import get_fb_data
+from app.db import get_response_stats
+from app.db import get_stats
+from app.db import get_url_index
+from app.db import import_basedata
+from app.db import init_db
+from app.db import landingpage_body
+from app.db import ReplayCache
+from app.db import snapshot_interval
+from app.db import write_responses
+from app.models import Doi
+from app.models import FBRequest
+from app.models import FBState
+from app.models import Request
+from app.models import ResponseBody
+from app.models import Url
+from app.requests import AsyncFetcher
+from app.requests import CacheSettings
+from app.requests import FetchResult
+from app.requests import rate_limiter
+from app.storage import SegmentStore
 
 
 def test_get_db(app):
@@ -15,3 +48,408 @@ def test_get_db(app):
 def test_init_db(runner):
     result = runner.invoke(args=["init-db"])
     assert result
+
+
+@pytest.mark.parametrize("chunksize", [2, 100])
+def test_import_basedata_chunked(app, tmp_path, chunksize):
+    filename = tmp_path / "basedata.csv"
+    filename.write_text(
+        "doi,url,url_type,date_published\n"
+        "10.22230/src.2010v1n2a24,http://src-online.ca/src/article/view/24,ojs,2010-01-01\n"
+        "10.22230/src.2010v1n2a25,http://src-online.ca/src/article/view/25,ojs,2010-01-02\n"
+        "10.22230/src.2010v1n2a24,http://src-online.ca/src/article/view/99,ojs,2010-01-01\n"
+        "no-doi,http://src-online.ca/src/article/view/26,ojs,2010-01-03\n"
+        "10.22230/src.2010v1n2a27,http://src-online.ca/src/article/view/25,ojs,2010-01-04\n"
+        "doi:10.22230/SRC.2010v1n2a28,http://src-online.ca/src/article/view/28,,"
+        "2010-01-05\n"
+        "10.22230/src.2010v1n2a29,,ojs,2010-13-01\n"
+        "10.22230/src.2010v1n2a30,http://src-online.ca/src/article/view/30,ojs,\n"
+    )
+    with app.app_context():
+        result = import_basedata(str(filename), reset=True, chunksize=chunksize)
+        db = get_db()
+        doi = db.session.query(Doi).get("10.22230/src.2010v1n2a25")
+        assert doi.date_published == datetime(2010, 1, 2)
+        url = db.session.query(Url).get("http://src-online.ca/src/article/view/28")
+        assert url.doi == "10.22230/src.2010v1n2a28"
+        assert url.url_type is None
+        # a DOI without a date is skipped together with its URL
+        assert db.session.query(Doi).get("10.22230/src.2010v1n2a30") is None
+        assert (
+            db.session.query(Url).get("http://src-online.ca/src/article/view/30")
+            is None
+        )
+        # a duplicate URL skips the URL only, in the same chunk or a later one
+        doi = db.session.query(Doi).get("10.22230/src.2010v1n2a27")
+        assert doi is not None
+        url = db.session.query(Url).get("http://src-online.ca/src/article/view/25")
+        assert url.doi == "10.22230/src.2010v1n2a25"
+
+    assert result["num_dois_added"] == 4
+    assert result["num_urls_added"] == 3
+    assert result["dois_invalid"] == ["no-doi"]
+    assert list(result["timings"]) == [
+        "read",
+        "validate",
+        "dedup",
+        "filter",
+        "dates",
+        "records",
+        "write",
+    ]
+
+
+@pytest.mark.parametrize("server_side", [False, True])
+def test_create_doi_urls(app, server_side):
+    dois = ["10.1234/abc-1.2_3~4", "10.1002/(SICI)1097<3::AID>", "10.1234/ä b;c"]
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(db, Doi, [{"doi": doi} for doi in dois])
+        create_entities(
+            db, Url, [{"url": "https://doi.org/" + dois[0], "doi": dois[0]}]
+        )
+
+        url_index = get_url_index()
+        start = datetime.utcnow()
+        result_new = create_doi_new_urls(server_side=server_side)
+        result_old = create_doi_old_urls(server_side=server_side)
+
+        assert result_new == {"num_processed": 3, "num_urls_added": 2}
+        assert result_old == {"num_processed": 3, "num_urls_added": 3}
+        urls = {(url.url, url.doi) for url in get_all(db, Url)}
+        for doi in dois:
+            assert ("https://doi.org/" + doi, doi) in urls
+            assert ("http://dx.doi.org/" + quote(doi), doi) in urls
+            assert "http://dx.doi.org/" + quote(doi) in url_index
+            assert "https://doi.org/" + doi in url_index
+        assert all(doi.url_doi_new and doi.url_doi_old for doi in get_all(db, Doi))
+        # naive UTC, like the rows written through the ORM
+        url = db.session.query(Url).get("http://dx.doi.org/" + quote(dois[0]))
+        assert start <= url.created_at <= datetime.utcnow()
+
+
+def test_create_doi_lp_urls(app, stub_server, monkeypatch):
+    fetch = AsyncFetcher.fetch
+
+    async def fetch_stub(self, url, params=None):
+        return await fetch(
+            self, url.replace("https://doi.org/", stub_server + "/doi/"), params
+        )
+
+    monkeypatch.setattr(AsyncFetcher, "fetch", fetch_stub)
+    monkeypatch.setattr(rate_limiter, "per_host_rate", 0)
+    dois = ["10.1234/1", "10.1234/2"]
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(db, Doi, [{"doi": doi} for doi in dois])
+
+        create_doi_new_urls()
+        result = create_doi_lp_urls()
+
+        assert result["num_processed"] == 2
+        assert result["num_requests_added"] == 2
+        assert result["num_urls_added"] == 2
+        urls = db.session.query(Url).filter(Url.url_type == "doi_lp").all()
+        assert sorted(url.url for url in urls) == [
+            stub_server + "/landing/" + doi for doi in dois
+        ]
+        assert all(doi.url_doi_lp for doi in get_all(db, Doi))
+
+
+def test_create_ncbi_urls(app, stub_server, monkeypatch):
+    monkeypatch.setattr("app.requests.NCBI_IDCONV_URL", stub_server + "/idconv/")
+    monkeypatch.setattr("app.requests.NCBI_MAX_IDS", 2)
+    monkeypatch.setattr("app.db.NCBI_MAX_IDS", 2)
+    monkeypatch.setattr(rate_limiter, "per_host_rate", 0)
+    dois = ["10.1234/1pmc", "10.1234/2", "10.1234/3pmc"]
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(db, Doi, [{"doi": doi} for doi in dois])
+
+        result = create_ncbi_urls()
+
+        assert result["num_processed"] == 3
+        assert result["num_urls_added"] == 4
+        assert result["num_requests_added"] == 3
+        assert result["num_failed"] == 0
+        # one response per request to NCBI, shared by its DOI's
+        assert db.session.query(ResponseBody).count() == 2
+        requests = get_all(db, Request)
+        assert requests[0].response_hash == requests[1].response_hash
+        assert requests[0].response_content is None
+        assert requests[0].response.content.startswith('{"status": "ok"')
+        assert {url.url_type for url in get_all(db, Url)} == {"pm", "pmc"}
+        assert all(doi.url_ncbi for doi in get_all(db, Doi))
+
+
+def test_get_stats(app):
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(
+            db,
+            Doi,
+            [
+                {"doi": "10.1234/1", "url_doi_new": True, "url_unpaywall": True},
+                {"doi": "10.1234/2", "url_doi_new": True},
+                {"doi": "10.1234/3"},
+            ],
+        )
+        create_entities(
+            db,
+            Url,
+            [
+                {"url": "https://doi.org/10.1234/1", "doi": "10.1234/1"},
+                {"url": "https://doi.org/10.1234/2", "doi": "10.1234/2"},
+                {"url": "https://example.org/1", "doi": "10.1234/1"},
+            ],
+        )
+        db.session.query(Url).filter(Url.url.like("https://doi.org/%")).update(
+            {"url_type": "doi_new"}, synchronize_session=False
+        )
+        db.session.query(Url).filter(Url.url == "https://example.org/1").update(
+            {"url_type": "unpaywall"}, synchronize_session=False
+        )
+        create_entities(
+            db, Request, [{"doi": "10.1234/1", "request_type": "unpaywall"}]
+        )
+
+        stats = get_stats(max_age=0)
+        assert stats["imports"] == 0
+        assert stats["dois"]["num"] == 3
+        assert stats["dois"]["new"] == 2
+        assert stats["dois"]["unpaywall"] == 1
+        assert stats["dois"]["lp"] == 0
+        assert stats["urls"] == {
+            "num": 3,
+            "new": 2,
+            "old": 0,
+            "lp": 0,
+            "pm": 0,
+            "pmc": 0,
+            "unpaywall": 1,
+            "ojs": 0,
+        }
+        assert stats["requests"]["num"] == 1
+        assert stats["requests"]["unpaywall"] == 1
+        assert stats["fbrequests"] == 0
+
+        create_entities(db, Doi, [{"doi": "10.1234/4"}])
+        assert get_stats()["dois"]["num"] == 3
+        assert get_stats(max_age=0)["dois"]["num"] == 4
+
+
+def test_response_stats(app, runner):
+    content = '{"records": [' + ", ".join(['{"doi": "10.1234/1"}'] * 50) + "]}"
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(db, Doi, [{"doi": "10.1234/1"}])
+        row = ResponseBody.make_row(content)
+        create_entities(db, ResponseBody, [row])
+        create_entities(
+            db,
+            Request,
+            [{"doi": "10.1234/1", "response_hash": row["hash"]} for _ in range(3)],
+        )
+
+        stats = get_response_stats()
+
+    assert stats["num_requests"] == 3
+    assert stats["num_responses"] == 1
+    assert stats["bytes_referenced"] == 3 * len(content)
+    assert stats["bytes_unique"] == len(content)
+    assert stats["bytes_stored"] == len(row["body"])
+    assert stats["bytes_saved"] == 3 * len(content) - len(row["body"])
+
+    result = runner.invoke(args=["responses-report"])
+    assert result.exit_code == 0
+    assert "Bytes saved" in result.output
+
+
+def test_landingpage_body():
+    result = FetchResult(
+        "https://doi.org/10.1234/1",
+        200,
+        "https://example.org/1",
+        b"<html>" + b"x" * 100 + b"</html>",
+        {"Content-Type": "text/html"},
+    )
+
+    assert landingpage_body(result, "none", 10) is None
+    assert '"final_url": "https://example.org/1"' in landingpage_body(
+        result, "headers", 10
+    )
+    assert landingpage_body(result, "head", 10) == "<html>xxxx"
+    assert landingpage_body(result, "full", 10) == result.text
+
+
+def test_write_responses_segments(app, tmp_path):
+    store = SegmentStore(str(tmp_path))
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        rows = [ResponseBody.make_row(content) for content in ["a" * 100, "b"]]
+        responses = {row["hash"]: row for row in rows}
+
+        bytes_stored = write_responses(db, responses, store)
+        # bodies already stored are skipped
+        assert write_responses(db, dict(responses), store) == 0
+        db.session.commit()
+
+        assert bytes_stored == sum(row["stored_size"] for row in rows)
+        response = db.session.query(ResponseBody).get(rows[0]["hash"])
+        assert response.body is None
+        assert response.read(store) == "a" * 100
+
+
+def test_create_unpaywall_urls_cached(app, stub_server, monkeypatch):
+    monkeypatch.setattr("app.requests.UNPAYWALL_API_URL", stub_server + "/unpaywall/")
+    monkeypatch.setattr(rate_limiter, "per_host_rate", 0)
+    dois = ["10.1234/{0}".format(i) for i in range(5)]
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(db, Doi, [{"doi": doi} for doi in dois])
+
+        result = create_unpaywall_urls()
+        assert result["num_processed"] == 5
+        assert result["num_requests_added"] == 5
+        assert result["num_cached"] == 0
+        # unpaywall:doi, unpaywall:url and unpaywall:pdf, no landing page
+        assert result["num_urls_added"] == 15
+
+        # fresh responses are taken from the cache
+        result = create_unpaywall_urls(refresh=True)
+        assert result["num_processed"] == 5
+        assert result["num_requests_added"] == 0
+        assert result["num_cached"] == 5
+        assert result["num_urls_added"] == 0
+
+
+def test_replay_cache(app, stub_server, monkeypatch):
+    monkeypatch.setattr("app.requests.NCBI_IDCONV_URL", stub_server + "/idconv/")
+    monkeypatch.setattr(rate_limiter, "per_host_rate", 0)
+    dois = ["10.1234/1pmc", "10.1234/2"]
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(db, Doi, [{"doi": doi} for doi in dois])
+        create_ncbi_urls()
+        for row in get_all(db, Doi):
+            row.url_ncbi = False
+        db.session.commit()
+
+        # served from the recorded requests, without network access
+        cache = ReplayCache()
+        monkeypatch.setattr(CacheSettings, "cache", cache)
+        monkeypatch.setattr(CacheSettings, "offline", True)
+        result = create_ncbi_urls()
+
+        assert cache.hits == 1
+        assert result["num_failed"] == 0
+        assert result["num_requests_added"] == 2
+        assert all(doi.url_ncbi for doi in get_all(db, Doi))
+
+
+def test_get_fb_data(app, stub_server, monkeypatch):
+    monkeypatch.setattr("app.requests.FB_GRAPH_URL", stub_server + "/")
+    monkeypatch.setattr(rate_limiter, "per_host_rate", 0)
+    rate_limiter.set_api_limit("fb", 0)
+    monkeypatch.setenv("FB_API_TOKEN", "test-token")
+    monkeypatch.setenv("FB_BATCH_SIZE", "2")
+    urls = ["https://example.org/{0}".format(i) for i in range(4)]
+    urls.append("https://example.org/noeng")
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(db, Doi, [{"doi": "10.1234/1"}])
+        create_entities(db, Url, [{"url": url, "doi": "10.1234/1"} for url in urls])
+
+        result = get_fb_data()
+
+        assert result["num_processed"] == 5
+        assert result["num_fbrequests_added"] == 5
+        assert result["num_partial"] == 1
+        assert result["num_failed"] == 0
+        rows = {row.url: row for row in get_all(db, FBRequest)}
+        assert rows["https://example.org/0"].shares == 2
+        assert rows["https://example.org/noeng"].shares is None
+
+
+def test_get_fb_data_incremental(app, stub_server, monkeypatch):
+    monkeypatch.setattr("app.requests.FB_GRAPH_URL", stub_server + "/")
+    monkeypatch.setattr(rate_limiter, "per_host_rate", 0)
+    rate_limiter.set_api_limit("fb", 0)
+    monkeypatch.setenv("FB_API_TOKEN", "test-token")
+    monkeypatch.setenv("FB_BATCH_SIZE", "2")
+    urls = ["https://example.org/{0}".format(i) for i in range(3)]
+    urls.append("https://example.org/noeng")
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(
+            db,
+            Doi,
+            [
+                {"doi": "10.1234/new", "date_published": datetime.utcnow()},
+                {"doi": "10.1234/old", "date_published": datetime(2010, 1, 1)},
+            ],
+        )
+        create_entities(
+            db,
+            Url,
+            [{"url": urls[0], "doi": "10.1234/old"}]
+            + [{"url": url, "doi": "10.1234/new"} for url in urls[1:]],
+        )
+
+        result = get_fb_data(incremental=True, limit=3)
+        assert result["num_processed"] == 3
+        assert result["num_fbrequests_added"] == 3
+        assert result["num_unchanged"] == 0
+
+        result = get_fb_data(incremental=True)
+        assert result["num_processed"] == 1
+        assert result["num_partial"] == 1
+
+        # nothing due
+        result = get_fb_data(incremental=True)
+        assert result["num_processed"] == 0
+
+        states = {state.url: state for state in get_all(db, FBState)}
+        assert len(states) == 4
+        old, new = states[urls[0]], states[urls[1]]
+        assert new.counts == (1, 2, 3, 4)
+        assert old.next_snapshot_at - old.last_snapshot_at == timedelta(days=90)
+        assert new.next_snapshot_at - new.last_snapshot_at < timedelta(days=1.01)
+
+        for state in states.values():
+            state.next_snapshot_at = datetime(2000, 1, 1)
+        db.session.commit()
+        result = get_fb_data(incremental=True)
+        assert result["num_processed"] == 4
+        assert result["num_fbrequests_added"] == 0
+        assert result["num_unchanged"] == 4
+        assert db.session.query(FBRequest).count() == 4
+        assert db.session.query(FBState).get(urls[1]).num_snapshots == 2
+
+
+def test_snapshot_interval():
+    day = 24 * 3600
+    assert snapshot_interval(None, 0.0, day, 90 * day) == day
+    assert snapshot_interval(timedelta(days=30), 0.0, day, 90 * day) == 2 * day
+    assert snapshot_interval(timedelta(days=300), 10.0, day, 90 * day) == day
+    assert snapshot_interval(timedelta(days=3650), 0.0, day, 90 * day) == 90 * day
@@ -0,0 +1,191 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test export."""
+import gzip
+from datetime import datetime
+from json import loads
+
+import pytest
+
+from app.crud import create_entities
+from app.db import drop_db
+from app.db import get_db
+from app.db import import_basedata
+from app.db import init_db
+from app.export import export_engagement
+from app.export import export_parquet
+from app.models import Doi
+from app.models import FBRequest
+from app.models import Import
+from app.models import Request
+from app.models import Url
+from app.utils import pyarrow
+from app.utils import read_csv_as_dicts
+
+requires_pyarrow = pytest.mark.skipif(pyarrow is None, reason="needs pyarrow")
+
+
+def fill_db(db):
+    create_entities(
+        db,
+        Doi,
+        [
+            {"doi": "10.1234/{0}".format(i), "date_published": datetime(2020, 1, i + 1)}
+            for i in range(5)
+        ],
+    )
+    create_entities(
+        db,
+        Url,
+        [
+            {
+                "url": "https://example.org/{0}".format(i),
+                "doi": "10.1234/{0}".format(i),
+                "url_type": "ojs" if i % 2 else "doi_new",
+            }
+            for i in range(5)
+        ],
+    )
+    create_entities(
+        db,
+        Request,
+        [{"doi": "10.1234/1", "request_type": "unpaywall", "response_status": 200}],
+    )
+    create_entities(db, FBRequest, [{"url": "https://example.org/1", "reactions": 3}])
+
+
+@requires_pyarrow
+def test_export_parquet(app, tmp_path, runner):
+    with app.app_context():
+        drop_db()
+        init_db()
+        fill_db(get_db())
+
+        result = export_parquet(str(tmp_path), batch_size=2)
+
+    assert result == {"dois": 5, "urls": 5, "requests": 1, "fbrequests": 1}
+    assert sorted(path.name for path in (tmp_path / "urls").iterdir()) == [
+        "url_type=doi_new",
+        "url_type=ojs",
+    ]
+    urls = pyarrow.parquet.read_table(
+        str(tmp_path / "urls"), filters=[("url_type", "=", "ojs")]
+    )
+    assert sorted(urls.column("url").to_pylist()) == [
+        "https://example.org/1",
+        "https://example.org/3",
+    ]
+    dois = pyarrow.parquet.read_table(str(tmp_path / "dois"))
+    assert dois.num_rows == 5
+    assert datetime(2020, 1, 1) in dois.column("date_published").to_pylist()
+    fbrequests = pyarrow.parquet.read_table(str(tmp_path / "fbrequests"))
+    assert fbrequests.column("reactions").to_pylist() == [3]
+
+    # exports replace the earlier ones
+    result = runner.invoke(args=["export-parquet", str(tmp_path), "-t", "urls"])
+    assert "5 rows" in result.output
+    urls = pyarrow.parquet.read_table(str(tmp_path / "urls"))
+    assert urls.num_rows == 5
+
+
+@requires_pyarrow
+@pytest.mark.parametrize("extension", [".parquet", ".feather"])
+def test_import_basedata_arrow(app, tmp_path, extension):
+    table = pyarrow.table(
+        {
+            "doi": ["10.1234/1", "10.1234/2", "invalid"],
+            "url": ["https://example.org/1", "https://example.org/2", None],
+            "url_type": ["ojs", "ojs", "ojs"],
+            "date_published": pyarrow.array(
+                [datetime(2020, 1, 1), datetime(2020, 1, 2), None],
+                type=pyarrow.date32(),
+            ),
+        }
+    )
+    filename = str(tmp_path / ("basedata" + extension))
+    if extension == ".parquet":
+        pyarrow.parquet.write_table(table, filename, row_group_size=2)
+    else:
+        pyarrow.feather.write_feather(table, filename)
+
+    with app.app_context():
+        result = import_basedata(filename, reset=True, chunksize=2)
+        doi = get_db().session.query(Doi).get("10.1234/2")
+        assert doi.date_published == datetime(2020, 1, 2)
+
+    assert result["num_dois_added"] == 2
+    assert result["num_urls_added"] == 2
+    assert result["dois_invalid"] == ["invalid"]
+
+
+def test_export_engagement(app, tmp_path, runner):
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        fill_db(db)
+        create_entities(db, Import, [{"source": "api"}])
+        db.session.query(Doi).filter(Doi.doi.in_(["10.1234/3", "10.1234/4"])).update(
+            {"import_id": 1}, synchronize_session=False
+        )
+        create_entities(
+            db,
+            FBRequest,
+            [
+                {"url": "https://example.org/1", "reactions": 5, "shares": 1},
+                {"url": "https://example.org/3", "comments": 2},
+            ],
+        )
+
+        filename = str(tmp_path / "engagement.csv")
+        assert export_engagement(filename, batch_size=2) == 5
+        rows = read_csv_as_dicts(filename)
+        assert [row["doi"] for row in rows] == [
+            "10.1234/{0}".format(i) for i in range(5)
+        ]
+        # the latest request of an URL is exported
+        assert rows[1]["fb_reactions"] == "5"
+        assert rows[1]["fb_shares"] == "1"
+        assert rows[0]["fb_reactions"] == ""
+        assert rows[0]["date_published"] == "2020-01-01T00:00:00"
+
+        filename = str(tmp_path / "engagement.ndjson.gz")
+        num_rows = export_engagement(
+            filename, import_id=1, date_to=datetime(2020, 1, 4), url_types=["ojs"],
+        )
+        with gzip.open(filename, "rt") as f:
+            entries = [loads(line) for line in f]
+        assert num_rows == 1
+        assert entries == [
+            {
+                "doi": "10.1234/3",
+                "date_published": "2020-01-04T00:00:00",
+                "import_id": 1,
+                "url": "https://example.org/3",
+                "url_type": "ojs",
+                "fb_reactions": None,
+                "fb_shares": None,
+                "fb_comments": 2,
+                "fb_plugin_comments": None,
+                "fb_requested_at": entries[0]["fb_requested_at"],
+            }
+        ]
+
+    filename = str(tmp_path / "engagement.jsonl")
+    result = runner.invoke(
+        args=["export", filename, "--from", "2020-01-02", "-u", "doi_new"]
+    )
+    assert "2 rows exported" in result.output
+    with open(filename) as f:
+        assert [loads(line)["doi"] for line in f] == ["10.1234/2", "10.1234/4"]
+
+
+def test_export_parquet_without_pyarrow(runner, tmp_path, monkeypatch):
+    monkeypatch.setattr("app.main.pyarrow", None)
+    result = runner.invoke(args=["export-parquet", str(tmp_path)])
+    assert result.exit_code == 1
+    assert "pip install fhecollector[arrow]" in result.output
+
+    result = runner.invoke(args=["import-basedata", str(tmp_path / "data.parquet")])
+    assert result.exit_code == 1
+    assert "needs the pyarrow package" in result.output
@@ -0,0 +1,79 @@
+# !/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Test pipeline."""
+from app.crud import create_entities
+from app.db import commit_batch
+from app.db import count_pending_dois
+from app.db import drop_db
+from app.db import get_checkpoint
+from app.db import get_db
+from app.db import init_db
+from app.db import iter_pending_dois
+from app.models import Doi
+
+
+def test_checkpoint_resume(app):
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(db, Doi, [{"doi": "10.1234/{0}".format(i)} for i in range(5)])
+
+        checkpoint = get_checkpoint("test")
+        batches = iter_pending_dois(db, "url_doi_new", 2, checkpoint)
+        batch = next(batches)
+        commit_batch(db, checkpoint, batch[-1].doi, len(batch))
+
+        # interrupted run is resumed after the last batch committed
+        checkpoint = get_checkpoint("test")
+        assert checkpoint.batch_num == 1
+        assert [
+            row.doi
+            for batch in iter_pending_dois(db, "url_doi_new", 2, checkpoint)
+            for row in batch
+        ] == ["10.1234/2", "10.1234/3", "10.1234/4"]
+
+        # finished run starts from the beginning
+        checkpoint.finish(db)
+        checkpoint = get_checkpoint("test")
+        assert checkpoint.last_key is None
+        assert checkpoint.batch_num == 0
+
+
+def test_pending_dois(app):
+    with app.app_context():
+        drop_db()
+        init_db()
+        db = get_db()
+        create_entities(
+            db,
+            Doi,
+            [
+                {"doi": "10.1234/0", "url_doi_new": True},
+                {"doi": "10.1234/1", "url_doi_new": False},
+                {"doi": "10.1234/2"},
+            ],
+        )
+
+        assert count_pending_dois("url_doi_new") == 2
+        assert [
+            row.doi
+            for batch in iter_pending_dois(db, "url_doi_new", 10, None)
+            for row in batch
+        ] == ["10.1234/1", "10.1234/2"]
+
+        query = db.session.query(Doi.doi).filter(Doi.pending("url_doi_new"))
+        if db.engine.dialect.name == "sqlite":
+            statement = query.statement.compile(
+                db.engine, compile_kwargs={"literal_binds": True}
+            )
+            plan = db.session.execute("EXPLAIN QUERY PLAN {0}".format(statement))
+            assert "ix_dois_pending_url_doi_new" in str(plan.fetchall())
+
+
+def test_collect_command(runner):
+    result = runner.invoke(
+        args=["collect", "-s", "doi-new", "-s", "doi-old", "-j", "2"]
+    )
+    assert result.exit_code == 0
+    assert "doi-new" in result.output